@@ -19,28 +19,31 @@ can be moved between stacks on the board but cannot enter a players hand. We
 allow you to move the cards that were in your hand at the start of the turn
 freely. This way you can interactively figure out what works and only fully
 commit to placing cards on the board by ending your turn.
+
+Note4: What do we mean by a "joker"?
+If the JOKERS rules option is on, the deck also contains jokers. A joker in a
+stack stands for any card the stack needs -- a missing rank of a flush or a
+missing color of a triplet. A stack can't consist of jokers only. Stacks with
+jokers are validated from the bitmasks of their cards (see
+util.is_valid_layout()), so the possible substitutions are never enumerated.
 """
 
+import profiling # First, so that it knows when the program started
 import pygame
 
+import gamelog
+
 from menu import Menu
 from game import Game
 from config import *
 
 if __name__ == "__main__":
-    pygame.init()
-
-    # Load images
-    deck_img = pygame.image.load(DECK_IMG_FILE)
-    card_imgs = {}
-    for color in COLORS:
-        card_imgs[color] = {}
-        for rank in RANKS:
-            card_imgs[color][rank] = pygame.image.load(
-                CARDS_DIR + "/card_" \
-                + str(((RANKS.index(rank) + 1) % len(RANKS)) + 1) \
-                + "_" + color + ".png"
-            )
+    gamelog.setup()
+
+    # Only the parts of pygame we use. pygame.init() would also initialize
+    # audio, joysticks etc.
+    pygame.display.init()
+    pygame.font.init()
 
     screen = pygame.display.set_mode(SCREEN_SIZE)
     pygame.display.set_caption(WINDOW_CAPTION)
@@ -48,5 +51,22 @@ if __name__ == "__main__":
     menu = Menu(screen)
     gamemode = menu.run()
 
+    # Load images. Not needed by the menu so it's done after it's shown
+    with profiling.timer("startup.load_images"):
+        deck_img = pygame.image.load(DECK_IMG_FILE)
+        card_imgs = {}
+        for color in COLORS:
+            card_imgs[color] = {}
+            for rank in RANKS:
+                card_imgs[color][rank] = pygame.image.load(
+                    CARDS_DIR + "/card_" \
+                    + str(((RANKS.index(rank) + 1) % len(RANKS)) + 1) \
+                    + "_" + color + ".png"
+                )
+        if JOKERS:
+            card_imgs[JOKER] = {
+                JOKER: pygame.image.load(CARDS_DIR + "/" + JOKER_IMG_FILE)
+            }
+
     game = Game(gamemode, screen, deck_img, card_imgs)
     game.run()
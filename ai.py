@@ -4,39 +4,62 @@ AI for the game.
 This file contains the logic behind AI and functions (called from the Game
 class) to
 - Given a state of the game, let the AI generate moves
-- Given moves, print them in human-readable form onto stdout
+- Given moves, log them in human-readable form (see the gamelog module)
 - Given moves and access to the game state, apply the moves
 """
 
+import os
+import time
+import threading
+import logging
 import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from config import *
-from card import Card
+from engine import Position, encode_move, decode_move
+from analysis import Analysis
+import gamelog
+import notation
 import util
+import profiling
+import solver
+
+# Pool of worker processes for search_moves(). Created on first use
+_executor = None
+_executor_lock = threading.Lock()
 
 
 ######################
 # INTERNAL FUNCTIONS #
 ######################
 
-def print_stack_suggestion(stack, *from_stacks):
+def stack_suggestion(stack, *from_stacks):
     """ 
-    Print a suggestion to create a new stack. Optionally specify that some of
-    the cards should be taken from existing stacks.
+    Return a suggestion to create a new stack. Optionally specify that some
+    of the cards should be taken from existing stacks.
     """
-    print("Suggested move: Put a new stack " +
-          f"{util.stack_to_string(stack)} on the board")
+    text = "Suggested move: Put a new stack " + \
+        f"{util.stack_to_string(stack)} on the board"
     if from_stacks:
-        print("Use cards from stacks " +
-              f'{"; ".join([util.stack_to_string(s) for s in from_stacks])}')
+        text += "\nUse cards from stacks " + \
+            f'{"; ".join([util.stack_to_string(s) for s in from_stacks])}'
+    return text
 
-def print_card_suggestion(card, stack):
+def card_suggestion(card, stack):
     """
-    Print a suggestion to add a card from hand to a stack.
+    Return a suggestion to add a card from hand to a stack.
     """
-    print("Suggested move: Add card " +
-          f"{util.card_to_string(card)} to " +
-          f"the stack {util.stack_to_string(stack)}")
+    return "Suggested move: Add card " + \
+        f"{util.card_to_string(card)} to " + \
+        f"the stack {util.stack_to_string(stack)}"
+
+def rearrangement_suggestion(*stacks):
+    """
+    Return a suggestion to rearrange the board into the given stacks.
+    """
+    return "Suggested move: Rearrange the board into stacks " + \
+        f'{"; ".join([util.stack_to_string(s) for s in stacks])}'
 
 def get_subsets(x, n):
     """
@@ -51,18 +74,165 @@ def get_big_stacks(stacks):
     """
     return set([s for s in stacks if len(s) >= 4])
 
+@profiling.counted("ai.is_valid_stack")
 def is_valid_stack(cards):
-    foo = util.attempt_construct_valid_stack(cards)
-    return not (foo is None or None in foo)
+    return util.is_valid_stack(cards)
 
 def is_full_stack(stack):
     return len(stack) >= len(RANKS)
 
+def analyze(position, analysis=None):
+    """
+    Return the analysis (see the analysis module) to be used for the given
+    position. A given analysis is brought up to date with the position,
+    otherwise the position is analyzed from scratch.
+    """
+    if analysis is None:
+        analysis = Analysis()
+    analysis.update(position.hand, position.stacks)
+    return analysis
+
+def move_with_big_stack(position, analysis, big_stacks):
+    """
+    Return a move forming a new stack from 2 cards from hand and an end of a
+    big stack or None if there isn't any.
+    """
+    for big_stack in big_stacks:
+        for end in set([big_stack[0], big_stack[-1]]):
+            for duplet in analysis.pairs_with(end, position.hand):
+                return ("form new stack", duplet + (end,), big_stack)
+    return None
+
+def move_with_big_stacks(position, analysis, big_stacks):
+    """
+    Return a move forming a new stack from 1 card from hand and ends of 2 big
+    stacks or None if there isn't any.
+    """
+    for big_stack1, big_stack2 in get_subsets(big_stacks, 2):
+        for end1 in (big_stack1[0], big_stack1[-1]):
+            for end2 in (big_stack2[0], big_stack2[-1]):
+                for card in analysis.cards_with((end1, end2), position.hand):
+                    return ("form new stack", (end1, end2, card), big_stack1,
+                            big_stack2)
+    return None
+
+def root_moves(position, analysis=None):
+    """
+    Return a list of all moves the greedy algorithm (see greedy_moves()) can
+    consider as the first move of a turn in the given position (class
+    Position). That is forming a new stack from 3 cards from hand, from 2
+    cards from hand and an end of a big stack, from 1 card from hand and ends
+    of 2 big stacks and adding a card from hand to a stack.
+
+    'analysis' is an up-to-date analysis of the position (see analyze()),
+    by default the position is analyzed from scratch.
+    """
+    if analysis is None:
+        analysis = analyze(position)
+    moves = []
+    hand = position.hand
+    big_stacks = get_big_stacks(position.stacks)
+
+    for triplet in analysis.triplets(hand):
+        moves.append(("form new stack", triplet))
+
+    for big_stack in big_stacks:
+        for end in set([big_stack[0], big_stack[-1]]):
+            for duplet in analysis.pairs_with(end, hand):
+                moves.append(("form new stack", duplet + (end,), big_stack))
+    for big_stack1, big_stack2 in get_subsets(big_stacks, 2):
+        for end1 in (big_stack1[0], big_stack1[-1]):
+            for end2 in (big_stack2[0], big_stack2[-1]):
+                for card in analysis.cards_with((end1, end2), hand):
+                    moves.append(("form new stack", (end1, end2, card),
+                                  big_stack1, big_stack2))
+
+    for stack in position.stacks:
+        for code in analysis.accepted_codes(stack):
+            for card in analysis.cards_with_code(code, hand):
+                moves.append(("add card to stack", card, stack))
+
+    return moves
+
+def best_continuation(position, first_moves, analysis=None):
+    """
+    For each of the given first moves, apply it to the position and let the
+    greedy algorithm continue. Return the best result as a tuple (number of
+    cards placed from hand, moves). The position is left unchanged.
+
+    'analysis' is an up-to-date analysis of the position (see analyze()).
+    """
+    if analysis is None:
+        analysis = analyze(position)
+    best = (0, [])
+    hand_size = len(position.hand)
+    for move in first_moves:
+        if not position.apply(move):
+            continue
+        moves = [move] + greedy_moves(position, analysis)
+        placed = hand_size - len(position.hand)
+        if placed > best[0]:
+            best = (placed, moves)
+        position.undo_to(0)
+    return best
+
+def _search_worker(data, first_moves):
+    """
+    Run best_continuation() in a worker process. Both the position and the
+    moves come serialized (see Position.serialize() and encode_move()).
+    """
+    position, cards = Position.deserialize(data)
+    first_moves = [decode_move(m, cards) for m in first_moves]
+    placed, moves = best_continuation(position, first_moves)
+    return placed, [encode_move(m, cards) for m in moves]
+
+def solver_moves(position, placed, time_limit=SOLVER_TIME_LIMIT):
+    """
+    Let the exact solver (see the solver module) rearrange the whole board.
+    Return a list with a single "rearrange board" move if the solver places
+    more than 'placed' cards from hand within the time limit, otherwise None.
+    The solver doesn't know jokers, so with them it's never used.
+    """
+    if JOKERS:
+        return None
+    board = [card for stack in position.stacks for card in stack]
+    result = solver.solve(board, position.hand, at_least=placed + 1,
+                          time_limit=time_limit)
+    if result is None:
+        return None
+    stacks, value = result
+    return [("rearrange board",) + tuple(stacks)]
+
+def _num_workers():
+    return AI_SEARCH_WORKERS if AI_SEARCH_WORKERS else os.cpu_count()
+
+def _get_executor():
+    """
+    Return the pool of worker processes. Hints and pondering (see ponder.py)
+    search from other threads, so only one of them may create the pool.
+
+    The pool is created lazily, when other threads (the log listener, pygame,
+    the hint or ponder thread) are already running. Forking the process then
+    could copy a lock held by one of them and deadlock the worker, so the
+    workers are started by a fork server (or spawned where there's none).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            else:
+                context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(max_workers=_num_workers(),
+                                            mp_context=context)
+    return _executor
+
 
 ##########
 # AI API #
 ##########
 
+@profiling.timed("ai.generate_moves")
 def generate_moves(game):
     """
     Given the state of the game, let the AI generate moves it thinks will get
@@ -75,21 +245,22 @@ def generate_moves(game):
     [
         ("add card to stack", card_from_hand, stack),
         ("form new stack", new_stack[, stack1, stack2]),
+        ("rearrange board", stack1, stack2, ...),
         ...
     ]
     Each item in the list is a move and each move is either adding a card from
-    the hand to a stack or forming a new stack. The latter type of move may
-    contain up to two additional items specifying stacks from which (beside the
-    hand) to pull cards from.
+    the hand to a stack, forming a new stack or rearranging the whole board.
+    Forming a new stack may contain up to two additional items specifying
+    stacks from which (beside the hand) to pull cards from. Rearranging the
+    board lists all stacks the board should consist of afterwards.
 
     In the move representation stacks are represented as tuples of cards.
     """
 
-    result_moves = []
-
     # The AI doesn't manipulate widgets. It makes its own (simpler)
     # representation of the game state and works with that (stacks are tuples,
-    # the hand is a set and stacks on board are also represented by a set)
+    # the hand is a set and stacks on board are also represented by a set).
+    # See the Position class in the engine module.
     #
     # We represent stacks only by tuples, not lists. This is done so that the
     # stacks put into result_moves don't change later. This also helps because
@@ -100,13 +271,62 @@ def generate_moves(game):
     # and therefore may occur twice in the hand. However, this game actually
     # represent each occurence of the same card as a different object.
 
-    hand, stacks = game.get_state_copy()
+    return plan_moves(Position.from_game(game))
+
+def plan_moves(position, analysis=None):
+    """
+    Generate moves for the given position (class Position) the way
+    generate_moves() does. The position is left unchanged.
+
+    'analysis' is an analysis kept from the previous turns (see analyze()),
+    it's brought up to date with the position.
+    """
+    num_applied = position.num_applied()
+    analysis = analyze(position, analysis)
+    if AI_SEARCH:
+        moves = search_moves(position, analysis)
+    else:
+        moves = greedy_moves(position, analysis)
+        position.undo_to(num_applied)
+
+    if AI_SOLVER:
+        # The solver is exact but it may run out of time. Use it only if it
+        # beats the moves found above
+        placed = len(position.hand)
+        for move in moves:
+            if not position.apply(move):
+                break
+        placed -= len(position.hand)
+        position.undo_to(num_applied)
+        better_moves = solver_moves(position, placed)
+        if better_moves is not None:
+            return better_moves
+    return moves
+
+def greedy_moves(position, analysis=None):
+    """
+    Generate moves for the given position (class Position) the way
+    generate_moves() does. The moves are applied to the position as they are
+    found, so the caller can take them back using Position.undo_to().
+
+    'analysis' is an up-to-date analysis (see analyze()) of the position or
+    of a position it was reached from during the turn. By default the
+    position is analyzed from scratch.
+    """
+    return list(iter_greedy_moves(position, analysis))
 
-    # Sort the stacks
-    foo = set()
-    for stack in stacks:
-        foo.add(util.sorted_by_flush(stack))
-    stacks = foo
+def iter_greedy_moves(position, analysis=None):
+    """
+    Generator variant of greedy_moves(). Each move is yielded as soon as it
+    is applied to the position, so the caller can start making it (or stop
+    early, see bounded_moves()) before the rest of the turn is found. If the
+    position rejects a move, the generator stops without yielding it, so the
+    yielded moves are always the moves applied.
+    """
+    if analysis is None:
+        analysis = analyze(position)
+    hand = position.hand
+    stacks = position.stacks
 
     # Get big stacks (stacks of 4 cards or more)
     big_stacks = get_big_stacks(stacks)
@@ -115,210 +335,312 @@ def generate_moves(game):
 
     # 1a) Try to create stacks where all 3 cards are from hand
 
-    # Generate triplets. If one of them is valid, remove its cards from hand
-    # and generate new triplets which won't contain the removed cards. Do this
-    # until no valid triplet is found in hand.
-    found_a_move = True
-    while found_a_move:
-        found_a_move = False
-
-        triplets = get_subsets(hand, 3)
-        for triplet in triplets:
-            if found_a_move:
-                break
-
-            if is_valid_stack(triplet):
+    # Go through the valid triplets of the analysis and apply each one whose
+    # cards weren't used by the previously applied triplets.
+    with profiling.timer("ai.generate_moves.1a"):
+        for triplet in analysis.triplets(hand):
+            if all([card in hand for card in triplet]):
                 # Found a valid move!
                 move = ("form new stack", triplet)
-                result_moves.append(move)
-                hand -= set(triplet)
-                stacks.add(util.sorted_by_flush(triplet))
-                found_a_move = True
+                if not position.apply(move):
+                    return
+                yield move
 
     # 1b) Try to create stacks where 2 cards are from hand and 1 is from a big
     # stack
 
-    # Use the same strategy as for 1a but this time use the cartesian product
-    # of duplets of cards from hand and big stacks. For each (card1, card2,
-    # stack) tuple generate two new stacks (take the first OR the last card of
-    # the big stack).
-    found_a_move = True
-    while found_a_move:
-        found_a_move = False
-
-        card_duplets = get_subsets(hand, 2)
-        for card_duplet in card_duplets:
-            if found_a_move:
-                break
-
-            for big_stack in big_stacks:
-                if found_a_move:
-                    break
-
-                stack1 = card_duplet + (big_stack[0],)
-                stack2 = card_duplet + (big_stack[-1],)
-
-                for stack in (stack1, stack2):
-                    if found_a_move:
-                        break
-
-                    if is_valid_stack(stack):
-                        # Found a valid move!
-                        move = ("form new stack", stack, big_stack)
-                        result_moves.append(move)
-                        hand -= set(card_duplet)
-                        stacks.add(util.sorted_by_flush(stack))
-                        if stack == stack1:
-                            stacks.remove(big_stack)
-                            stacks.add(big_stack[1:])
-                        else:
-                            stacks.remove(big_stack)
-                            stacks.add(big_stack[:-1])
-                        # We modified stacks set so we recompute big stacks set
-                        big_stacks = get_big_stacks(stacks)
-                        found_a_move = True
+    # For the first or the last card of each big stack, ask the analysis for
+    # duplets of cards from hand forming a stack with it. Apply the first one
+    # found and start over until there are none.
+    with profiling.timer("ai.generate_moves.1b"):
+        move = move_with_big_stack(position, analysis, big_stacks)
+        while move is not None:
+            if not position.apply(move):
+                return
+            yield move
+            # We modified stacks so we recompute big stacks
+            big_stacks = get_big_stacks(stacks)
+            move = move_with_big_stack(position, analysis, big_stacks)
 
     # 1c) Try to create stacks where 1 card is from hand and 2 cards are from
     # big stacks
 
-    # Use the same strategy as for 1b but the cartesian product is now (card,
-    # stack1, stack2) and we generate four possible new stacks.
-    found_a_move = True
-    while found_a_move:
-        found_a_move = False
-
-        # Copy hand so that we don't get into trouble with deleting from
-        # hand while iterating over it
-        hand_copy = set([c for c in hand])
-
-        stack_duplets = get_subsets(big_stacks, 2)
-        for stack_duplet in stack_duplets:
-            if found_a_move:
-                break
-
-            for card in hand_copy:
-                if found_a_move:
-                    break
-
-                big_stack1 = stack_duplet[0]
-                big_stack2 = stack_duplet[1]
-
-                stack1 = (big_stack1[0], big_stack2[0], card)
-                stack2 = (big_stack1[0], big_stack2[-1], card)
-                stack3 = (big_stack1[-1], big_stack2[0], card)
-                stack4 = (big_stack1[-1], big_stack2[-1], card)
-
-                for stack in (stack1, stack2, stack3, stack4):
-                    if found_a_move:
-                        break
-
-                    if is_valid_stack(stack):
-                        # Found a valid move!
-                        move = ("form new stack", stack, big_stack1,
-                                big_stack2)
-                        result_moves.append(move)
-                        hand.remove(card)
-                        stacks.add(util.sorted_by_flush(stack))
-                        if stack == stack1:
-                            stacks.remove(big_stack1)
-                            stacks.add(big_stack1[1:])
-                            stacks.remove(big_stack2)
-                            stacks.add(big_stack2[1:])
-                        elif stack == stack2:
-                            stacks.remove(big_stack1)
-                            stacks.add(big_stack1[1:])
-                            stacks.remove(big_stack2)
-                            stacks.add(big_stack2[:-1])
-                        elif stack == stack3:
-                            stacks.remove(big_stack1)
-                            stacks.add(big_stack1[:-1])
-                            stacks.remove(big_stack2)
-                            stacks.add(big_stack2[1:])
-                        else:
-                            stacks.remove(big_stack1)
-                            stacks.add(big_stack1[:-1])
-                            stacks.remove(big_stack2)
-                            stacks.add(big_stack2[:-1])
-                        # We modified stacks set so we recompute big stacks set
-                        big_stacks = get_big_stacks(stacks)
-                        found_a_move = True
+    # Use the same strategy as for 1b but for each pair of ends of two big
+    # stacks ask for cards from hand completing them.
+    with profiling.timer("ai.generate_moves.1c"):
+        move = move_with_big_stacks(position, analysis, big_stacks)
+        while move is not None:
+            if not position.apply(move):
+                return
+            yield move
+            # We modified stacks so we recompute big stacks
+            big_stacks = get_big_stacks(stacks)
+            move = move_with_big_stacks(position, analysis, big_stacks)
 
     # 2) Try to add cards from hand to existing stacks
 
     # Try visiting stacks and seeing if any of the cards from hand could be
-    # added to them. Keep unvisited stacks in worklist. If a card gets added to
-    # a stack, add the stack back to the worklist so that we can check if
-    # perhaps another card can be added to it.
-
-    worklist = [s for s in stacks]
-    while worklist:
-        stack = worklist.pop()
+    # added to them (see Analysis.accepted_codes()). Keep unvisited stacks in
+    # worklist. If a card gets added to a stack, add the stack back to the
+    # worklist so that we can check if perhaps another card can be added to
+    # it.
+    with profiling.timer("ai.generate_moves.2"):
+        worklist = [s for s in stacks]
+        while worklist:
+            stack = worklist.pop()
+
+            # Ask the free-card index of the analysis for the cards the stack
+            # accepts
+            for code in analysis.accepted_codes(stack):
+                cards = analysis.cards_with_code(code, hand)
+                if cards:
+                    # Found a valid move!
+                    move = ("add card to stack", cards[0], stack)
+                    if not position.apply(move):
+                        return
+                    yield move
+                    worklist.append(util.sorted_by_flush(stack + (cards[0],)))
+                    break
 
-        if is_full_stack(stack):
-            continue
+def bounded_moves(moves, max_moves=None, deadline=None):
+    """
+    Yield moves from the given iterable (e.g. iter_greedy_moves()) until
+    'max_moves' of them are yielded or time.perf_counter() passes the
+    deadline. None means no limit. Every prefix of a turn can be played, so
+    the moves yielded so far are always a valid turn.
+    """
+    for i, move in enumerate(moves):
+        if max_moves is not None and i >= max_moves:
+            return
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+        yield move
+
+@profiling.timed("ai.search_moves")
+def search_moves(position, analysis=None):
+    """
+    Generate moves for the given position (class Position) by trying every
+    first move greedy_moves() could make (see root_moves()) and continuing
+    greedily from it. Return the moves placing the most cards from hand.
+
+    The first moves are split among processes of a process pool (see the
+    AI_SEARCH_WORKERS config constant). Each process gets the position
+    serialized and returns its best continuation. 'analysis' is an
+    up-to-date analysis of the position (see analyze()) used in this
+    process.
+    """
+    if analysis is None:
+        analysis = analyze(position)
+    first_moves = root_moves(position, analysis)
+    workers = _num_workers()
+
+    if workers <= 1 or len(first_moves) < AI_SEARCH_MIN_PARALLEL_MOVES:
+        return best_continuation(position, first_moves, analysis)[1]
+
+    executor = _get_executor()
+    data, cards = position.serialize()
+    futures = []
+    for i in range(workers):
+        chunk = [encode_move(m, cards) for m in first_moves[i::workers]]
+        if chunk:
+            futures.append(executor.submit(_search_worker, data, chunk))
+
+    best = (0, [])
+    for future in futures:
+        result = future.result()
+        if result[0] > best[0]:
+            best = result
+    return [decode_move(m, cards) for m in best[1]]
+
+def log_move(move):
+    """
+    Log a single move outputed by generate_moves() in a human-readable form.
+    The event "move" has the move in the position notation (see the notation
+    module). Nothing is built if the moves logger is silenced.
+    """
+    if not gamelog.moves_logger.isEnabledFor(logging.INFO):
+        return
+    if move[0] == "add card to stack":
+        text = card_suggestion(*move[1:])
+    elif move[0] == "rearrange board":
+        text = rearrangement_suggestion(*move[1:])
+    else:
+        text = stack_suggestion(*move[1:])
+    gamelog.moves_logger.info(text, extra={"event": {
+        "event": "move",
+        "kind": move[0],
+        "move": notation.move_to_text(move),
+    }})
+
+def log_end_turn():
+    gamelog.event(gamelog.moves_logger, logging.INFO, "end_turn",
+                  "Suggested move: End turn")
+
+def log_moves(moves):
+    """
+    Given moves outputed by generate_moves(), log them in a human-readable
+    form.
+    """
+    for move in moves:
+        log_move(move)
+    log_end_turn()
 
-        for card in hand:
-            new_stack = stack + (card,)
+def apply_move(move, game):
+    """
+    Given a single move outputed by generate_moves(), make the move!
 
-            if is_valid_stack(new_stack):
-                # Found a valid move!
-                move = ("add card to stack", card, stack)
-                result_moves.append(move)
-                stacks.remove(stack)
-                new_stack = util.sorted_by_flush(new_stack)
-                stacks.add(new_stack)
-                hand.remove(card)
-                worklist.append(new_stack)
-                break
+    Returns True on success, otherwise False. On failure the game may be left
+    in the middle of the move.
+    """
+    if move[0] == "add card to stack":
+        card = move[1]
+        stack = game.find_stack_containing_cards(move[2])
+        if stack is None:
+            return False
+        return game.try_take_card_from_hand(card) \
+            and game.try_put_card_onto_stack(stack)
+    elif move[0] == "rearrange board":
+        return apply_rearrangement(move[1:], game)
+    else: # Form new stack
+        cards = move[1]
+        new_stack = game.get_random_empty_stack()
+        if new_stack is None:
+            return False
+
+        from_stacks = []
+        for stack in move[2:]:
+            stack = game.find_stack_containing_cards(stack)
+            if stack is None:
+                return False
+            from_stacks.append(stack)
+
+        for card in cards:
+            # Try to find the card first in hand then in the stacks
+            taken = game.try_take_card_from_hand(card)
+            for stack in from_stacks:
+                if taken:
+                    break
+                taken = game.try_take_card_from_stack(card, stack)
+            if not taken or not game.try_put_card_onto_stack(new_stack):
+                return False
+        return True
 
-    return result_moves
+def apply_rearrangement(stacks, game):
+    """
+    Move cards so that the board consists of the given stacks (see the
+    "rearrange board" move). Each stack gets the Stack widget already holding
+    most of its cards so that as few cards as possible have to be moved.
 
-def print_moves(moves):
+    Returns True on success, otherwise False. On failure the game may be left
+    in the middle of the move.
+    """
+    location = {} # Card -> Stack widget it lies in
+    for widget in game.stacks:
+        for card in widget.get_state_copy():
+            location[card] = widget
+
+    # Assign widgets to stacks, bigger stacks choose first
+    targets = {} # index of a stack -> Stack widget
+    free = list(game.stacks)
+    order = sorted(range(len(stacks)), key=lambda i: -len(stacks[i]))
+    for i in order:
+        overlaps = [sum([location.get(c) is w for c in stacks[i]])
+                    for w in free]
+        best = max(range(len(free)), key=lambda j: overlaps[j], default=None)
+        if best is not None and overlaps[best]:
+            targets[i] = free.pop(best)
+    for i in order:
+        if i in targets:
+            continue
+        if not free:
+            return False
+        # Prefer empty widgets, the others are going to be emptied
+        free.sort(key=lambda w: not w.is_empty())
+        targets[i] = free.pop(0)
+
+    for i, stack in enumerate(stacks):
+        target = targets[i]
+        for card in stack:
+            source = location.get(card)
+            if source is target:
+                continue
+            if source is None:
+                taken = game.try_take_card_from_hand(card)
+            else:
+                taken = game.try_take_card_from_stack(card, source)
+            if not taken or not game.try_put_card_onto_stack(target):
+                return False
+            location[card] = target
+    return True
+
+def validate_moves(moves, game):
     """
-    Given moves outputed by generate_moves(), print them onto stdout in a
-    human-reasable form.
+    Check that the moves (see generate_moves()) can be made one after another
+    in the current state of the game without touching it. The moves are
+    applied to a Position of the game instead.
     """
-
+    position = Position.from_game(game)
     for move in moves:
-        if move[0] == "add card to stack":
-            print_card_suggestion(*move[1:])
-        else:
-            print_stack_suggestion(*move[1:])
-    print("Suggested move: End turn")
+        if not position.apply(move):
+            return False
+    return True
 
+@profiling.timed("ai.apply_moves")
 def apply_moves(moves, game):
     """
     Given moves outputed by generate_moves(), make the moves!
+
+    The moves are validated first (see validate_moves()) and then made as one
+    transaction which tells the game about the changes (see
+    GameLogic.begin_transaction()) only once, when all of them are made. If
+    any of them fails, report it and take back all of them. The turn then
+    ends with drawing a card.
     """
+    moves = list(moves)
+    if not validate_moves(moves, game):
+        gamelog.event(gamelog.ai_logger, logging.WARNING, "moves_invalid",
+                      "AI moves are invalid, not making them")
+    else:
+        game.begin_transaction(defer_changes=True)
+        for move in moves:
+            if not apply_move(move, game):
+                _log_move_failed(move)
+                game.rollback_transaction()
+                break
+        else:
+            game.commit_transaction()
 
-    # TODO Když něco selže, ohlaš to a nespadni
+    game.try_end_turn()
 
+def iter_apply_moves(moves, game, verbose=False):
+    """
+    Generator variant of apply_moves(). 'moves' may be any iterable, e.g. a
+    generator of moves being found (see iter_greedy_moves()), so they can't
+    be validated in advance. Each move is yielded after it is made, so the
+    caller can show the game in between -- the game is told about the changes
+    once per move, not once per moved card. The turn ends once the generator
+    is exhausted. If 'verbose' is True, the moves are logged as they are
+    made (see log_move()).
+    """
+    game.begin_transaction(defer_changes=True)
     for move in moves:
-        if move[0] == "add card to stack":
-            card = move[1]
-            stack = game.find_stack_containing_cards(move[2])
-            game.try_take_card_from_hand(card)
-            game.try_put_card_onto_stack(stack)
-        else: # Form new stack
-            cards = move[1]
-            new_stack = game.get_random_empty_stack()
-
-            stack1 = None
-            stack2 = None
-            if len(move) >= 3:
-                stack1 = game.find_stack_containing_cards(move[2])
-            if len(move) >= 4:
-                stack2 = game.find_stack_containing_cards(move[3])
-
-            for card in cards:
-                # Try to find the card first in hand then in stack1 then in
-                # stack2
-                if not game.try_take_card_from_hand(card) \
-                        and not stack1 is None:
-                    if not game.try_take_card_from_stack(card, stack1) \
-                            and not stack2 is None:
-                        game.try_take_card_from_stack(card, stack2)
-
-                game.try_put_card_onto_stack(new_stack)
+        if verbose:
+            log_move(move)
+        if not apply_move(move, game):
+            _log_move_failed(move)
+            game.rollback_transaction()
+            break
+        game.flush_changes()
+        yield move
+    else:
+        game.commit_transaction()
+        if verbose:
+            log_end_turn()
 
     game.try_end_turn()
+
+def _log_move_failed(move):
+    if gamelog.ai_logger.isEnabledFor(logging.WARNING):
+        gamelog.event(gamelog.ai_logger, logging.WARNING, "move_failed",
+                      "AI move failed, taking back all moves of this turn",
+                      move=notation.move_to_text(move))
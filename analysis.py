@@ -0,0 +1,167 @@
+"""
+Incremental analysis of positions
+
+This file contains the part of the greedy AI's work (see ai.iter_greedy_moves())
+which doesn't have to be redone every turn. Between two turns of the same
+player the board usually changes by a few stacks and the hand by a card or
+two, so an Analysis is kept by the strategy (see the strategies module) and
+only the difference of the positions is applied to it:
+
+- free-card index ... cards in hand by their codes (see util.card_code())
+- candidate stacks ... all valid stacks of three cards from hand. A card
+  entering the hand is tried only with the cards that can share a stack with
+  it (the same color at most two ranks away or the same rank), so it costs
+  O(1) checks instead of enumerating all subsets of the hand again
+- accepting sets ... util.accepted_codes() of every stack on the board
+
+The analysis of a position is also valid for every position reached from it
+during the turn -- moves only take cards from the hand. Cards which already
+left the hand are filtered out by the users of the analysis.
+"""
+
+import functools
+import itertools
+
+from config import *
+import util
+
+
+@functools.lru_cache(maxsize=None)
+def partner_codes(code):
+    """
+    Return a tuple of codes (see util.card_code()) of cards which can form a
+    valid stack of three cards with the card of the given code. For a joker
+    (see Note4 in __main__.py) that's every code.
+    """
+    if code == util.JOKER_CODE:
+        return tuple(range(util.JOKER_CODE + 1))
+    color, rank = divmod(code, len(RANKS))
+    codes = set()
+    for d in (-2, -1, 1, 2):
+        codes.add(color * len(RANKS) + (rank + d) % len(RANKS))
+    for other in range(len(COLORS)):
+        if other != color:
+            codes.add(other * len(RANKS) + rank)
+    if JOKERS:
+        codes.add(util.JOKER_CODE)
+    return tuple(sorted(codes))
+
+
+class Analysis:
+    def __init__(self):
+        self.hand = set() # The analyzed hand
+        self.stacks = set() # The analyzed stacks
+        self._by_code = {} # Code -> set of cards in hand (free-card index)
+        self._triplets = set() # Valid stacks (tuples) of three cards in hand
+        self._triplets_of = {} # Card in hand -> set of its valid triplets
+        self._accepted = {} # Stack on the board -> util.accepted_codes()
+        self._scratch = {} # The same for stacks made during the turn
+
+        # Number of cards and stacks which entered or left the analysis in
+        # the last call of update()
+        self.num_changes = 0
+
+    def update(self, hand, stacks):
+        """
+        Bring the analysis up to date with the given hand (set of Cards) and
+        stacks (set of stacks normalized by engine.normalize_stack()) by
+        applying their difference from the analyzed ones.
+        """
+        left = self.hand - hand
+        entered = hand - self.hand
+        removed = self.stacks - stacks
+        added = stacks - self.stacks
+        for card in left:
+            self._remove_card(card)
+        for card in entered:
+            self._add_card(card)
+        for stack in removed:
+            del self._accepted[stack]
+            self.stacks.remove(stack)
+        for stack in added:
+            codes = self._scratch.get(stack)
+            if codes is None:
+                codes = util.accepted_codes(stack)
+            self._accepted[stack] = codes
+            self.stacks.add(stack)
+        self._scratch.clear()
+        self.num_changes = len(left) + len(entered) + len(removed) + len(added)
+
+    def triplets(self, hand):
+        """
+        Return a list of the valid stacks of three cards from the given hand,
+        which has to be a subset of the analyzed hand.
+        """
+        return [t for t in self._triplets
+                if t[0] in hand and t[1] in hand and t[2] in hand]
+
+    def pairs_with(self, card, hand):
+        """
+        Return a list of pairs (tuples) of cards from the given hand (a subset
+        of the analyzed hand) which form a valid stack with the given card.
+        """
+        partners = [c for c in self._partners(card) if c in hand]
+        return [(a, b) for a, b in itertools.combinations(partners, 2)
+                if util.is_valid_stack((a, b, card))]
+
+    def cards_with(self, cards, hand):
+        """
+        Return a list of cards from the given hand (a subset of the analyzed
+        hand) which form a valid stack with the given cards (a tuple).
+        """
+        return [c for c in self._partners(cards[0])
+                if c in hand and util.is_valid_stack(cards + (c,))]
+
+    def cards_with_code(self, code, hand):
+        """
+        Return a list of cards from the given hand (a subset of the analyzed
+        hand) with the given code.
+        """
+        return [c for c in self._by_code.get(code, ()) if c in hand]
+
+    def accepted_codes(self, stack):
+        """
+        Return util.accepted_codes() of the stack (sorted by
+        util.sorted_by_flush()). Stacks of the analyzed board are answered
+        from the analysis, the others are remembered until the next update().
+        """
+        codes = self._accepted.get(stack)
+        if codes is None:
+            codes = self._scratch.get(stack)
+        if codes is None:
+            codes = util.accepted_codes(stack)
+            self._scratch[stack] = codes
+        return codes
+
+    def _partners(self, card):
+        """
+        Return a list of the analyzed cards in hand which can share a stack
+        of three cards with the given card (see partner_codes()).
+        """
+        partners = []
+        for code in partner_codes(util.card_code(card)):
+            for other in self._by_code.get(code, ()):
+                if other is not card:
+                    partners.append(other)
+        return partners
+
+    def _add_card(self, card):
+        triplets = set()
+        for a, b in self.pairs_with(card, self.hand):
+            triplet = (a, b, card)
+            triplets.add(triplet)
+            self._triplets_of[a].add(triplet)
+            self._triplets_of[b].add(triplet)
+        self._triplets |= triplets
+        self._triplets_of[card] = triplets
+        self._by_code.setdefault(util.card_code(card), set()).add(card)
+        self.hand.add(card)
+
+    def _remove_card(self, card):
+        for triplet in self._triplets_of.pop(card):
+            self._triplets.discard(triplet)
+            for other in triplet:
+                if other is not card:
+                    self._triplets_of[other].discard(triplet)
+        self._by_code[util.card_code(card)].discard(card)
+        self.hand.remove(card)
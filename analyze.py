@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+Headless position analysis
+
+This file reads positions in the text notation (see notation.py), one per
+line, lets an AI strategy (see the strategies module) choose the moves of the
+player on turn and streams the moves out as soon as each position is
+analyzed. It doesn't need pygame, so it can be used to bulk-analyze positions
+from logs and bug reports.
+
+Each output line is tab separated: the number of the input line, the
+milliseconds the strategy spent and the moves in the notation. Blank lines
+and lines starting with "#" are skipped, invalid positions are reported on
+stderr.
+
+Usage: python3 analyze.py [-h] [-a STRATEGY] [-t TIME_BUDGET] [file]
+"""
+
+import sys
+import argparse
+
+from config import *
+from strategies import STRATEGIES, make_strategy
+import notation
+
+def analyze(lines, strategy):
+    """
+    Analyze positions given by lines of text using the strategy. Yields
+    tuples (line number, milliseconds, moves) or (line number, None, error
+    message) for invalid positions.
+    """
+    for i, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            match = notation.match_from_text(line)
+        except ValueError as e:
+            yield i, None, str(e)
+            continue
+        moves = strategy.choose_moves(match)
+        yield i, strategy.stats["seconds"] * 1000, moves
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="Let the AI play positions given in text notation.")
+    parser.add_argument("file", nargs="?", type=argparse.FileType("r"),
+                        default=sys.stdin,
+                        help="file with one position per line "
+                             + "(default: stdin)")
+    parser.add_argument("-a", "--strategy", default=AI_SEAT_STRATEGIES[0],
+                        choices=list(STRATEGIES),
+                        help="the AI strategy")
+    parser.add_argument("-t", "--time-budget", type=float, default=None,
+                        help="seconds per position for strategies which "
+                             + "take it")
+    args = parser.parse_args()
+
+    strategy = make_strategy(args.strategy, time_budget=args.time_budget)
+    for i, ms, result in analyze(args.file, strategy):
+        if ms is None:
+            print(f"line {i}: {result}", file=sys.stderr)
+            continue
+        print(f"{i}\t{ms:.1f}\t{notation.moves_to_text(result)}", flush=True)
@@ -0,0 +1,119 @@
+"""
+Batch validity checking
+
+This file contains NumPy versions of the stack validity checks from the util
+module working on many candidate stacks at once, e.g. for simulators
+validating thousands of stacks. Candidates are encoded as rows of a 2D array
+of card codes (see util.card_code(), jokers are util.JOKER_CODE). Rows
+shorter than the array are padded by -1.
+
+A flush is recognized by the bitmask of its ranks. The number of missing cards
+(gaps) of every one of the 2^13 masks is precomputed using a table of cyclic
+rotations of the masks.
+"""
+
+import itertools
+import functools
+import numpy as np
+
+from config import *
+import util
+
+NUM_RANKS = len(RANKS)
+ALL_RANKS_MASK = (1 << NUM_RANKS) - 1
+
+def _make_tables():
+    """
+    Return a tuple (
+        ROTATIONS ... ROTATIONS[r, mask] is the mask rotated by r ranks down
+        GAPS ... GAPS[mask] is the smallest number of missing cards needed to
+                 turn the ranks of the mask into a cyclic sequence
+        POPCOUNT ... POPCOUNT[mask] is the number of ones in the mask
+    )
+    """
+    masks = np.arange(1 << NUM_RANKS, dtype=np.int32)
+    rotations = np.empty((NUM_RANKS, 1 << NUM_RANKS), dtype=np.int32)
+    for r in range(NUM_RANKS):
+        rotations[r] = ((masks >> r) | (masks << (NUM_RANKS - r))) \
+                       & ALL_RANKS_MASK
+
+    # The sequence starting at the lowest rank of a rotated mask spans
+    # bit_length(rotated mask) ranks. Take the shortest span over rotations
+    # which have a card at the lowest rank.
+    bit_length = np.zeros(1 << NUM_RANKS, dtype=np.int32)
+    for b in range(NUM_RANKS):
+        bit_length[masks >= (1 << b)] = b + 1
+    spans = np.where(rotations & 1, bit_length[rotations], NUM_RANKS)
+    popcount = np.zeros(1 << NUM_RANKS, dtype=np.int32)
+    for b in range(NUM_RANKS):
+        popcount += (masks >> b) & 1
+    gaps = spans.min(axis=0) - popcount
+    gaps[0] = 0
+    return rotations, gaps, popcount
+
+ROTATIONS, GAPS, POPCOUNT = _make_tables()
+
+def encode(stacks, width=None):
+    """
+    Encode stacks (sequences of Cards) into an array of card codes padded by
+    -1.
+    """
+    if width is None:
+        width = max([len(s) for s in stacks], default=0)
+    codes = np.full((len(stacks), width), -1, dtype=np.int16)
+    for i, stack in enumerate(stacks):
+        codes[i, :len(stack)] = [util.card_code(c) for c in stack]
+    return codes
+
+def check(codes):
+    """
+    Check validity of candidate stacks given as an N x k array of card codes.
+
+    Returns a tuple (
+        boolean array, True for candidates forming a flush or a triplet (the
+        same decision as util.is_valid_layout(), an empty row is valid),
+        array of gap counts -- number of missing cards of candidates which
+        can be completed into a flush (same color, unique ranks), otherwise
+        -1. Jokers in a candidate fill as many of its gaps.
+    )
+    """
+    codes = np.asarray(codes)
+    present = codes >= 0
+    natural = present & (codes != util.JOKER_CODE)
+    size = present.sum(axis=1)
+    jokers = size - natural.sum(axis=1)
+    num_natural = size - jokers
+    colors = np.where(natural, codes // NUM_RANKS, 0)
+    ranks = np.where(natural, codes % NUM_RANKS, 0)
+
+    color_mask = np.bitwise_or.reduce(np.where(natural, 1 << colors, 0),
+                                      axis=1)
+    rank_mask = np.bitwise_or.reduce(np.where(natural, 1 << ranks, 0), axis=1)
+    num_colors = POPCOUNT[color_mask]
+    num_ranks = POPCOUNT[rank_mask]
+
+    flush_like = (num_natural > 0) & (num_colors == 1) \
+                 & (num_ranks == num_natural)
+    triplet_like = (num_natural > 0) & (num_ranks == 1) \
+                   & (num_colors == num_natural)
+    gaps = np.where(flush_like, GAPS[rank_mask], -1)
+    flush = flush_like & (size >= 3) & (size <= NUM_RANKS) & (gaps <= jokers)
+    triplet = ~flush_like & triplet_like & (size >= 3) \
+              & (size <= len(COLORS))
+    return flush | triplet | (size == 0), gaps
+
+@functools.lru_cache(maxsize=None)
+def _combinations(num_items, n):
+    return np.array(list(itertools.combinations(range(num_items), n)),
+                    dtype=np.int16).reshape(-1, n)
+
+def valid_subsets(cards, n):
+    """
+    Return a list of all n-element subsets (tuples) of the given cards which
+    form a valid stack.
+    """
+    cards = list(cards)
+    indices = _combinations(len(cards), n)
+    codes = np.array([util.card_code(c) for c in cards], dtype=np.int16)
+    valid, gaps = check(codes[indices])
+    return [tuple([cards[i] for i in row]) for row in indices[valid]]
@@ -1,29 +1,52 @@
 """
 The Card class
 
-This file contains the class representing cards in this program.
+This file contains the class representing cards in this program. Cards hold
+only their color, rank and whether they are frozen, so that many games fit in
+memory at once (see membench.py). Their images are kept by the UI (see
+widgets.CardImages).
 """
 
 from config import *
 
+# (color, rank) -> number of the first copy of the card. Both copies of a
+# card are numbered by two consecutive numbers, jokers follow the other cards
+_FIRST_COPY = {(color, rank): 2 * (i * len(RANKS) + j)
+               for i, color in enumerate(COLORS)
+               for j, rank in enumerate(RANKS)}
+_FIRST_COPY[(JOKER, JOKER)] = 2 * len(COLORS) * len(RANKS)
+
+# Flag of frozen cards, above the numbers of all copies (at most 108). A
+# number with the flag stays below 257, so CPython shares the int instead of
+# allocating one per card
+_FROZEN = 128
+
 class Card:
-    def __init__(self, color, rank, img):
+    __slots__ = ("color", "rank", "_bits")
+
+    def __init__(self, color, rank, copy=0):
+        """
+        copy ... which copy of the card this is (0 or 1, 0 to NUM_JOKERS - 1
+                 for jokers)
+
+        Cards are equal only to themselves, but their hash is the number of
+        the copy (see _FIRST_COPY) rather than their address. Sets of cards
+        are then iterated in the same order in every run, so that seeded
+        games of the AI (see tournament.py) can be replayed.
+        """
         self.color = color
         self.rank = rank
-        self.img = img.copy()
+        # The number of the copy, or-ed with _FROZEN once frozen
+        self._bits = _FIRST_COPY[(color, rank)] + copy
 
-        self._frozen = False
-        self._update_alpha()
+    def __hash__(self):
+        return self._bits & ~_FROZEN
 
     def freeze(self):
-        self._frozen = True
-        self._update_alpha()
+        self._bits |= _FROZEN
 
     def is_frozen(self):
-        return self._frozen
+        return self._bits >= _FROZEN
 
-    def _update_alpha(self):
-        if self._frozen:
-            self.img.set_alpha(255 * 1.00)
-        else:
-            self.img.set_alpha(255 * (1.00 - CARD_TRANSPARENCY))
+    def is_joker(self):
+        return self.color == JOKER
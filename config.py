@@ -8,7 +8,49 @@ This file contains global constants.
 COLORS = ("heart", "clover", "spade", "diamond")
 RANKS = ("2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A")
 STARTING_HAND_NUM_CARDS = 12
-AI_VS_AI_TURN_DELAY = 1000
+JOKERS = False # Play with jokers (see Note4 in __main__.py)
+NUM_JOKERS = 4 # In the whole (double) deck
+JOKER = "joker" # Both the color and the rank of jokers
+ZOBRIST_SEED = 20230920 # Seed of the random keys of position hashes
+AI_VS_AI_TURN_DELAY = 1000 # Milliseconds per turn at the normal speed
+# Speeds of AI vs AI games chosen by keys 1, 2, ... (multiples of the normal
+# speed, 0 ... as fast as the AI can play)
+AI_VS_AI_SPEEDS = (1, 10, 0)
+# Which frames of AI vs AI games are drawn, cycled by the R key
+AI_VS_AI_RENDER_MODES = ("all", "every_nth", "final")
+AI_VS_AI_RENDER_EVERY = 10 # Turns between drawn frames in "every_nth" mode
+
+# AI
+AI_SEARCH = True # Search all first moves (see ai.search_moves()) or be greedy
+AI_SEARCH_WORKERS = 0 # Processes searching in parallel, 0 ... all cores
+AI_SEARCH_MIN_PARALLEL_MOVES = 16 # Fewer first moves are searched in-process
+AI_SOLVER = True # Try rearranging the whole board (see solver.py)
+SOLVER_TIME_LIMIT = 0.1 # Seconds, see solver.py
+# Strategies of the AI players 1 and 2 (see strategies.STRATEGIES)
+AI_SEAT_STRATEGIES = ("solver", "solver")
+MONTE_CARLO_TIME_BUDGET = 1.0 # Seconds per turn
+MONTE_CARLO_MAX_PLAYOUTS = 2000 # Per turn
+MONTE_CARLO_PLAYOUT_RATE = 0 # Max playouts per second, 0 ... unlimited
+MONTE_CARLO_PLAYOUT_TURNS = 8 # Playouts are cut off and evaluated after this
+MONTE_CARLO_EXPLORATION = 0.7 # UCB1 exploration constant
+MONTE_CARLO_HAND_DIFF_SCALE = 3 # How fast a cut off playout's reward saturates
+HINT_CACHE_SIZE = 64 # Number of positions with a cached hint
+AI_PONDER = True # Think during the turn of the human opponent (see ponder.py)
+PONDER_CACHE_SIZE = 16 # Number of positions with pondered moves
+AI_ENDGAME = True # Solve endgames exactly (see endgame.py)
+ENDGAME_MAX_HAND_SIZE = 5 # The endgame solver plays when no hand is bigger
+ENDGAME_TIME_LIMIT = 1.0 # Seconds, then the strategy plays instead
+ENDGAME_TABLE_SIZE = 1000000 # Entries of the transposition table
+
+# Tournament (see tournament.py)
+TOURNAMENT_GAMES = 20 # Deals per pair of strategies, each played from both seats
+TOURNAMENT_MAX_TURNS = 300 # Longer matches are counted as draws
+TOURNAMENT_WORKERS = 0 # Processes playing matches, 0 ... all cores
+
+# Game server (see server.py and loadgen.py)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_AI_WORKERS = 0 # Processes playing AI turns, 0 ... all cores
 
 # Gamemode constants
 PLAYER_VS_PLAYER = 0
@@ -25,6 +67,7 @@ BG_COLOR = "0x005500"
 FG_COLOR = "0x227722"
 ERR_COLOR = "0x772222"
 TEXT_COLOR = "0x000000"
+HINT_COLOR = "0xffdd00" # Border of cards suggested by a hint
 # For not frozen cards. From 0.00 (opaque) to 1.00 (invisible)
 CARD_TRANSPARENCY = 0.20
 
@@ -34,8 +77,10 @@ COLUMNS_OF_STACKS = 19
 HAND_PX_HEIGHT = 100
 STACK_PX_MARGINS = 8
 CARD_HEIGHT_WIDTH_RATIO = 4. / 3
+HINT_BORDER_WIDTH = 3
 
 # UI font
+FONT_FILE = "./fonts/font.ttf" # Bundled font, FONT_NAME is used if missing
 FONT_NAME = "arial"
 FONT_SIZE = 9
 MEDIUM_FONT_SIZE = 18
@@ -44,6 +89,14 @@ BIG_FONT_SIZE = 27
 # Files
 CARDS_DIR = "./cards"
 DECK_IMG_FILE = "back.png"
+JOKER_IMG_FILE = "card_joker.png" # In CARDS_DIR
+
+# Logging (see gamelog.py)
+LOG_LEVEL = "INFO" # "WARNING" silences moves and turns
+LOG_FORMAT = "text" # "text" or "json" (JSON lines)
+LOG_FILE = None # None ... stdout
 
-BOT1_NAME = "Albert BOT"
-BOT2_NAME = "Zuzka BOT"
+# Profiling (can also be enabled by the VATIKAN_PROFILE environment variable)
+PROFILING = False
+PROFILING_OUTPUT_FILE = "profile.json" # .json or .csv
+PROFILING_OVERLAY_BG_COLOR = "0xffffff"
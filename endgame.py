@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+
+"""
+Endgame solver
+
+This file contains an exact solver of endgames. Once the deck is empty, every
+card is either on the board or in one of the hands, so the hand of the
+opponent is known (it's what isn't anywhere else) and the game becomes
+deterministic. When both hands are small (see ENDGAME_MAX_HAND_SIZE), the
+solver searches the whole game tree by alpha-beta (negamax) with a
+transposition table and plays optimally.
+
+The rules allow rearranging the board freely, so only the multiset of cards
+on the board matters, not how they are split into stacks. A turn is therefore
+given by the multiset of cards the player puts from hand onto the board. It
+can be played iff the board and the cards can be partitioned into valid
+stacks. The cards are given here, so instead of maximizing the cards placed
+like the exact solver (see solver.py) this file has its own search for
+partitions (see partition()), sharing the triplets and the assignment of
+cards with the solver. Putting no card is always possible. When both players
+pass in a row, the position repeats and the game is scored as a draw.
+
+Values are from the point of view of the player on turn: WIN minus the number
+of turns before the player wins, the negation of that for a loss and 0 for a
+draw. So the solver prefers quick wins and slow losses.
+
+Run as a script, it plays games by the greedy AI until the deck is empty,
+solves the endgames reached and reports node counts and times so that the
+threshold can be tuned.
+
+Usage: python3 endgame.py [-h] [-n GAMES] [-k HAND_SIZE] [-s SEED]
+                          [-t TIME_LIMIT]
+"""
+
+import time
+import argparse
+import functools
+import itertools
+
+from config import *
+from engine import Match, Position
+import util
+import ai
+import solver
+
+WIN = 1000
+
+# Kinds of values stored in the transposition table
+EXACT = 0
+LOWER = 1 # The value is a lower bound
+UPPER = 2 # The value is an upper bound
+
+NUM_CODES = len(COLORS) * len(RANKS)
+
+class EndgameTimeout(Exception):
+    pass
+
+
+def is_endgame(match, max_hand_size=ENDGAME_MAX_HAND_SIZE):
+    """
+    Can the endgame solver play the given match (class Match)? That is, is
+    the deck empty and are both hands at most 'max_hand_size' cards? The
+    solver works with natural cards only, so never with jokers (see Note4 in
+    __main__.py).
+    """
+    return not JOKERS and not match.deck and match.winner is None \
+        and all([len(hand) <= max_hand_size for hand in match.hands])
+
+def _shift(value):
+    """
+    Turn the value of a position after a turn into the value of the position
+    before it -- negate it and move it one turn further from the end.
+    """
+    if value > 0:
+        return -value + 1
+    if value < 0:
+        return -value - 1
+    return 0
+
+def _turns(hand):
+    """
+    Return all nonempty turns (sorted tuples of card codes) of the given hand
+    (sorted tuple of card codes), bigger turns first.
+    """
+    counts = {}
+    for code in hand:
+        counts[code] = counts.get(code, 0) + 1
+    codes = sorted(counts)
+    turns = []
+    for taken in itertools.product(*[range(counts[c] + 1) for c in codes]):
+        turn = []
+        for code, n in zip(codes, taken):
+            turn.extend([code] * n)
+        if turn:
+            turns.append(tuple(turn))
+    turns.sort(key=len, reverse=True)
+    return turns
+
+def _remove(hand, turn):
+    """
+    Return the hand (sorted tuple of card codes) without the cards of the
+    turn.
+    """
+    rest = list(hand)
+    for code in turn:
+        rest.remove(code)
+    return tuple(rest)
+
+
+@functools.lru_cache(maxsize=ENDGAME_TABLE_SIZE)
+def _flushes(counts, triplet_ranks):
+    """
+    Partition cards of a single color (bytes of numbers of cards indexed by
+    ranks) into flushes of 3 to 5 cards (a longer flush can always be cut
+    into shorter ones). Cards of ranks in the bit mask 'triplet_ranks' may be
+    left out -- they may still go to triplets.
+
+    Returns a tuple of flushes (tuples of ranks) or None if there is no such
+    partition.
+    """
+    num_ranks = len(counts)
+    ranks = [r for r in range(num_ranks) if counts[r]]
+    if not ranks:
+        return ()
+    starts = [r for r in ranks if not counts[r - 1]]
+    if starts:
+        # No flush goes on below the card so the card starts a flush
+        rank = starts[0]
+        first_ranks = lambda length: (rank,)
+    else:
+        # All ranks are there, the card may be anywhere in its flush
+        rank = min(ranks, key=lambda r: counts[r])
+        first_ranks = lambda length: range(rank - length + 1, rank + 1)
+
+    options = []
+    for length in (3, 4, 5):
+        for first in first_ranks(length):
+            flush = tuple([r % num_ranks
+                           for r in range(first, first + length)])
+            if all([counts[r] for r in flush]):
+                options.append(flush)
+    if triplet_ranks & (1 << rank):
+        options.append(None)
+
+    for flush in options:
+        rest = bytearray(counts)
+        for r in (rank,) if flush is None else flush:
+            rest[r] -= 1
+        result = _flushes(bytes(rest), triplet_ranks)
+        if result is not None:
+            return result if flush is None else (flush,) + result
+    return None
+
+def partition(counts, deadline=None):
+    """
+    Partition cards into valid stacks.
+
+    counts ... bytes of numbers of cards indexed by codes
+    deadline ... time.perf_counter() value after which EndgameTimeout is
+                 raised, None for no limit
+
+    Returns a list of stacks (lists of (color, rank) index pairs as
+    solver._assign_cards() takes them) or None if there is no partition.
+
+    Colors only interact through triplets, so the search decides triplets
+    rank by rank and then partitions each color into flushes on its own. A
+    branch is cut off as soon as some color can't be partitioned even if it
+    could give any card of the undecided ranks to a triplet, and ranks where
+    some color needs a triplet are decided first.
+    """
+    num_ranks = len(RANKS)
+    num_colors = len(COLORS)
+    counts = bytearray(counts)
+    triplets = []
+    failed = set()
+
+    def segments():
+        return [bytes(counts[c * num_ranks:(c + 1) * num_ranks])
+                for c in range(num_colors)]
+
+    def triplet_masks(undecided):
+        # For each color the undecided ranks where it could join a triplet
+        masks = []
+        for color in range(num_colors):
+            mask = 0
+            for rank in range(num_ranks):
+                if not undecided & (1 << rank):
+                    continue
+                others = sum([1 for c in range(num_colors)
+                              if c != color and counts[c * num_ranks + rank]])
+                if others >= 2:
+                    mask |= 1 << rank
+            masks.append(mask)
+        return masks
+
+    def search(undecided):
+        key = (undecided, bytes(counts))
+        if key in failed:
+            return None
+        if deadline is not None and time.perf_counter() > deadline:
+            raise EndgameTimeout()
+        colors = segments()
+        masks = triplet_masks(undecided)
+        flushes = [_flushes(c, m) for c, m in zip(colors, masks)]
+        if None in flushes:
+            failed.add(key)
+            return None
+        if not undecided:
+            return flushes
+
+        ranks = [r for r in range(num_ranks) if undecided & (1 << r)]
+        rank = ranks[0]
+        for r in ranks:
+            bit = 1 << r
+            if any([m & bit and _flushes(c, m & ~bit) is None
+                    for c, m in zip(colors, masks)]):
+                rank = r # Some color needs a triplet here
+                break
+
+        available = [counts[c * num_ranks + rank] for c in range(num_colors)]
+        # Taking nothing first, the search only needs some partition
+        for taken in reversed(solver._triplet_options(available)):
+            for color, n in enumerate(taken):
+                counts[color * num_ranks + rank] -= n
+            triplets.append((rank, taken))
+            result = search(undecided & ~(1 << rank))
+            if result is not None:
+                return result
+            triplets.pop()
+            for color, n in enumerate(taken):
+                counts[color * num_ranks + rank] += n
+        failed.add(key)
+        return None
+
+    flushes = search((1 << num_ranks) - 1)
+    if flushes is None:
+        return None
+    stacks = []
+    for color, color_flushes in enumerate(flushes):
+        for flush in color_flushes:
+            stacks.append([(color, rank) for rank in flush])
+    for rank, taken in triplets:
+        if any(taken):
+            stacks.extend(solver._triplet_groups(rank, taken))
+    return stacks
+
+
+class EndgameSolver:
+    def __init__(self, time_limit=ENDGAME_TIME_LIMIT,
+                 table_size=ENDGAME_TABLE_SIZE):
+        """
+        time_limit ... seconds for one call of solve(), None for no limit
+        table_size ... the transposition table is cleared when it has more
+                       entries than this
+
+        The tables are kept between calls, so later turns of the same
+        endgame are mostly found there.
+        """
+        self.time_limit = time_limit
+        self.table_size = table_size
+
+        # (board, hand on turn, other hand, passed) -> (value, kind, turn)
+        self._table = {}
+        # (board, turn) -> can the turn be played
+        self._playable = {}
+        self._nodes = 0
+        self._deadline = None
+
+        # Statistics of the last call of solve()
+        self.stats = {}
+
+    def solve(self, match):
+        """
+        Find the optimal turn of the player on turn of the given match (class
+        Match). The deck must be empty.
+
+        Returns a tuple (value, turn -- sorted tuple of codes of cards to put
+        onto the board) or None if the time limit was hit.
+        """
+        start = time.perf_counter()
+        if len(self._table) > self.table_size:
+            self._table.clear()
+        if len(self._playable) > self.table_size:
+            self._playable.clear()
+        self._nodes = 0
+        self._deadline = None if self.time_limit is None \
+            else start + self.time_limit
+
+        board = bytearray(NUM_CODES)
+        for stack in match.stacks:
+            for card in stack:
+                board[util.card_code(card)] += 1
+        hand = tuple(sorted([util.card_code(c) for c in match.hand()]))
+        other = tuple(sorted([util.card_code(c)
+                              for c in match.hand(match.opponent())]))
+
+        try:
+            result = self._negamax(bytes(board), hand, other, False,
+                                   -WIN - 1, WIN + 1)
+        except EndgameTimeout:
+            result = None
+        self.stats = {
+            "endgame_nodes": self._nodes,
+            "endgame_seconds": time.perf_counter() - start,
+            "endgame_solved": result is not None,
+        }
+        if result is not None:
+            self.stats["endgame_value"] = result[0]
+        return result
+
+    def choose_moves(self, match):
+        """
+        Return the moves (see ai.generate_moves() for the format) of the
+        optimal turn of the player on turn or None if the time limit was hit.
+        """
+        result = self.solve(match)
+        if result is None:
+            return None
+        value, turn = result
+        if not turn:
+            return []
+
+        hand = list(match.hand())
+        cards = []
+        for code in turn:
+            card = next(c for c in hand if util.card_code(c) == code)
+            hand.remove(card)
+            cards.append(card)
+        board = [card for stack in match.stacks for card in stack]
+        counts = bytearray(NUM_CODES)
+        for card in board + cards:
+            counts[util.card_code(card)] += 1
+        stacks = partition(bytes(counts))
+        return [("rearrange board",)
+                + tuple(solver._assign_cards(stacks, board, cards))]
+
+    def _negamax(self, board, hand, other, passed, alpha, beta):
+        """
+        Return a tuple (value, best turn) of the position where the player
+        with 'hand' is on turn. If the value is at most alpha, it's only an
+        upper bound, if it's at least beta, it's only a lower bound.
+
+        board ... bytes of numbers of cards on the board indexed by codes
+        hand, other ... sorted tuples of card codes in the hands
+        passed ... did the other player put no card in the previous turn
+        """
+        self._nodes += 1
+        if self._deadline is not None and not self._nodes % 256 \
+                and time.perf_counter() > self._deadline:
+            raise EndgameTimeout()
+
+        key = (board, hand, other, passed)
+        entry = self._table.get(key)
+        turns = _turns(hand) + [()]
+        if entry is not None:
+            value, kind, best_turn = entry
+            if kind == EXACT or kind == LOWER and value >= beta \
+                    or kind == UPPER and value <= alpha:
+                return value, best_turn
+            # Try the best turn found before first
+            turns.remove(best_turn)
+            turns.insert(0, best_turn)
+
+        original_alpha = alpha
+        best = None
+        best_turn = None
+        for turn in turns:
+            if not turn:
+                if passed:
+                    value = 0 # The position repeats
+                else:
+                    child, t = self._negamax(board, other, hand, True,
+                                             -beta - 1, -alpha + 1)
+                    value = _shift(child)
+            elif not self._is_playable(board, turn):
+                continue
+            elif len(turn) == len(hand):
+                value = WIN
+            else:
+                new_board = bytearray(board)
+                for code in turn:
+                    new_board[code] += 1
+                child, t = self._negamax(bytes(new_board), other,
+                                         _remove(hand, turn), False,
+                                         -beta - 1, -alpha + 1)
+                value = _shift(child)
+
+            if best is None or value > best:
+                best = value
+                best_turn = turn
+            alpha = max(alpha, best)
+            if alpha >= beta or best == WIN:
+                break
+
+        if best <= original_alpha:
+            kind = UPPER
+        elif best >= beta:
+            kind = LOWER
+        else:
+            kind = EXACT
+        self._table[key] = (best, kind, best_turn)
+        return best, best_turn
+
+    def _is_playable(self, board, turn):
+        """
+        Can the cards of the turn be put onto the board?
+        """
+        key = (board, turn)
+        playable = self._playable.get(key)
+        if playable is None:
+            counts = bytearray(board)
+            for code in turn:
+                counts[code] += 1
+            playable = partition(bytes(counts), self._deadline) is not None
+            self._playable[key] = playable
+        return playable
+
+
+def played_endgame(seed=None, max_hand_size=ENDGAME_MAX_HAND_SIZE):
+    """
+    Deal a new match (see Match.new()) and let the greedy AI play both
+    players until the deck is empty. Return the match if it's then an endgame
+    (see is_endgame()), otherwise None.
+    """
+    match = Match.new(seed)
+    while not match.is_over() and match.deck:
+        position = Position(set(match.hand()), set(match.stacks))
+        match.play_turn(ai.greedy_moves(position))
+    if is_endgame(match, max_hand_size):
+        return match
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="Solve endgames of greedy self-play and report the "
+                        + "effort.")
+    parser.add_argument("-n", "--games", type=int, default=50,
+                        help="number of games to play")
+    parser.add_argument("-k", "--hand-size", type=int,
+                        default=ENDGAME_MAX_HAND_SIZE,
+                        help="maximum cards in each hand")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the first game")
+    parser.add_argument("-t", "--time-limit", type=float,
+                        default=ENDGAME_TIME_LIMIT,
+                        help="seconds per endgame, 0 for no limit")
+    args = parser.parse_args()
+
+    print(f"{'seed':>6} {'hands':>6} {'value':>6} {'nodes':>8} {'ms':>9}")
+    endgames = 0
+    solved = []
+    for seed in range(args.seed, args.seed + args.games):
+        match = played_endgame(seed, args.hand_size)
+        if match is None:
+            continue
+        endgames += 1
+        hands = f"{len(match.hand())}/{len(match.hand(match.opponent()))}"
+        endgame = EndgameSolver(args.time_limit if args.time_limit else None)
+        endgame.solve(match)
+        stats = endgame.stats
+        value = stats.get("endgame_value", "-")
+        print(f"{seed:>6} {hands:>6} {value:>6} {stats['endgame_nodes']:>8} "
+              + f"{stats['endgame_seconds'] * 1000:>9.1f}")
+        if stats["endgame_solved"]:
+            solved.append(stats)
+
+    print()
+    print(f"{endgames} of {args.games} games reached an endgame, "
+          + f"solved {len(solved)}")
+    if solved:
+        nodes = sorted([s["endgame_nodes"] for s in solved])
+        seconds = sorted([s["endgame_seconds"] for s in solved])
+        print(f"nodes median {nodes[len(nodes) // 2]}, max {nodes[-1]}")
+        print(f"ms median {seconds[len(seconds) // 2] * 1000:.1f}, "
+              + f"max {seconds[-1] * 1000:.1f}")
@@ -0,0 +1,490 @@
+"""
+Engine
+
+This file contains the headless representation of the game state used by the
+AI. It doesn't know anything about widgets or pygame.
+
+The Position class represents the part of the game state the AI works with --
+the hand of the current player and the stacks on the board. Moves (in the
+format produced by ai.generate_moves()) are applied to a position in place and
+can be taken back, so a search can walk the tree of moves without copying the
+position at every node.
+
+Positions can be compared by a canonical key where cards are reduced to their
+color and rank (both copies of a card are interchangeable) and by a 64-bit
+Zobrist-style hash of the same information. The hash is updated with each
+applied move so it can be used as a key of transposition tables and caches.
+
+The Match class is a headless game of two players built on top of positions.
+It works with whole turns and is used for simulations.
+"""
+
+import random
+
+from config import *
+from card import Card
+import util
+
+MASK64 = (1 << 64) - 1
+
+# Random keys of the hash. Seeded so that all processes agree on them
+_random = random.Random(ZOBRIST_SEED)
+_HAND_KEYS = [_random.getrandbits(64) for _ in range(len(COLORS) * len(RANKS))]
+_STACK_KEYS = [_random.getrandbits(64) for _ in range(len(COLORS) * len(RANKS))]
+# Keys of jokers (see util.JOKER_CODE). Drawn last so that the keys of the
+# other cards stay the same
+_HAND_KEYS.append(_random.getrandbits(64))
+_STACK_KEYS.append(_random.getrandbits(64))
+
+def _mix(x):
+    """
+    Scramble bits of a 64-bit number (the splitmix64 finalizer)
+    """
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+    return x ^ (x >> 31)
+
+def hand_hash(cards):
+    """
+    Return the hash of a multiset of cards in hand. Hashes of cards are added
+    (not xored) so that two copies of a card don't cancel out.
+    """
+    h = 0
+    for card in cards:
+        h += _HAND_KEYS[util.card_code(card)]
+    return h & MASK64
+
+def stack_hash(stack):
+    """
+    Return the hash of a stack. It doesn't depend on the order of the cards.
+    """
+    h = 0
+    for card in stack:
+        h += _STACK_KEYS[util.card_code(card)]
+    return _mix(h & MASK64)
+
+def stack_key(stack):
+    """
+    Return the canonical representation of a stack -- a sorted tuple of card
+    codes (see util.card_code()).
+    """
+    return tuple(sorted([util.card_code(c) for c in stack]))
+
+
+def normalize_stack(cards):
+    """
+    Return the given cards as a tuple sorted the way the AI expects stacks to
+    be sorted (see util.sorted_by_flush()). Cards not forming a valid stack
+    are returned in the original order.
+    """
+    foo = util.attempt_construct_valid_stack(cards)
+    if foo is None or None in foo:
+        return tuple(cards)
+    return foo
+
+def encode_move(move, cards):
+    """
+    Replace Cards in a move (see ai.generate_moves()) by their ids. 'cards' is
+    the list of Cards indexed by ids returned by Position.serialize().
+    """
+    ids = {card: i for i, card in enumerate(cards)}
+    if move[0] == "add card to stack":
+        return (move[0], ids[move[1]], tuple([ids[c] for c in move[2]]))
+    return (move[0],) + tuple([tuple([ids[c] for c in s]) for s in move[1:]])
+
+def decode_move(move, cards):
+    """
+    Reverse encode_move().
+    """
+    if move[0] == "add card to stack":
+        return (move[0], cards[move[1]], tuple([cards[i] for i in move[2]]))
+    return (move[0],) + tuple([tuple([cards[i] for i in s]) for s in move[1:]])
+
+class Position:
+    def __init__(self, hand, stacks):
+        """
+        hand ... set of Cards in hand
+        stacks ... set of *nonempty* stacks (tuples of Cards) normalized by
+                   normalize_stack()
+
+        Besides the hand, the position keeps util.CardCounts of the cards in
+        hand (hand_counts) so that the AI can ask which cards it holds in O(1).
+
+        The position takes ownership of the given sets and modifies them.
+        """
+        self.hand = hand
+        self.stacks = stacks
+        self.hand_counts = util.CardCounts(hand)
+
+        # Each applied move leaves an entry here. An entry is a tuple
+        # (cards removed from hand, stacks removed, stacks added)
+        self._undo_log = []
+
+        # Computed on first use by get_hash(), then updated with each move
+        self._hash = None
+
+    @classmethod
+    def from_game(cls, game):
+        """
+        Make a position out of the current state of a Game object.
+        """
+        hand, stacks = game.get_state_copy()
+        return cls(hand, set(normalize_stack(s) for s in stacks))
+
+    def serialize(self):
+        """
+        Return a compact picklable representation of the position to be sent
+        to other processes and the list of Cards indexed by the ids used in
+        it.
+
+        The representation is a tuple (
+            bytes of card codes (see util.card_code()) indexed by card ids,
+            tuple of ids of cards in hand,
+            tuple of stacks (tuples of card ids)
+        )
+        """
+        cards = list(self.hand)
+        for stack in self.stacks:
+            cards.extend(stack)
+        ids = {card: i for i, card in enumerate(cards)}
+
+        codes = bytes([util.card_code(c) for c in cards])
+        hand = tuple(range(len(self.hand)))
+        stacks = tuple([tuple([ids[c] for c in s]) for s in self.stacks])
+        return (codes, hand, stacks), cards
+
+    @classmethod
+    def deserialize(cls, data):
+        """
+        Make a position out of the output of serialize(). The position
+        contains new Card objects without images.
+
+        Returns the position and the list of its Cards indexed by ids.
+        """
+        codes, hand, stacks = data
+        cards = [util.card_from_code(c) for c in codes]
+        position = cls(set([cards[i] for i in hand]),
+                       set([tuple([cards[i] for i in s]) for s in stacks]))
+        return position, cards
+
+    def copy(self):
+        """
+        Return a copy of the position with an empty undo log.
+        """
+        return Position(set(self.hand), set(self.stacks))
+
+    def apply(self, move):
+        """
+        Apply a move (see ai.generate_moves() for the format) to the position.
+
+        Checks that all cards of the move are in the hand or in the given
+        stacks, that the resulting stacks are valid and that the taken cards
+        leave valid stacks behind.
+
+        Returns True on success, otherwise False (the position doesn't change)
+        """
+        if move[0] == "add card to stack":
+            card = move[1]
+            stack = move[2]
+            if card not in self.hand or stack not in self.stacks:
+                return False
+            new_stack = util.attempt_construct_valid_stack(stack + (card,))
+            if new_stack is None or None in new_stack:
+                return False
+
+            self.hand.remove(card)
+            self.hand_counts.remove(card)
+            self.stacks.remove(stack)
+            self.stacks.add(new_stack)
+            self._log((card,), (stack,), (new_stack,))
+            return True
+        elif move[0] == "rearrange board":
+            return self._apply_rearrangement(move[1:])
+        else: # Form new stack
+            cards = move[1]
+            from_stacks = move[2:]
+            for stack in from_stacks:
+                if stack not in self.stacks:
+                    return False
+            if len(set(from_stacks)) != len(from_stacks):
+                return False
+
+            from_hand = []
+            for card in cards:
+                if card in self.hand:
+                    from_hand.append(card)
+                elif not any(card in stack for stack in from_stacks):
+                    return False
+
+            new_stack = util.attempt_construct_valid_stack(cards)
+            if not new_stack or None in new_stack:
+                return False
+
+            # What remains of the stacks we took cards from
+            remaining_stacks = []
+            for stack in from_stacks:
+                remaining = tuple([c for c in stack if c not in cards])
+                if remaining:
+                    remaining = util.attempt_construct_valid_stack(remaining)
+                    if remaining is None or None in remaining:
+                        return False
+                    remaining_stacks.append(remaining)
+
+            for card in from_hand:
+                self.hand.remove(card)
+                self.hand_counts.remove(card)
+            for stack in from_stacks:
+                self.stacks.remove(stack)
+            added = tuple(remaining_stacks) + (new_stack,)
+            for stack in added:
+                self.stacks.add(stack)
+            self._log(tuple(from_hand), from_stacks, added)
+            return True
+
+    def _apply_rearrangement(self, new_stacks):
+        """
+        Replace the stacks on the board by the given stacks. They have to
+        contain all cards on the board, the rest of their cards is taken from
+        the hand.
+        """
+        board = set([card for stack in self.stacks for card in stack])
+        from_hand = []
+        normalized = set()
+        seen = set()
+        for stack in new_stacks:
+            new_stack = util.attempt_construct_valid_stack(stack)
+            if not new_stack or None in new_stack:
+                return False
+            for card in new_stack:
+                if card in seen:
+                    return False
+                seen.add(card)
+                if card not in board:
+                    if card not in self.hand:
+                        return False
+                    from_hand.append(card)
+            normalized.add(new_stack)
+        if not board <= seen:
+            return False
+
+        # Stacks which stay the same don't need to be touched
+        removed = tuple(self.stacks - normalized)
+        added = tuple(normalized - self.stacks)
+        for card in from_hand:
+            self.hand.remove(card)
+            self.hand_counts.remove(card)
+        for stack in removed:
+            self.stacks.remove(stack)
+        for stack in added:
+            self.stacks.add(stack)
+        self._log(tuple(from_hand), removed, added)
+        return True
+
+    def undo(self):
+        """
+        Take back the last applied move.
+        """
+        cards, removed, added = self._undo_log.pop()
+        if self._hash is not None:
+            self._hash = (self._hash + hand_hash(cards)
+                          - sum([stack_hash(s) for s in added])
+                          + sum([stack_hash(s) for s in removed])) & MASK64
+        for stack in added:
+            self.stacks.remove(stack)
+        for stack in removed:
+            self.stacks.add(stack)
+        for card in cards:
+            self.hand.add(card)
+            self.hand_counts.add(card)
+
+    def hand_card_with_code(self, code):
+        """
+        Return a card from hand with the given code (see util.card_code()) or
+        None if there isn't any.
+        """
+        if not self.hand_counts.counts[code]:
+            return None
+        for card in self.hand:
+            if util.card_code(card) == code:
+                return card
+
+    def num_applied(self):
+        """
+        Return the number of applied moves that can be taken back.
+        """
+        return len(self._undo_log)
+
+    def undo_to(self, num_applied):
+        """
+        Take back applied moves until only 'num_applied' moves remain.
+        """
+        while len(self._undo_log) > num_applied:
+            self.undo()
+
+    def _log(self, cards, removed, added):
+        """
+        Record an applied move in the undo log and update the hash.
+
+        cards ... cards that left the hand
+        removed ... stacks that left the board
+        added ... stacks that were put onto the board
+        """
+        self._undo_log.append((cards, removed, added))
+        if self._hash is not None:
+            self._hash = (self._hash - hand_hash(cards)
+                          + sum([stack_hash(s) for s in added])
+                          - sum([stack_hash(s) for s in removed])) & MASK64
+
+    def get_hash(self):
+        """
+        Return a 64-bit hash of the position. Positions with equal keys (see
+        key()) have equal hashes.
+        """
+        if self._hash is None:
+            self._hash = (hand_hash(self.hand)
+                          + sum([stack_hash(s) for s in self.stacks])) & MASK64
+        return self._hash
+
+    def key(self):
+        """
+        Return the canonical representation of the position. Cards are reduced
+        to their codes (see util.card_code()) so the key doesn't depend on
+        which copy of a card is where.
+
+        Returns a tuple (sorted tuple of codes of cards in hand, sorted tuple
+        of stack keys (see stack_key()))
+        """
+        hand = tuple(sorted([util.card_code(c) for c in self.hand]))
+        stacks = tuple(sorted([stack_key(s) for s in self.stacks]))
+        return (hand, stacks)
+
+class Match:
+    def __init__(self, hands, stacks, deck, player=1):
+        """
+        hands ... list of two sets of Cards, hands of player 1 and 2
+        stacks ... set of stacks as in Position
+        deck ... list of Cards, the last card is drawn first
+        player ... the player on turn (1 or 2)
+
+        A headless game working with whole turns. Used for simulations (e.g.
+        playouts of the Monte Carlo AI) where Game and its widgets would be too slow.
+        """
+        self.hands = hands
+        self.stacks = stacks
+        self.deck = deck
+        self.player = player
+        self.winner = None
+        self.turn = 0
+
+        self._hand_size_at_turn_start = len(self.hands[player - 1])
+
+    @classmethod
+    def new(cls, seed=None):
+        """
+        Shuffle a new deck and deal the cards the way Game does.
+        """
+        deck = []
+        for color in COLORS:
+            for rank in RANKS:
+                # Each card two times
+                deck.append(Card(color, rank, 0))
+                deck.append(Card(color, rank, 1))
+        if JOKERS:
+            for i in range(NUM_JOKERS):
+                deck.append(Card(JOKER, JOKER, i))
+        random.Random(seed).shuffle(deck)
+
+        hands = [set(), set()]
+        for i in range(STARTING_HAND_NUM_CARDS):
+            hands[0].add(deck.pop())
+            hands[1].add(deck.pop())
+        return cls(hands, set(), deck)
+
+    @classmethod
+    def from_game(cls, game):
+        """
+        Make a match out of the current state of a Game object.
+        """
+        stacks = set()
+        for stack in game.stacks:
+            s = stack.get_state_copy()
+            if s:
+                stacks.add(normalize_stack(s))
+        match = cls(
+            [game.hand1.get_state_copy(), game.hand2.get_state_copy()],
+            stacks,
+            game.deck.get_state_copy(),
+            game.player
+        )
+        match.winner = game.winner
+        return match
+
+    def copy(self):
+        match = Match([set(h) for h in self.hands], set(self.stacks),
+                      list(self.deck), self.player)
+        match.winner = self.winner
+        match.turn = self.turn
+        match._hand_size_at_turn_start = self._hand_size_at_turn_start
+        return match
+
+    def hand(self, player=None):
+        """
+        Return the hand of the given player (by default of the player on turn)
+        """
+        if player is None:
+            player = self.player
+        return self.hands[player - 1]
+
+    def opponent(self):
+        return 2 if self.player == 1 else 1
+
+    def position(self):
+        """
+        Return a Position of the player on turn. The position shares the hand
+        and the stacks with the match so moves applied to it are moves made
+        in the match.
+        """
+        return Position(self.hand(), self.stacks)
+
+    def is_over(self):
+        return self.winner is not None
+
+    def end_turn(self, draw=None):
+        """
+        End the turn of the current player. If the player didn't put any card
+        from hand on the board, they draw a card. Then checks if the hand isn't
+        empty, possibly choosing the player as winner. Finally switches the
+        players.
+
+        draw ... True or False decides whether the player draws a card instead
+                 (e.g. for a match made in the middle of a turn, see
+                 from_game())
+        """
+        hand = self.hand()
+        if draw is None:
+            draw = len(hand) >= self._hand_size_at_turn_start
+        if draw and self.deck:
+            hand.add(self.deck.pop())
+        if self.winner is None and not hand:
+            self.winner = self.player
+
+        self.player = self.opponent()
+        self.turn += 1
+        self._hand_size_at_turn_start = len(self.hand())
+
+    def play_turn(self, moves):
+        """
+        Make the moves (see ai.generate_moves() for the format) and end the
+        turn. If any of the moves fails, all of them are taken back.
+
+        Returns True if all moves succeeded, otherwise False.
+        """
+        position = self.position()
+        success = True
+        for move in moves:
+            if not position.apply(move):
+                position.undo_to(0)
+                success = False
+                break
+        self.end_turn()
+        return success
@@ -0,0 +1,35 @@
+"""
+Fonts
+
+This file contains the cache of fonts used by the UI. Looking up a system font
+(pygame.font.SysFont()) scans the font directories of the system, which can
+take hundreds of milliseconds on Linux. Here the font file is resolved only
+once -- the bundled font (FONT_FILE) is preferred, then the system font
+FONT_NAME, then the default font of pygame -- and each size is loaded only
+once.
+
+Requires pygame.font to be initialized.
+"""
+
+import os
+import functools
+import pygame.font
+
+from config import *
+
+@functools.lru_cache(maxsize=None)
+def get_font_path():
+    """
+    Return the path of the font file to use or None for the default font of
+    pygame.
+    """
+    if FONT_FILE and os.path.isfile(FONT_FILE):
+        return FONT_FILE
+    return pygame.font.match_font(FONT_NAME)
+
+@functools.lru_cache(maxsize=None)
+def get_font(size):
+    """
+    Return the font (pygame.font.Font) of the given size.
+    """
+    return pygame.font.Font(get_font_path(), size)
@@ -1,49 +1,63 @@
 """
 The Game class
 
-This file contains the main class of this program.
+This file contains the main class of this program. It extends the game logic
+(see logic.GameLogic) by the UI -- widgets, hints, pondering of the AI and the
+main game loop.
 """
 
+import time
+import logging
 import pygame
 import pygame.image
-import pygame.font
-from random import randint
 
 from config import *
-from card import Card
 import widgets
+import fonts
 import ai
-
-class Game:
+import gamelog
+import profiling
+from engine import Match, Position
+from hints import HintEngine
+from ponder import Ponderer
+from strategies import make_strategy
+from logic import GameLogic
+
+class Game(GameLogic):
     def __init__(self, gamemode, screen, deck_img, card_imgs):
-        self.gamemode = gamemode
+        self._created = time.perf_counter()
         self.screen = screen
 
         # Setup font
-        self.font = pygame.font.SysFont(FONT_NAME, FONT_SIZE)
-        self.medium_font = pygame.font.SysFont(FONT_NAME, MEDIUM_FONT_SIZE)
-        self.big_font = pygame.font.SysFont(FONT_NAME, BIG_FONT_SIZE)
+        self.font = fonts.get_font(FONT_SIZE)
+        self.medium_font = fonts.get_font(MEDIUM_FONT_SIZE)
+        self.big_font = fonts.get_font(BIG_FONT_SIZE)
 
         # Setup board
+        self.card_images = widgets.CardImages(card_imgs)
         pickup_width = HAND_PX_HEIGHT * 3 / 4
         # The bottom player
         self.pickup1 = widgets.PickUpArea(
                 (0, SCREEN_SIZE[1] - HAND_PX_HEIGHT),
-                (pickup_width, HAND_PX_HEIGHT)
+                (pickup_width, HAND_PX_HEIGHT),
+                self.card_images
         )
         self.hand1 = widgets.Hand(
                 (pickup_width + STACK_PX_MARGINS, SCREEN_SIZE[1] - HAND_PX_HEIGHT),
                 (SCREEN_SIZE[0] - pickup_width, HAND_PX_HEIGHT),
+                self.card_images,
                 False
         )
         # The top player
         self.pickup2 = widgets.PickUpArea(
                 (0, 0),
-                (pickup_width, HAND_PX_HEIGHT)
+                (pickup_width, HAND_PX_HEIGHT),
+                self.card_images
         )
         self.hand2 = widgets.Hand(
                 (pickup_width + STACK_PX_MARGINS, 0),
                 (SCREEN_SIZE[0] - pickup_width, HAND_PX_HEIGHT),
+                self.card_images,
                 gamemode == PLAYER_VS_AI,
                 deck_img
         )
@@ -60,7 +74,8 @@ class Game:
                 x = (col + 1) * STACK_PX_MARGINS + col * stack_width
                 y = HAND_PX_HEIGHT + (row + 1) * STACK_PX_MARGINS + row * stack_height
                 self.stacks.append(widgets.Stack((x, y),
-                                                 (stack_width, stack_height)))
+                                                 (stack_width, stack_height),
+                                                 self.card_images))
 
         deck_width = stack_width
         deck_height = stack_width * CARD_HEIGHT_WIDTH_RATIO
@@ -70,7 +85,6 @@ class Game:
         self.deck = widgets.Deck(
                 (deck_x, deck_y),
                 (deck_width, deck_height),
-                card_imgs,
                 deck_img,
                 self.medium_font
         )
@@ -83,242 +97,296 @@ class Game:
                 (button_width, button_height),
                 self.font
         )
+        # Above the deck and the number of its cards drawn over it
+        hint_button_y = deck_y - self.medium_font.get_height() \
+                - button_height - STACK_PX_MARGINS
+        self.hint_button = widgets.HintButton(
+                (button_x, hint_button_y),
+                (button_width, button_height),
+                self.font
+        )
 
-        # Put starting cards into players' hands
-        for i in range(STARTING_HAND_NUM_CARDS):
-            card = self.deck.pop()
-            self.hand1.add(card)
-            card = self.deck.pop()
-            self.hand2.add(card)
+        # Deals the starting hands
+        super().__init__(gamemode, self.stacks, self.hand1, self.hand2,
+                         self.pickup1, self.pickup2, self.deck)
 
         # DEBUG
-        #self.stacks[0].add(Card("heart", "Q", card_imgs["heart"]["Q"]))
-        #self.hand1.add(Card("clover", "5", card_imgs["clover"]["5"]))
+        #self.stacks[0].add(Card("heart", "Q"))
+        #self.hand1.add(Card("clover", "5"))
         self.end_turn_button.set_board_valid()
 
-        self.winner = None
+        # Strategies of the AI players (see the strategies module)
+        self.strategies = [make_strategy(name) for name in AI_SEAT_STRATEGIES]
+
+        self.hints = HintEngine()
+        self._hint_wanted = False # The player asked for a hint not ready yet
+
+        # The AI opponent of a human thinks during the human's turns
+        self.ponderer = None
+        if gamemode == PLAYER_VS_AI and AI_PONDER:
+            self.ponderer = Ponderer(AI_SEAT_STRATEGIES[1])
+
+        # Spectating AI vs AI games (see AI VS AI SPEED below)
+        self._speed_index = 0
+        self._render_mode = AI_VS_AI_RENDER_MODES[0]
+        self._next_ai_turn = 0 # pygame.time.get_ticks() of the next turn
+        self._ai_turns = 0 # Number of AI turns played
+        self._rendered_turns = 0 # Number of AI turns at the last drawing
+        self._ai_turn = None # Generator of the AI turn in progress
 
         self.win_screen = self.screen.copy()
         self.win_screen.fill(FG_COLOR)
         self.win_screen.set_alpha(255 * 0.60)
 
-    def board_is_valid(self):
-        valid = True
-        for stack in self.stacks:
-            valid &= stack.is_valid()
-        if self.pickup.has_card():
-            valid &= not self.pickup.get().is_frozen()
-        return valid
-
-    def board_is_frozen(self):
-        """
-        Does the board contain only frozen cards (No new card was put on the board
-        this turn)?
-        """
-        frozen = True
-        for stack in self.stacks:
-            frozen &= stack.is_frozen()
-        return frozen
-
     def select_winner(self, player):
-        self.winner = player
+        super().select_winner(player)
         s = self.big_font.render(f"HRAC {player} VYHRAL", True, TEXT_COLOR)
         x = self.screen.get_width() / 2 - s.get_width() / 2
         y = self.screen.get_height() / 2 - s.get_height() / 2
         self.win_screen.blit(s, (x, y))
 
     def end_turn(self):
-        """
-        End turn
+        super().end_turn()
+        gamelog.event(gamelog.game_logger, logging.INFO, "turn", "Player %d",
+                      self.player, player=self.player)
 
-        Checks if the current hand isn't empty, possibly choosing the current
-        player as winner. Then switches the players. Finally, freezes cards on
-        the board.
-        """
-
-        if self.pickup.has_card():
-            card = self.pickup.pop()
-            self.hand.add(card)
-
-        if self.winner is None and self.hand.is_empty():
-            self.select_winner(self.player)
-
-        if self.player == 1:
-            self.player = 2
-            self.pickup = self.pickup2
-            self.hand = self.hand2
-        else:
-            self.player = 1
-            self.pickup = self.pickup1
-            self.hand = self.hand1
-        print(f"\nPlayer {self.player}")
-
-        # Freeze all cards on the board
-        for stack in self.stacks:
-            stack.freeze()
+        self.clear_hint()
+        self.prepare_hint()
+        self.ponder_turn()
 
+    @profiling.timed("game.update_end_turn_button")
     def update_end_turn_button(self):
-        if self.board_is_valid():
-            self.end_turn_button.set_board_valid()
-        else:
-            self.end_turn_button.unset_board_valid()
-        if self.board_is_frozen() and not self.deck.is_empty():
-            self.end_turn_button.set_card_draw_needed()
-        else:
-            self.end_turn_button.unset_card_draw_needed()
-
         if self.gamemode == AI_VS_AI:
-            player = BOT1_NAME if self.player == 1 else BOT2_NAME
-            self.end_turn_button.set_player_name(player)
+            strategy = self.strategies[self.player - 1]
+            player_name = f"{strategy.name} BOT ({self.get_speed_label()})"
         else:
-            self.end_turn_button.set_player_name(f"hrac {self.player}")
-
-    ###################################
-    # API FOR MANIPULATING GAME STATE #
-    ###################################
+            player_name = f"hrac {self.player}"
+        self.end_turn_button.set_state(
+                self.board_is_valid(),
+                self.board_is_frozen() and not self.deck.is_empty(),
+                player_name
+        )
 
-    def try_end_turn(self):
-        """
-        Try to end the turn. This can have 3 results:
-        - The turn just ends
-        - The current player draws a card and the turn ends
-        - The turn doesn't end
+    def _state_changed(self):
+        self.update_end_turn_button()
+        self.ponder_current_board()
 
-        If there is a card in pickup area, we put it into the hand. If that
-        isn't possible, the turn cannot end.
 
-        If the turn ends, return True, otherwise return False
+    def iter_ai_turn(self, verbose=True):
+        """
+        Let the AI play the turn of the player on turn, yielding after each
+        move. The moves are made as the strategy finds them (see
+        Strategy.iter_moves()). Unless 'verbose' is False, log the moves.
         """
-        if self.pickup.has_card():
-            if not self.try_put_card_into_hand():
-                return False
-
-        if self.board_is_valid():
-            if self.board_is_frozen():
-                if not self.deck.is_empty():
-                    # Draw a card first
-                    card = self.deck.pop()
-                    self.hand.add(card)
-                self.end_turn()
-                self.update_end_turn_button()
+        strategy = self.strategies[self.player - 1]
+        match = Match.from_game(self)
+        moves = None
+        if self.ponderer is not None:
+            moves = self.ponderer.take(match)
+        pondered = moves is not None
+        if not pondered:
+            moves = strategy.iter_moves(match)
+        yield from ai.iter_apply_moves(moves, self, verbose)
+        if verbose:
+            # The strategy makes its statistics anew while finding the moves
+            if pondered:
+                name, stats = f"{strategy.name} (pondered)", self.ponderer.stats
             else:
-                self.end_turn()
-                self.update_end_turn_button()
+                name, stats = strategy.name, strategy.stats
+            gamelog.event(gamelog.game_logger, logging.INFO, "strategy_stats",
+                          "%s: %s", name, stats, strategy=name, stats=stats)
+        self._ai_turns += 1
+
+    def step_ai_turn(self, verbose=True):
+        """
+        Make the next move of the AI turn in progress, starting a turn if
+        there is none. Called once per frame, so the first card of the AI
+        lands on the board as soon as it is found. Returns True if the turn
+        has ended.
+        """
+        if self._ai_turn is None:
+            self._ai_turn = self.iter_ai_turn(verbose)
+        if next(self._ai_turn, None) is None:
+            self._ai_turn = None
             return True
         return False
 
-    def try_take_card_from_stack(self, card, stack):
+    def play_ai_turn(self, verbose=True):
         """
-        Try to take a given card from a given stack widget and put it into the
-        pickup area.
-
-        Returns True on success, otherwise False
+        Let the AI play the (rest of the) turn of the player on turn at once.
         """
-        if self.pickup.has_card() or not stack.has_card(card):
-            return False
-        stack.remove(card)
-        self.pickup.put(card)
-        self.update_end_turn_button()
-        return True
+        while not self.step_ai_turn(verbose):
+            pass
 
-    def try_take_card_from_hand(self, card):
-        """
-        Try to take a given card from hand and put it into the pickup area.
+    ##################
+    # AI VS AI SPEED #
+    ##################
 
-        Returns True on success, otherwise False
+    def get_speed(self):
         """
-        if self.pickup.has_card() or not self.hand.has_card(card):
-            return False
-        self.hand.remove(card)
-        self.pickup.put(card)
-        self.update_end_turn_button()
-        return True
-
-    def try_put_card_onto_stack(self, stack):
+        Return the speed of an AI vs AI game -- a multiple of the normal speed
+        (one turn per AI_VS_AI_TURN_DELAY) or 0 for the maximum speed.
         """
-        Try to take the card in the pickup area and put it onto a given stack.
+        return AI_VS_AI_SPEEDS[self._speed_index]
 
-        Returns True on success, otherwise False
-        """
-        if not self.pickup.has_card():
-            return False
-        stack.add(self.pickup.pop())
+    def get_speed_label(self):
+        return f"{self.get_speed()}x" if self.get_speed() else "max"
+
+    def set_speed_index(self, i):
+        self._speed_index = i
+        self._next_ai_turn = 0
+        gamelog.event(gamelog.game_logger, logging.INFO, "speed", "Speed %s",
+                      self.get_speed_label(), speed=self.get_speed())
         self.update_end_turn_button()
-        return True
 
-    def try_put_card_into_hand(self):
-        """
-        Try to take the card in the pickup area and put it into hand.
+    def cycle_render_mode(self):
+        i = AI_VS_AI_RENDER_MODES.index(self._render_mode)
+        self._render_mode = AI_VS_AI_RENDER_MODES[
+            (i + 1) % len(AI_VS_AI_RENDER_MODES)]
+        gamelog.event(gamelog.game_logger, logging.INFO, "render_mode",
+                      "Rendering %s", self._render_mode,
+                      render_mode=self._render_mode)
 
-        Returns True on success, otherwise False
+    def should_render(self):
         """
-        if not self.pickup.has_card() or self.pickup.get().is_frozen():
-            return False
-        self.hand.add(self.pickup.pop())
-        self.update_end_turn_button()
-        return True
-
-    def find_stack_containing_cards(self, cards):
+        Should the current frame be drawn? In AI vs AI games this depends on
+        the render mode -- every frame, only every AI_VS_AI_RENDER_EVERY-th
+        turn or only the final position.
         """
-        Try to find a Stack widget containing exactly Card objects present in
-        the given cards list. Assume no card is present twice in the cards
-        list. Assume that for each Stack widget, no card is present twice in
-        it.
+        if self.gamemode != AI_VS_AI or self.winner is not None \
+                or self._render_mode == "all":
+            return True
+        if self._render_mode == "every_nth":
+            return self._ai_turns >= self._rendered_turns \
+                + AI_VS_AI_RENDER_EVERY
+        return False # Only the final position
 
-        Return the Stack widget on success or None on failure.
+    def play_ai_vs_ai(self):
         """
-        for stack in self.stacks:
-            if len(cards) != stack.size():
-                continue
-
-            this_one = True
-            for card in cards:
-                if not stack.has_card(card):
-                    this_one = False
-                    break
-
-            if this_one:
-                return stack
-
-        return None
-
-    def get_random_empty_stack(self):
+        Play AI vs AI turns due in this frame. At the maximum speed, play
+        turns until the time of a frame is used up.
         """
-        Return a random empty Stack widget or None if there aren't any.
+        if self.winner is not None:
+            return
+        speed = self.get_speed()
+        now = pygame.time.get_ticks()
+        if speed:
+            if self._ai_turn is not None or now >= self._next_ai_turn:
+                if self.step_ai_turn():
+                    self._next_ai_turn = now + AI_VS_AI_TURN_DELAY / speed
+            return
+
+        deadline = now + 1000 / FPS
+        while self.winner is None and pygame.time.get_ticks() < deadline:
+            self.play_ai_turn(verbose=False)
+
+    #############
+    # PONDERING #
+    #############
+
+    def ponder_turn(self):
         """
-        empty_stacks = [s for s in self.stacks if s.is_empty()]
-        return empty_stacks[randint(0, len(empty_stacks) - 1)]
-
-    def get_state_copy(self):
+        Let the AI start pondering the turn of its human opponent which has
+        just started (see the ponder module).
         """
-        Return a tuple representing the current state of the game. 
-
-        (
-            set of Cards in hand
-            set of *nonempty* stacks {
-                stack1 (tuple of Cards),
-                stack2 (tuple of Cards),
-                ...
-            }
-        )
+        if self.ponderer is not None and self.human_on_turn() \
+                and self.winner is None:
+            self.ponderer.ponder_turn(Match.from_game(self))
 
-        Intended for use in AI.
+    def ponder_current_board(self):
+        """
+        Let the AI ponder its human opponent ending the turn with the current
+        board. Called after each change of the game state, so only boards the
+        turn could end with are pondered.
+        """
+        if self.ponderer is None or not self.human_on_turn() \
+                or self.winner is not None or self.pickup.has_card():
+            return
+        # A frozen board means drawing a card, pondered by ponder_turn()
+        if not self.board_is_valid() or self.board_is_frozen():
+            return
+        match = Match.from_game(self)
+        match.end_turn(draw=False)
+        self.ponderer.ponder(match)
+
+    #########
+    # HINTS #
+    #########
+
+    def human_on_turn(self):
+        return not self.is_ai(self.player)
+
+    def can_hint(self):
+        """
+        Hints are given only to human players and only when the board is in a
+        state the AI can work with (no card in the pickup area, valid stacks).
         """
-        hand = self.hand.get_state_copy()
+        return self.human_on_turn() and self.winner is None \
+            and not self.pickup.has_card() and self.board_is_valid()
 
-        stacks = set()
-        for stack in self.stacks:
-            s = stack.get_state_copy()
-            if s:
-                stacks.add(s)
+    def prepare_hint(self):
+        """
+        Start computing a hint for the current state in the background (see
+        the hints module) so that it is ready when the player asks for it.
+        """
+        if self.can_hint():
+            self.hints.request(Position.from_game(self))
 
-        return (hand, stacks)
+    def show_hint(self):
+        """
+        Show the hint for the current state if it's ready. Otherwise wait for
+        it (see update_hint()).
+        """
+        if not self.can_hint():
+            self.hint_button.set_text("nelze")
+            return
+        self.prepare_hint()
+        self._hint_wanted = True
+        self.update_hint()
+
+    def update_hint(self):
+        """
+        Show the hint the player asked for once it has been computed.
+        """
+        if not self._hint_wanted:
+            return
+        position = Position.from_game(self)
+        moves = self.hints.get(position)
+        if moves is None:
+            # A stale hint might have been thrown away, ask again
+            self.prepare_hint()
+            self.hint_button.set_text("pocitam...")
+            return
+        self._hint_wanted = False
+
+        num_applied = position.num_applied()
+        for i, move in enumerate(moves):
+            if not position.apply(move):
+                moves = moves[:i]
+                break
+        placed = [c for c in self.hand.get_state_copy()
+                  if c not in position.hand]
+        position.undo_to(num_applied)
+
+        self.hand.set_highlighted(placed)
+        self.hint_button.set_text(f"vylozit {len(placed)} karet")
+        ai.log_moves(moves)
+
+    def clear_hint(self):
+        self._hint_wanted = False
+        self.hand1.set_highlighted([])
+        self.hand2.set_highlighted([])
+        self.hint_button.set_text("")
 
     #####################################
     # MOUSE, DRAWING AND MAIN GAME LOOP #
     #####################################
 
     def process_mouse_click(self, pos):
+        if self.hint_button.collidepoint(pos):
+            self.show_hint()
+            return
+        self.clear_hint()
         if self.end_turn_button.collidepoint(pos):
             self.try_end_turn()
         else:
@@ -342,65 +410,75 @@ class Game:
                             if card:
                                 self.try_take_card_from_stack(card, stack)
 
+    @profiling.timed("game.draw")
     def draw(self):
         self.screen.fill(BG_COLOR)
 
-        self.pickup1.draw(self.screen)
-        self.hand1.draw(self.screen)
-        self.pickup2.draw(self.screen)
-        self.hand2.draw(self.screen)
-        for stack in self.stacks:
-            stack.draw(self.screen)
-        self.deck.draw(self.screen)
-        self.end_turn_button.draw(self.screen)
+        # All widgets are drawn by a single call of blits()
+        widgets_to_draw = [self.pickup1, self.hand1, self.pickup2, self.hand2]
+        widgets_to_draw += self.stacks
+        widgets_to_draw += [self.deck, self.end_turn_button]
+        if self.gamemode != AI_VS_AI:
+            widgets_to_draw.append(self.hint_button)
 
+        blits = []
+        for widget in widgets_to_draw:
+            blits.extend(widget.get_blits())
         if self.winner is not None:
-            self.screen.blit(self.win_screen, (0, 0))
+            blits.append((self.win_screen, (0, 0)))
+        self.screen.blits(blits, doreturn=False)
+        profiling.count("game.draw.blits", len(blits))
+
+        if profiling.ENABLED:
+            profiling.draw_overlay(self.screen, self.font)
 
         pygame.display.flip()
 
     def run(self):
-        self.player = 1 # 1 or 2
-        self.pickup = self.pickup1
-        self.hand = self.hand1
-
         self.update_end_turn_button()
+        self.prepare_hint()
+        self.ponder_turn()
 
         self.draw()
+        profiling.mark("startup.time_to_first_frame", self._created)
+        self._next_ai_turn = pygame.time.get_ticks() + AI_VS_AI_TURN_DELAY
 
         clock = pygame.time.Clock()
-        ai_timer_running = False
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    raise SystemExit
-                if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
-                    pos = pygame.mouse.get_pos()
-                    if self.gamemode == PLAYER_VS_PLAYER:
-                        self.process_mouse_click(pos)
-                    elif self.gamemode == PLAYER_VS_AI:
-                        if self.player == 1:
+            with profiling.timer("game.events"):
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        pygame.quit()
+                        raise SystemExit
+                    if event.type == pygame.MOUSEBUTTONUP \
+                            and event.button == 1:
+                        pos = pygame.mouse.get_pos()
+                        if self.gamemode == PLAYER_VS_PLAYER:
                             self.process_mouse_click(pos)
-                    else: # gamemode AI_VS_AI
-                        pass
-                if event.type == pygame.USEREVENT:
-                    ai_timer_running = False
-                    moves = ai.generate_moves(self)
-                    ai.print_moves(moves)
-                    ai.apply_moves(moves, self)
+                        elif self.gamemode == PLAYER_VS_AI:
+                            if self.player == 1:
+                                self.process_mouse_click(pos)
+                        else: # gamemode AI_VS_AI
+                            pass
+                    if event.type == pygame.KEYDOWN \
+                            and self.gamemode == AI_VS_AI:
+                        # Keys 1, 2, ... choose the speed, R the rendering
+                        i = event.key - pygame.K_1
+                        if 0 <= i < len(AI_VS_AI_SPEEDS):
+                            self.set_speed_index(i)
+                        elif event.key == pygame.K_r:
+                            self.cycle_render_mode()
 
             if self.gamemode == PLAYER_VS_AI and self.player == 2:
-                moves = ai.generate_moves(self)
-                ai.print_moves(moves)
-                ai.apply_moves(moves, self)
-
-            if self.gamemode == AI_VS_AI \
-                    and not ai_timer_running \
-                    and self.winner is None:
-                event = pygame.event.Event(pygame.USEREVENT)
-                pygame.time.set_timer(event, AI_VS_AI_TURN_DELAY, loops=1)
-                ai_timer_running = True
-
-            self.draw()
+                self.step_ai_turn()
+
+            if self.gamemode == AI_VS_AI:
+                self.play_ai_vs_ai()
+
+            self.update_hint()
+
+            if self.should_render():
+                self.draw()
+                self._rendered_turns = self._ai_turns
+            profiling.end_frame()
             clock.tick(FPS)
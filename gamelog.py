@@ -0,0 +1,84 @@
+"""
+Logging
+
+This file contains the logging of the game. Instead of printing, the game
+and the AI log events using the logging module under the "vatikan" logger:
+- vatikan.moves ... moves of the AI and hints (INFO)
+- vatikan.game ... turns, statistics of strategies, settings (INFO)
+- vatikan.ai ... failed moves of the AI (WARNING)
+
+Each record carries a structured event -- a dict with the name of the event
+under "event" and its fields (see event()). In the JSON lines format (see
+the LOG_FORMAT config constant) a record is written as one JSON object per
+line, so logs of games can be processed by other programs.
+
+The records are handed over to a background thread through a queue (see
+setup()), so the game loop never waits for the console. Programs which don't
+call setup() (e.g. simulations) log only warnings and events below that
+level aren't even built.
+"""
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+from config import *
+
+moves_logger = logging.getLogger("vatikan.moves")
+game_logger = logging.getLogger("vatikan.game")
+ai_logger = logging.getLogger("vatikan.ai")
+
+def event(logger, level, name, msg, *args, **fields):
+    """
+    Log the event 'name' with the given fields. The message is formatted by
+    the args only when it's written. Nothing is done if the logger doesn't
+    log the level.
+    """
+    if logger.isEnabledFor(level):
+        fields["event"] = name
+        logger.log(level, msg, *args, extra={"event": fields})
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object with the time, the level, the logger,
+    the message and the fields of the event of the record.
+    """
+    def format(self, record):
+        data = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, "event", {}))
+        return json.dumps(data, default=str)
+
+def setup(level=LOG_LEVEL, log_format=LOG_FORMAT, file=LOG_FILE):
+    """
+    Start writing the log of the given level and above in the given format
+    ("text" or "json") into the file (None ... stdout). Records are written
+    by a background thread, which is stopped (and the queue flushed) at exit.
+
+    Returns the logging.handlers.QueueListener writing the records.
+    """
+    if file is None:
+        handler = logging.StreamHandler(sys.stdout)
+    else:
+        handler = logging.FileHandler(file)
+    if log_format == "json":
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    logger = logging.getLogger("vatikan")
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,63 @@
+"""
+Hints
+
+This file contains the hint engine suggesting moves to human players. The
+moves are generated by the AI (see ai.plan_moves()) in a background thread, so
+the UI keeps running while they are being computed. The Game class asks for a
+hint speculatively as soon as a turn of a human player starts, so by the time
+the player clicks the hint button, the hint is usually ready.
+
+Hints are cached by the hash of the position (see Position.get_hash()). When
+the board or the hand changes, the hash changes and a new hint is computed.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import *
+import ai
+
+class HintEngine:
+    def __init__(self, cache_size=HINT_CACHE_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._cache_size = cache_size
+        # Hash of a position -> Future of the moves. Least recently used first
+        self._futures = OrderedDict()
+
+    def request(self, position):
+        """
+        Start computing a hint for the position (class Position) unless it is
+        cached or already being computed. The position is handed over to the
+        background thread, so it mustn't be used afterwards.
+        """
+        key = position.get_hash()
+        if key in self._futures:
+            self._futures.move_to_end(key)
+            return
+        self._futures[key] = self._executor.submit(self._compute, position)
+        while len(self._futures) > self._cache_size:
+            self._futures.popitem(last=False)
+
+    def get(self, position):
+        """
+        Return the hint (list of moves, see ai.generate_moves()) for the
+        position or None if it isn't ready. Call request() first (with another
+        Position object of the same state).
+        """
+        future = self._futures.get(position.get_hash())
+        if future is None or not future.done():
+            return None
+        moves = future.result()
+
+        # Different copies of the same cards have the same hash. Check that
+        # the moves use the cards of this position
+        num_applied = position.num_applied()
+        ok = all([position.apply(move) for move in moves])
+        position.undo_to(num_applied)
+        if not ok:
+            del self._futures[position.get_hash()]
+            return None
+        return moves
+
+    def _compute(self, position):
+        return ai.plan_moves(position)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""
+Load generator for the game server
+
+This file plays many games on the game server (see server.py) at once and
+reports the latency of the actions -- the time from sending a request to
+receiving its response. The games are spread over a number of connections.
+In each turn a player takes a card from hand, puts it onto an empty stack,
+takes it back, returns it to hand and ends the turn. In games against the AI
+the player then waits for the AI to finish its turn.
+
+Usage: python3 loadgen.py [-h] [-g GAMES] [-c CONNECTIONS] [-t TURNS] [--ai]
+                          [--host HOST] [--port PORT]
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from config import *
+
+class Connection:
+    """
+    A connection to the server multiplexing requests of many games. Responses
+    are matched with requests by ids, pushed updates are passed to the games.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._pending = {} # Request id -> future of the response
+        self._updates = {} # Game id -> queue of pushed diffs
+        self.latencies = [] # Seconds
+        self._receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       limit=2 ** 20)
+        return cls(reader, writer)
+
+    async def request(self, **request):
+        request["id"] = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request["id"]] = future
+        start = time.perf_counter()
+        self._writer.write(json.dumps(request).encode() + b"\n")
+        response = await future
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def updates(self, game_id):
+        return self._updates.setdefault(game_id, asyncio.Queue())
+
+    async def _receive(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if "event" in message:
+                self.updates(message["game"]).put_nowait(message["diff"])
+            else:
+                self._pending.pop(message["id"]).set_result(message)
+
+    async def close(self):
+        self._receiver.cancel()
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+def apply_diff(state, diff):
+    for key, value in diff.items():
+        if key == "stacks":
+            for i, stack in value.items():
+                state["stacks"][int(i)] = stack
+        else:
+            state[key] = value
+
+async def play_game(connection, turns, against_ai, rnd):
+    """
+    Play a game for the given number of turns (or until it ends).
+    """
+    mode = "player_vs_ai" if against_ai else "player_vs_player"
+    response = await connection.request(action="new_game", mode=mode)
+    game = response["game"]
+    state = {"stacks": [[] for s in response["diff"]["stacks"]]}
+    apply_diff(state, response["diff"])
+    updates = connection.updates(game)
+
+    async def act(**request):
+        response = await connection.request(game=game, **request)
+        if "diff" in response:
+            apply_diff(state, response["diff"])
+        return response
+
+    for turn in range(turns):
+        if state["winner"] is not None:
+            break
+        hand = state["hand1"] if state["player"] == 1 else state["hand2"]
+        empty = [i for i, s in enumerate(state["stacks"]) if not s]
+        if hand and empty:
+            card = rnd.choice(hand)
+            stack = rnd.choice(empty)
+            await act(action="take_card_from_hand", card=card)
+            await act(action="put_card_onto_stack", stack=stack)
+            await act(action="take_card_from_stack", card=card, stack=stack)
+            await act(action="put_card_into_hand")
+        await act(action="end_turn")
+
+        # Wait for the AI to finish its turn
+        while against_ai and state["player"] == 2 \
+                and state["winner"] is None:
+            apply_diff(state, await updates.get())
+
+    await connection.request(action="close_game", game=game)
+
+async def run(games, connections, turns, against_ai, host, port, seed=0):
+    """
+    Play the games and return a tuple (list of latencies in seconds, total
+    seconds).
+    """
+    start = time.perf_counter()
+    conns = [await Connection.open(host, port) for i in range(connections)]
+    rnd = random.Random(seed)
+    await asyncio.gather(*[
+        play_game(conns[i % connections], turns, against_ai,
+                  random.Random(rnd.random()))
+        for i in range(games)
+    ])
+    elapsed = time.perf_counter() - start
+    latencies = []
+    for conn in conns:
+        latencies.extend(conn.latencies)
+        await conn.close()
+    return latencies, elapsed
+
+def percentile(sorted_values, p):
+    i = min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))
+    return sorted_values[i]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="Measure action latency of the game server.")
+    parser.add_argument("-g", "--games", type=int, default=100,
+                        help="number of concurrent games")
+    parser.add_argument("-c", "--connections", type=int, default=10)
+    parser.add_argument("-t", "--turns", type=int, default=20,
+                        help="turns played in each game")
+    parser.add_argument("--ai", action="store_true",
+                        help="play against the AI")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    latencies, elapsed = asyncio.run(run(args.games,
+                                         min(args.connections, args.games),
+                                         args.turns, args.ai, args.host,
+                                         args.port))
+    latencies.sort()
+    print(f"{args.games} games, {len(latencies)} actions in {elapsed:.2f} s "
+          + f"({len(latencies) / elapsed:.0f} actions/s)")
+    print(f"p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+          + f"p99 {percentile(latencies, 99) * 1000:.2f} ms, "
+          + f"max {latencies[-1] * 1000:.2f} ms")
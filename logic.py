@@ -0,0 +1,577 @@
+"""
+Game logic
+
+This file contains the state of a game and the API for manipulating it,
+independent of pygame. The GameLogic class holds the board, the hands, the
+pickup areas and the deck and implements the rules: which cards can be moved
+where and when a turn can end. The Game class (see the game module) extends it
+by the UI and the widgets extend the state containers defined here by drawing.
+Without the UI, games can be hosted headless (see the server module).
+
+The containers are
+- StackState ... a stack on the board
+- HandState ... the hand of a player
+- PickUpAreaState ... the card a player holds while moving it
+- DeckState ... the shuffled cards to be drawn
+
+The containers and the cards use __slots__ and keep no pygame objects so that
+a server can host many games at once (see membench.py).
+"""
+
+from random import shuffle, randint
+
+from config import *
+from card import Card
+import util
+import profiling
+
+NUM_STACKS = (COLUMNS_OF_STACKS - 1) * ROWS_OF_STACKS # One column is the deck
+
+# Shared by all empty stacks, most of the board is empty (see StackState)
+_EMPTY_CARDS = ()
+_EMPTY_COUNTS = util.CardCounts()
+
+class StackState:
+    __slots__ = ("_cards", "_cards_with_missing", "_counts", "_is_valid")
+
+    def __init__(self):
+        # Contains just cards, no missing markers. An empty stack shares the
+        # empty cards and counts with the others until a card is added
+        self._cards = _EMPTY_CARDS
+        # Sorted cards, contains missing markers. Derived from the cards only
+        # when needed (see get_cards_with_missing()), None when outdated
+        self._cards_with_missing = None
+        self._counts = _EMPTY_COUNTS
+        self._is_valid = True # Is empty or contains a flush or a triplet
+
+    def is_empty(self):
+        return not self._cards
+
+    def size(self):
+        return len(self._cards)
+
+    def has_card(self, card):
+        if not self._counts.has(card.color, card.rank):
+            return False
+        return card in self._cards
+
+    def get_counts(self):
+        """
+        Return the util.CardCounts of cards in the stack.
+        """
+        return self._counts
+
+    def add(self, card):
+        """
+        Add a card onto the stack.
+        """
+        if not self._cards:
+            self._cards = []
+            self._counts = util.CardCounts()
+        self._cards.append(card)
+        self._counts.add(card)
+        self._update()
+    
+    def remove(self, card):
+        """
+        Remove given card from stack.
+        """
+        self._cards.remove(card)
+        self._counts.remove(card)
+        if not self._cards:
+            self._cards = _EMPTY_CARDS
+            self._counts = _EMPTY_COUNTS
+        self._update()
+
+    @profiling.counted("logic.StackState.update")
+    def _update(self):
+        """
+        Update validity after a change. Works with the bitmasks of the counts
+        of cards in constant time, even with jokers (see
+        util.is_valid_layout()).
+        """
+        self._cards_with_missing = None
+        counts = self._counts
+        self._is_valid = util.is_valid_layout(counts.size, counts.jokers,
+                                              counts.colors, counts.ranks)
+
+    def _is_flush_like(self):
+        """
+        Are all cards of the same color and of different ranks?
+        """
+        counts = self._counts
+        return util.popcount(counts.colors) == 1 \
+            and util.popcount(counts.ranks) == counts.size
+
+    def get_cards_with_missing(self):
+        """
+        Return the cards sorted the way they are drawn -- flushes by ranks
+        with "missing card" markers (None) in gaps. Jokers take the places of
+        the markers (see util.attempt_construct_flush()).
+        """
+        if self._cards_with_missing is None:
+            size = self._counts.size
+            if self._counts.jokers:
+                stack = util.attempt_construct_valid_stack(self._cards)
+                if stack is None:
+                    stack = self._cards
+                self._cards_with_missing = list(stack)
+            elif size >= 3 and self._is_flush_like():
+                gaps, start = util.rank_mask_layout(self._counts.ranks)
+                ring = [None] * len(RANKS)
+                for card in self._cards:
+                    ring[RANKS.index(card.rank)] = card
+                ring = ring[start:] + ring[:start]
+                self._cards_with_missing = ring[:size + gaps]
+            else:
+                self._cards_with_missing = list(self._cards)
+        return self._cards_with_missing
+
+    def is_valid(self):
+        return self._is_valid
+
+    def freeze(self):
+        for card in self._cards:
+            card.freeze()
+
+    def is_frozen(self):
+        """
+        Does the stack contain only frozen cards (No new card was put in the
+        stack this turn)?
+        """
+        frozen = True
+        for card in self._cards:
+            frozen &= card.is_frozen()
+        return frozen
+
+    def get_state_copy(self):
+        return tuple(self._cards)
+
+
+class HandState:
+    __slots__ = ("_cards", "_counts")
+
+    def __init__(self):
+        self._cards = []
+        self._counts = util.CardCounts()
+
+    def has_card(self, card):
+        if not self._counts.has(card.color, card.rank):
+            return False
+        return card in self._cards
+
+    def get_counts(self):
+        """
+        Return the util.CardCounts of cards in the hand.
+        """
+        return self._counts
+
+    def add(self, card):
+        self._cards.append(card)
+        self._counts.add(card)
+
+    def remove(self, card):
+        self._cards.remove(card)
+        self._counts.remove(card)
+
+    def is_empty(self):
+        return len(self._cards) == 0
+
+    def size(self):
+        return len(self._cards)
+
+    def get_state_copy(self):
+        return set(self._cards)
+
+class PickUpAreaState:
+    __slots__ = ("_card",)
+
+    def __init__(self):
+        self._card = None
+
+    def has_card(self):
+        return not self._card is None
+
+    def put(self, card):
+        self._card = card
+
+    def get(self):
+        return self._card
+
+    def pop(self):
+        card = self._card
+        self._card = None
+        return card
+
+class DeckState:
+    __slots__ = ("_cards",)
+
+    def __init__(self):
+        """
+        Fill the deck with cards (and jokers if playing with them) and shuffle
+        it
+        """
+        self._cards = []
+        for color in COLORS:
+            for rank in RANKS:
+                # Each card two times
+                self._cards.append(Card(color, rank, 0))
+                self._cards.append(Card(color, rank, 1))
+        if JOKERS:
+            for i in range(NUM_JOKERS):
+                self._cards.append(Card(JOKER, JOKER, i))
+        shuffle(self._cards)
+
+    def is_empty(self):
+        return not self._cards
+
+    def size(self):
+        return len(self._cards)
+
+    def get_state_copy(self):
+        return list(self._cards)
+
+    def pop(self):
+        if self._cards:
+            return self._cards.pop()
+        else:
+            return None
+
+class GameLogic:
+    __slots__ = ("gamemode", "stacks", "hand1", "hand2", "pickup1", "pickup2",
+                 "deck", "player", "pickup", "hand", "winner", "_undo_log",
+                 "_defer_changes", "_changes_deferred")
+
+    def __init__(self, gamemode, stacks, hand1, hand2, pickup1, pickup2,
+                 deck):
+        """
+        gamemode ... PLAYER_VS_PLAYER, PLAYER_VS_AI or AI_VS_AI
+        stacks ... list of empty StackStates
+        hand1, hand2 ... empty HandStates of the bottom and the top player
+        pickup1, pickup2 ... empty PickUpAreaStates of the players
+        deck ... full DeckState
+
+        Deals the starting hands. Player 1 starts.
+        """
+        self.gamemode = gamemode
+        self.stacks = stacks
+        self.hand1 = hand1
+        self.hand2 = hand2
+        self.pickup1 = pickup1
+        self.pickup2 = pickup2
+        self.deck = deck
+
+        # Put starting cards into players' hands
+        for i in range(STARTING_HAND_NUM_CARDS):
+            card = self.deck.pop()
+            self.hand1.add(card)
+            card = self.deck.pop()
+            self.hand2.add(card)
+
+        self.player = 1 # 1 or 2
+        self.pickup = self.pickup1
+        self.hand = self.hand1
+        self.winner = None
+
+        # When a transaction is running, contains the changes made by the API
+        # for manipulating the game state so that they can be taken back
+        self._undo_log = None
+        # Is the transaction deferring calls of _state_changed() and was any
+        # call deferred?
+        self._defer_changes = False
+        self._changes_deferred = False
+
+    @classmethod
+    def new(cls, gamemode=PLAYER_VS_PLAYER):
+        """
+        Create a headless game.
+        """
+        stacks = [StackState() for i in range(NUM_STACKS)]
+        return cls(gamemode, stacks, HandState(), HandState(),
+                   PickUpAreaState(), PickUpAreaState(), DeckState())
+
+    def board_is_valid(self):
+        valid = True
+        for stack in self.stacks:
+            valid &= stack.is_valid()
+        if self.pickup.has_card():
+            valid &= not self.pickup.get().is_frozen()
+        return valid
+
+    def board_is_frozen(self):
+        """
+        Does the board contain only frozen cards (No new card was put on the board
+        this turn)?
+        """
+        frozen = True
+        for stack in self.stacks:
+            frozen &= stack.is_frozen()
+        return frozen
+
+    def is_ai(self, player):
+        """
+        Is the given player (1 or 2) played by the AI?
+        """
+        if self.gamemode == AI_VS_AI:
+            return True
+        return self.gamemode == PLAYER_VS_AI and player == 2
+
+    def select_winner(self, player):
+        self.winner = player
+
+    def end_turn(self):
+        """
+        End turn
+
+        Checks if the current hand isn't empty, possibly choosing the current
+        player as winner. Then switches the players. Finally, freezes cards on
+        the board.
+        """
+
+        if self.pickup.has_card():
+            card = self.pickup.pop()
+            self.hand.add(card)
+
+        if self.winner is None and self.hand.is_empty():
+            self.select_winner(self.player)
+
+        if self.player == 1:
+            self.player = 2
+            self.pickup = self.pickup2
+            self.hand = self.hand2
+        else:
+            self.player = 1
+            self.pickup = self.pickup1
+            self.hand = self.hand1
+
+        # Freeze all cards on the board
+        for stack in self.stacks:
+            stack.freeze()
+
+    def _state_changed(self):
+        """
+        Called after each change made through the API below. Subclasses can
+        react to it (e.g. by updating the UI). Transactions may defer the
+        calls (see begin_transaction()).
+        """
+        pass
+
+    def _changed(self):
+        """
+        Call _state_changed() or remember to call it at the end of the
+        transaction deferring it.
+        """
+        if self._defer_changes:
+            self._changes_deferred = True
+        else:
+            self._state_changed()
+
+    ###################################
+    # API FOR MANIPULATING GAME STATE #
+    ###################################
+
+    def try_end_turn(self):
+        """
+        Try to end the turn. This can have 3 results:
+        - The turn just ends
+        - The current player draws a card and the turn ends
+        - The turn doesn't end
+
+        If there is a card in pickup area, we put it into the hand. If that
+        isn't possible, the turn cannot end.
+
+        If the turn ends, return True, otherwise return False
+        """
+        if self._undo_log is not None:
+            return False
+        if self.pickup.has_card():
+            if not self.try_put_card_into_hand():
+                return False
+
+        if self.board_is_valid():
+            if self.board_is_frozen():
+                if not self.deck.is_empty():
+                    # Draw a card first
+                    card = self.deck.pop()
+                    self.hand.add(card)
+                self.end_turn()
+                self._changed()
+            else:
+                self.end_turn()
+                self._changed()
+            return True
+        return False
+
+    def try_take_card_from_stack(self, card, stack):
+        """
+        Try to take a given card from a given stack and put it into the
+        pickup area.
+
+        Returns True on success, otherwise False
+        """
+        if self.pickup.has_card() or not stack.has_card(card):
+            return False
+        stack.remove(card)
+        self.pickup.put(card)
+        self._log_change("take card from stack", card, stack)
+        self._changed()
+        return True
+
+    def try_take_card_from_hand(self, card):
+        """
+        Try to take a given card from hand and put it into the pickup area.
+
+        Returns True on success, otherwise False
+        """
+        if self.pickup.has_card() or not self.hand.has_card(card):
+            return False
+        self.hand.remove(card)
+        self.pickup.put(card)
+        self._log_change("take card from hand", card)
+        self._changed()
+        return True
+
+    def try_put_card_onto_stack(self, stack):
+        """
+        Try to take the card in the pickup area and put it onto a given stack.
+
+        Returns True on success, otherwise False
+        """
+        if not self.pickup.has_card():
+            return False
+        card = self.pickup.pop()
+        stack.add(card)
+        self._log_change("put card onto stack", card, stack)
+        self._changed()
+        return True
+
+    def try_put_card_into_hand(self):
+        """
+        Try to take the card in the pickup area and put it into hand.
+
+        Returns True on success, otherwise False
+        """
+        if not self.pickup.has_card() or self.pickup.get().is_frozen():
+            return False
+        card = self.pickup.pop()
+        self.hand.add(card)
+        self._log_change("put card into hand", card)
+        self._changed()
+        return True
+
+    def begin_transaction(self, defer_changes=False):
+        """
+        Start recording changes made through the methods above so that they
+        can be taken back by rollback_transaction(). Ending the turn isn't
+        allowed while a transaction is running.
+
+        If 'defer_changes' is True, _state_changed() (e.g. updating the UI)
+        isn't called after each change but only once when the transaction
+        ends or when flush_changes() is called.
+        """
+        self._undo_log = []
+        self._defer_changes = defer_changes
+        self._changes_deferred = False
+
+    def flush_changes(self):
+        """
+        Make the deferred call of _state_changed() now (if there were any
+        changes). The transaction goes on deferring.
+        """
+        if self._changes_deferred:
+            self._changes_deferred = False
+            self._state_changed()
+
+    def commit_transaction(self):
+        """
+        Keep the changes made during the transaction.
+        """
+        self._undo_log = None
+        self._defer_changes = False
+        self.flush_changes()
+
+    def rollback_transaction(self):
+        """
+        Take back all changes made during the transaction.
+        """
+        while self._undo_log:
+            change = self._undo_log.pop()
+            card = change[1]
+            if change[0] == "take card from stack":
+                self.pickup.pop()
+                change[2].add(card)
+            elif change[0] == "take card from hand":
+                self.pickup.pop()
+                self.hand.add(card)
+            elif change[0] == "put card onto stack":
+                change[2].remove(card)
+                self.pickup.put(card)
+            else: # Put card into hand
+                self.hand.remove(card)
+                self.pickup.put(card)
+        self._undo_log = None
+        self._defer_changes = False
+        self._changes_deferred = False
+        self._state_changed()
+
+    def _log_change(self, *change):
+        if self._undo_log is not None:
+            self._undo_log.append(change)
+
+    def find_stack_containing_cards(self, cards):
+        """
+        Try to find a stack containing exactly Card objects present in
+        the given cards list. Assume no card is present twice in the cards
+        list. Assume that for each stack, no card is present twice in
+        it.
+
+        Return the stack on success or None on failure.
+        """
+        for stack in self.stacks:
+            if len(cards) != stack.size():
+                continue
+
+            this_one = True
+            for card in cards:
+                if not stack.has_card(card):
+                    this_one = False
+                    break
+
+            if this_one:
+                return stack
+
+        return None
+
+    def get_random_empty_stack(self):
+        """
+        Return a random empty stack or None if there aren't any.
+        """
+        empty_stacks = [s for s in self.stacks if s.is_empty()]
+        if not empty_stacks:
+            return None
+        return empty_stacks[randint(0, len(empty_stacks) - 1)]
+
+    def get_state_copy(self):
+        """
+        Return a tuple representing the current state of the game. 
+
+        (
+            set of Cards in hand
+            set of *nonempty* stacks {
+                stack1 (tuple of Cards),
+                stack2 (tuple of Cards),
+                ...
+            }
+        )
+
+        Intended for use in AI.
+        """
+        hand = self.hand.get_state_copy()
+
+        stacks = set()
+        for stack in self.stacks:
+            s = stack.get_state_copy()
+            if s:
+                stacks.add(s)
+
+        return (hand, stacks)
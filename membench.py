@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Memory benchmark
+
+This file measures how much memory a headless game (see logic.GameLogic)
+takes, i.e. how many games a server (see server.py) can host at once. Many
+games are created and the memory allocated by them is measured by
+tracemalloc. The memory of the parts of a game -- the cards, the stacks, the
+hands, the deck and the pickup areas -- is reported too.
+
+Usage: python3 membench.py [-h] [-g GAMES]
+"""
+
+import gc
+import sys
+import argparse
+import tracemalloc
+
+from config import *
+from card import Card
+from logic import GameLogic
+
+def measure(make, count):
+    """
+    Call make() 'count' times, keep the results and return the number of
+    bytes allocated per call.
+    """
+    make() # Fill caches first
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = [make() for i in range(count)]
+        gc.collect()
+        allocated, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated / count
+
+def measure_parts(count):
+    """
+    Return a list of tuples (part, bytes per game) for the parts of a game.
+    The parts are measured in freshly created games, i.e. after dealing. The
+    cards are counted only once, as a part of their own.
+    """
+    games = [GameLogic.new() for i in range(count)]
+    parts = [
+        ("cards", lambda g: g.deck.get_state_copy()
+                            + list(g.hand1.get_state_copy())
+                            + list(g.hand2.get_state_copy())),
+        ("stacks", lambda g: g.stacks),
+        ("hands", lambda g: [g.hand1, g.hand2]),
+        ("pickup areas", lambda g: [g.pickup1, g.pickup2]),
+        ("deck", lambda g: g.deck),
+    ]
+    return [(name, _deep_size(get, games, name == "cards"))
+            for name, get in parts]
+
+def _deep_size(get, games, count_cards):
+    """
+    Return the mean size of the objects (and everything they refer to) given
+    by get(game) for the given games. Strings of colors and ranks are shared
+    by all games and not counted, cards only if 'count_cards' is True.
+    """
+    shared = set()
+    for value in (COLORS, RANKS, (JOKER,)):
+        shared.update(id(v) for v in value)
+    total = 0
+    for game in games:
+        seen = set(shared)
+        stack = [get(game)]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen or obj is None or isinstance(obj, (bool, int)):
+                continue
+            if isinstance(obj, Card) and not count_cards:
+                continue
+            seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, (list, tuple, set)):
+                stack.extend(obj)
+            elif isinstance(obj, dict):
+                stack.extend(obj.values())
+            for name in getattr(type(obj), "__slots__", ()):
+                stack.append(getattr(obj, name, None))
+            stack.extend(getattr(obj, "__dict__", {}).values())
+    return total / len(games)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="Measure memory taken by headless games.")
+    parser.add_argument("-g", "--games", type=int, default=1000,
+                        help="number of games to create")
+    args = parser.parse_args()
+
+    per_game = measure(GameLogic.new, args.games)
+    print(f"{per_game:.0f} bytes per game "
+          + f"({1024 ** 3 / per_game:.0f} games per GiB)")
+    print()
+    for name, size in measure_parts(min(args.games, 100)):
+        print(f"{name:<14} {size:>8.0f} bytes")
@@ -9,6 +9,8 @@ see two AI opponents play against each other.
 import pygame
 
 from config import *
+import fonts
+import profiling
 
 class Menu:
     def __init__(self, screen):
@@ -33,8 +35,8 @@ class Menu:
             (width, height)
         )
 
-        medium_font = pygame.font.SysFont(FONT_NAME, MEDIUM_FONT_SIZE)
-        big_font = pygame.font.SysFont(FONT_NAME, BIG_FONT_SIZE)
+        medium_font = fonts.get_font(MEDIUM_FONT_SIZE)
+        big_font = fonts.get_font(BIG_FONT_SIZE)
         self.title_text = big_font.render(
             "Karetni hra VATIKAN",
             True,
@@ -110,6 +112,9 @@ class Menu:
         pygame.display.flip()
 
     def run(self):
+        self.draw()
+        profiling.mark("startup.time_to_menu")
+
         clock = pygame.time.Clock()
         while True:
             for event in pygame.event.get():
@@ -0,0 +1,189 @@
+"""
+Flat Monte Carlo AI
+
+This file contains an AI which, unlike the greedy AI from the ai module, takes
+into account the future of the game -- what the opponent may hold, what
+remains in the deck and whether holding cards back would pay off.
+
+The AI considers a set of candidate plans for the current turn (see
+MonteCarlo.candidate_plans()). It then repeatedly picks a plan using the UCB1
+rule, samples the hidden cards (the opponent's hand and the order of the deck)
+from the cards it hasn't seen (determinization) and plays the game out for a
+few turns on the headless engine with both players playing greedily. The plan
+visited most often wins.
+
+The search is flat: UCB1 runs only over the plans of the current turn, there
+is no tree below them. The later turns of a playout are always greedy.
+
+A turn is limited by a time budget, a number of playouts and optionally a
+rate of playouts (see MonteCarlo), so latency can be traded against strength
+and the CPU the AI takes can be capped, e.g. on a server hosting many games.
+"""
+
+import time
+import math
+import random
+
+from config import *
+from engine import Position
+import ai
+import profiling
+
+
+class MonteCarlo:
+    def __init__(self, time_budget=MONTE_CARLO_TIME_BUDGET,
+                 max_playouts=MONTE_CARLO_MAX_PLAYOUTS,
+                 playout_rate=MONTE_CARLO_PLAYOUT_RATE,
+                 playout_turns=MONTE_CARLO_PLAYOUT_TURNS,
+                 exploration=MONTE_CARLO_EXPLORATION, seed=None):
+        """
+        time_budget ... seconds to spend on one turn
+        max_playouts ... maximum number of playouts in one turn
+        playout_rate ... maximum number of playouts per second, 0 for no limit.
+                         The search waits between playouts when it's ahead
+                         of the rate
+        playout_turns ... number of turns after which a playout is stopped and
+                          evaluated by the sizes of the hands
+        exploration ... the exploration constant of UCB1
+        """
+        self.time_budget = time_budget
+        self.max_playouts = max_playouts
+        self.playout_rate = playout_rate
+        self.playout_turns = playout_turns
+        self.exploration = exploration
+        self.random = random.Random(seed)
+
+        # Statistics of the last call of choose_moves()
+        self.stats = {}
+
+    def candidate_plans(self, match):
+        """
+        Return a list of candidate plans (lists of moves) for the player on
+        turn of the given match (class Match). The candidates are
+        - the plan of the greedy AI and all its prefixes (holding back cards,
+          including not placing anything at all)
+        - greedy continuations of all first moves (see ai.root_moves())
+        Plans leading to the same position are considered only once and
+        plans are cut at the first move the position rejects.
+        """
+        position = Position(set(match.hand()), set(match.stacks))
+
+        plans = []
+        seen = set()
+
+        def consider(plan):
+            for i, move in enumerate(plan):
+                if not position.apply(move):
+                    plan = plan[:i]
+                    break
+            key = position.key()
+            position.undo_to(0)
+            if key not in seen:
+                seen.add(key)
+                plans.append(plan)
+
+        greedy = ai.greedy_moves(position)
+        position.undo_to(0)
+        for i in range(len(greedy) + 1):
+            consider(greedy[:i])
+
+        for move in ai.root_moves(position):
+            if not position.apply(move):
+                continue
+            plan = [move] + ai.greedy_moves(position)
+            position.undo_to(0)
+            consider(plan)
+
+        return plans
+
+    def determinize(self, match):
+        """
+        Return a copy of the match where the hand of the opponent of the
+        player on turn and the deck are sampled from the cards the player
+        hasn't seen.
+        """
+        match = match.copy()
+        opponent_hand = match.hand(match.opponent())
+        unseen = list(opponent_hand) + match.deck
+        self.random.shuffle(unseen)
+
+        opponent_hand.clear()
+        opponent_hand.update(unseen[:len(unseen) - len(match.deck)])
+        match.deck = unseen[len(unseen) - len(match.deck):]
+        return match
+
+    def playout(self, match, player):
+        """
+        Let both players play greedily for at most playout_turns turns. Return
+        the reward of 'player' -- 1 for a win, 0 for a loss and a number in
+        between based on the sizes of the hands if the game didn't end.
+        """
+        for i in range(self.playout_turns):
+            if match.is_over():
+                break
+            ai.greedy_moves(match.position())
+            match.end_turn()
+
+        if match.winner == player:
+            return 1.
+        if match.winner is not None:
+            return 0.
+        opponent = 2 if player == 1 else 1
+        diff = len(match.hand(opponent)) - len(match.hand(player))
+        return 0.5 + 0.5 * diff / (abs(diff) + MONTE_CARLO_HAND_DIFF_SCALE)
+
+    @profiling.timed("montecarlo.choose_moves")
+    def choose_moves(self, match):
+        """
+        Return moves (see ai.generate_moves() for the format) for the player on
+        turn of the given match (class Match). The match is left unchanged.
+        """
+        start = time.perf_counter()
+        player = match.player
+        plans = self.candidate_plans(match)
+
+        visits = [0] * len(plans)
+        rewards = [0.] * len(plans)
+        playouts = 0
+        while len(plans) > 1 and playouts < self.max_playouts:
+            elapsed = time.perf_counter() - start
+            if self.playout_rate:
+                # Wait until the rate allows another playout
+                wait = playouts / self.playout_rate - elapsed
+                if elapsed + wait >= self.time_budget:
+                    break
+                if wait > 0:
+                    time.sleep(wait)
+            elif elapsed >= self.time_budget:
+                break
+
+            # Pick a plan by UCB1, unvisited plans first
+            if playouts < len(plans):
+                i = playouts
+            else:
+                log_total = math.log(playouts)
+                i = max(range(len(plans)), key=lambda j:
+                        rewards[j] / visits[j] + self.exploration
+                        * math.sqrt(log_total / visits[j]))
+
+            sample = self.determinize(match)
+            sample.play_turn(plans[i])
+            reward = self.playout(sample, player)
+
+            visits[i] += 1
+            rewards[i] += reward
+            playouts += 1
+
+        best = max(range(len(plans)), key=lambda j: (visits[j],
+                   rewards[j] / visits[j] if visits[j] else 0.))
+
+        elapsed = time.perf_counter() - start
+        self.stats = {
+            "candidates": len(plans),
+            "playouts": playouts,
+            "seconds": elapsed,
+            "playouts_per_second": playouts / elapsed if elapsed else 0.,
+            "expected_reward": rewards[best] / visits[best] if visits[best] \
+                else None,
+        }
+        return plans[best]
@@ -0,0 +1,194 @@
+"""
+Position notation
+
+This file contains a compact text notation of positions, so that positions
+from logs and bug reports can be fed back to the AI (see analyze.py). A
+position takes a single line:
+
+    <hand> / <stacks> / <number of cards in the deck>
+
+A card is written as a letter of its color (h, c, s, d) followed by its rank
+(2-9, T, J, Q, K, A), e.g. "hT" is the ten of hearts, a joker (see Note4 in
+__main__.py) is written as "jk". The hand is a list of
+cards separated by spaces, the stacks are such lists separated by commas.
+Board cards which aren't frozen yet (see Note3 in __main__.py) are followed
+by "*". For example:
+
+    hA sK / h2 h3 h4, sJ cJ dJ* / 40
+
+Moves (see ai.generate_moves() for the format) are written in the same
+notation, separated by semicolons:
+
+    hA > h2 h3 h4; new s5 s6 s7 from s4 s5 s6 s7; rearrange h2 h3 h4, ...
+"""
+
+from config import *
+from card import Card
+from engine import Match, normalize_stack
+import util
+
+COLOR_LETTERS = {"heart": "h", "clover": "c", "spade": "s", "diamond": "d"}
+RANK_LETTERS = {rank: rank for rank in RANKS}
+RANK_LETTERS["10"] = "T"
+
+# Card notation -> (color, rank)
+_CARDS = {
+    COLOR_LETTERS[color] + RANK_LETTERS[rank]: (color, rank)
+    for color in COLORS
+    for rank in RANKS
+}
+JOKER_TEXT = "jk"
+_CARDS[JOKER_TEXT] = (JOKER, JOKER)
+
+def card_to_text(card):
+    if card.is_joker():
+        return JOKER_TEXT
+    return COLOR_LETTERS[card.color] + RANK_LETTERS[card.rank]
+
+def _copies():
+    """
+    Return a list of the numbers of copies of cards in the game indexed by
+    card codes (see util.card_code())
+    """
+    copies = [2] * (len(COLORS) * len(RANKS))
+    copies.append(NUM_JOKERS if JOKERS else 0)
+    return copies
+
+def parse_card(text):
+    """
+    Make a new Card out of its notation. A trailing "*" makes the card not
+    frozen, otherwise it's frozen.
+    """
+    frozen = not text.endswith("*")
+    if not frozen:
+        text = text[:-1]
+    if text not in _CARDS:
+        raise ValueError(f"Unknown card '{text}'")
+    card = Card(*_CARDS[text])
+    if frozen:
+        card.freeze()
+    return card
+
+def cards_to_text(cards, frozen_flags=False):
+    """
+    Write a hand or a stack. If 'frozen_flags' is True, cards not frozen are
+    marked by "*".
+    """
+    return " ".join([card_to_text(c)
+                     + ("*" if frozen_flags and not c.is_frozen() else "")
+                     for c in cards])
+
+def stacks_to_text(stacks, frozen_flags=False):
+    return ", ".join([cards_to_text(util.sorted_by_flush(s), frozen_flags)
+                      for s in stacks if s])
+
+def position_to_text(hand, stacks, deck_size, frozen_flags=True):
+    """
+    Write a position given the cards in hand, the stacks (sequences of Cards)
+    and the number of cards in the deck. If 'frozen_flags' is False, all
+    board cards are written as frozen.
+    """
+    hand = sorted(hand, key=util.card_code)
+    stacks = sorted([s for s in stacks if s],
+                    key=lambda s: util.card_code(util.sorted_by_flush(s)[0]))
+    return f"{cards_to_text(hand)} / {stacks_to_text(stacks, frozen_flags)} " \
+        + f"/ {deck_size}"
+
+def parse_position(line):
+    """
+    Read a position written by position_to_text().
+
+    Returns a tuple (set of Cards in hand, list of stacks (tuples of Cards),
+    number of cards in the deck). Raises ValueError if the line isn't a valid
+    position.
+    """
+    parts = line.split("/")
+    if len(parts) != 3:
+        raise ValueError("A position has three parts separated by '/'")
+    hand_text, stacks_text, deck_text = parts
+
+    hand = set()
+    for text in hand_text.split():
+        card = parse_card(text)
+        if not card.is_frozen():
+            raise ValueError(f"Card '{text}' in hand can't be marked by '*'")
+        hand.add(card)
+
+    stacks = []
+    for stack_text in stacks_text.split(","):
+        cards = [parse_card(text) for text in stack_text.split()]
+        if not cards:
+            if stack_text.strip() or "," in stacks_text:
+                raise ValueError("Empty stack")
+            continue
+        stack = util.attempt_construct_valid_stack(cards)
+        if stack is None or None in stack:
+            raise ValueError(f"Invalid stack '{stack_text.strip()}'")
+        stacks.append(stack)
+
+    try:
+        deck_size = int(deck_text)
+    except ValueError:
+        raise ValueError("Invalid number of cards in the deck "
+                         + f"'{deck_text.strip()}'") from None
+
+    copies = _copies()
+    counts = [0] * len(copies)
+    for card in list(hand) + [c for s in stacks for c in s]:
+        counts[util.card_code(card)] += 1
+    if counts[-1] > copies[-1]:
+        raise ValueError(f"There are only {copies[-1]} jokers")
+    if max(counts[:-1]) > 2:
+        raise ValueError("There are only two copies of each card")
+    if not 0 <= deck_size <= sum(copies) - sum(counts):
+        raise ValueError(f"Invalid number of cards in the deck {deck_size}")
+    return hand, stacks, deck_size
+
+def match_to_text(match):
+    """
+    Write the position of the player on turn of the given match (class
+    Match). Matches work with whole turns, so all board cards are frozen.
+    """
+    return position_to_text(match.hand(), match.stacks, len(match.deck),
+                            False)
+
+def match_from_text(line):
+    """
+    Make a match (class Match) out of a position written by position_to_text()
+    with the player 1 on turn. The cards not in the position are dealt to the
+    deck (as many as the position says) and to the hand of the opponent in
+    the order of their codes, so the match is only one of the games
+    consistent with what the player sees.
+    """
+    hand, stacks, deck_size = parse_position(line)
+    counts = _copies()
+    for card in list(hand) + [c for s in stacks for c in s]:
+        counts[util.card_code(card)] -= 1
+    unseen = []
+    for code, n in enumerate(counts):
+        for i in range(n):
+            unseen.append(util.card_from_code(code, i))
+    deck = unseen[:deck_size]
+    opponent_hand = set(unseen[deck_size:])
+    return Match([hand, opponent_hand],
+                 set([normalize_stack(s) for s in stacks]), deck)
+
+def move_to_text(move):
+    if move[0] == "add card to stack":
+        return f"{card_to_text(move[1])} > " \
+            + cards_to_text(util.sorted_by_flush(move[2]))
+    if move[0] == "rearrange board":
+        return "rearrange " + stacks_to_text(move[1:])
+    text = "new " + cards_to_text(util.sorted_by_flush(move[1]))
+    if len(move) > 2:
+        text += " from " + stacks_to_text(move[2:])
+    return text
+
+def moves_to_text(moves):
+    """
+    Write moves (see ai.generate_moves() for the format), "-" if there are
+    none.
+    """
+    if not moves:
+        return "-"
+    return "; ".join([move_to_text(m) for m in moves])
@@ -0,0 +1,115 @@
+"""
+Pondering
+
+This file contains the pondering of the AI -- thinking about its next turn
+while the human opponent is still playing theirs. The AI can't know how the
+human's turn ends, so it guesses the likely boards at its end:
+- the human places nothing and just draws a card
+- the human plays the moves the greedy AI would (see ai.greedy_moves())
+- the human ends the turn now, whenever the board is valid during the turn
+Its moves for each of them are computed in a background thread and cached by
+the state the AI is going to see (see state_key()). When its turn comes and
+the state was guessed right, the AI plays the pondered moves at once.
+Otherwise the work is thrown away and the AI thinks as usual.
+
+The Ponderer has its own strategy object, so it never shares the analysis
+(see the analysis module) with the strategy playing in the main thread.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import *
+from engine import Position
+from strategies import make_strategy
+import ai
+
+def state_key(match):
+    """
+    Return the key of the state of the match the player on turn sees -- the
+    hash of their position (see Position.get_hash()), the number of cards in
+    the deck and in the hand of the opponent.
+    """
+    position = Position(set(match.hand()), set(match.stacks))
+    return (position.get_hash(), len(match.deck),
+            len(match.hand(match.opponent())))
+
+class Ponderer:
+    def __init__(self, strategy_name, cache_size=PONDER_CACHE_SIZE):
+        """
+        strategy_name ... the strategy of the AI (see strategies.STRATEGIES)
+        """
+        self._strategy = make_strategy(strategy_name)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._cache_size = cache_size
+        # State key -> Future of (moves, stats). Least recently used first
+        self._futures = OrderedDict()
+
+        # Statistics of the last call of take()
+        self.stats = {}
+
+    def ponder_turn(self, match):
+        """
+        Start pondering the guesses of how the turn of the opponent (on turn
+        in the given match, which has just started) ends. The match is left
+        unchanged.
+        """
+        drawn = match.copy()
+        drawn.end_turn(draw=True)
+        self.ponder(drawn)
+
+        played = match.copy()
+        if ai.greedy_moves(played.position()):
+            played.end_turn()
+            self.ponder(played)
+
+    def ponder(self, match):
+        """
+        Start computing the moves for the player on turn of the given match
+        unless they are cached or already being computed. The match is handed
+        over to the background thread, so it mustn't be used afterwards.
+        """
+        if match.is_over():
+            return
+        key = state_key(match)
+        if key in self._futures:
+            self._futures.move_to_end(key)
+            return
+        self._futures[key] = self._executor.submit(self._compute, match)
+        while len(self._futures) > self._cache_size:
+            key, future = self._futures.popitem(last=False)
+            future.cancel()
+
+    def take(self, match):
+        """
+        Return the pondered moves for the player on turn of the given match
+        or None if its state wasn't guessed. Waits for the moves if they are
+        still being computed. The rest of the pondering is thrown away.
+        """
+        future = self._futures.pop(state_key(match), None)
+        self.clear()
+        self.stats = {}
+        if future is None or future.cancelled():
+            return None
+        moves, stats = future.result()
+
+        # Different copies of the same cards have the same key. Check that
+        # the moves use the cards of this match
+        position = Position(set(match.hand()), set(match.stacks))
+        if not all([position.apply(move) for move in moves]):
+            return None
+        self.stats = dict(stats)
+        return moves
+
+    def clear(self):
+        """
+        Throw away all pondering. Computations which haven't started yet are
+        cancelled.
+        """
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    def _compute(self, match):
+        moves = self._strategy.choose_moves(match)
+        return moves, self._strategy.stats
@@ -0,0 +1,209 @@
+"""
+Profiling
+
+This file contains the opt-in instrumentation layer. It is able to
+- Time functions and blocks of code (per call and per frame)
+- Count calls of hot functions
+- Measure the time of startup (see mark())
+- Dump the collected data as CSV or JSON
+- Draw the collected data onto the screen as an overlay
+
+Profiling is enabled by setting PROFILING in config.py or by setting the
+VATIKAN_PROFILE environment variable. When it is disabled, the decorators
+return the decorated functions unchanged and timer() returns a shared no-op
+context manager so the instrumented code runs as if it wasn't instrumented.
+"""
+
+import os
+import time
+import json
+import csv
+import atexit
+
+from config import *
+
+# Imported first by __main__.py, so this is roughly when the program started
+START_TIME = time.perf_counter()
+
+ENABLED = PROFILING or bool(os.environ.get("VATIKAN_PROFILE"))
+
+# name -> [number of calls, total seconds, max seconds]
+_stats = {}
+# name -> seconds spent in the current frame
+_frame = {}
+# name -> seconds spent in the last finished frame
+_last_frame = {}
+_frames = 0
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def record(name, seconds):
+    """
+    Record that something called 'name' took 'seconds' seconds.
+    """
+    stat = _stats.get(name)
+    if stat is None:
+        stat = _stats[name] = [0, 0., 0.]
+    stat[0] += 1
+    stat[1] += seconds
+    if seconds > stat[2]:
+        stat[2] = seconds
+    _frame[name] = _frame.get(name, 0.) + seconds
+
+def timer(name):
+    """
+    Return a context manager timing the block of code inside the 'with'
+    statement.
+    """
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name)
+
+def timed(name):
+    """
+    Decorator timing each call of the decorated function.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """
+    Count 'n' occurrences of something called 'name' (e.g. blits).
+    """
+    if not ENABLED:
+        return
+    stat = _stats.get(name)
+    if stat is None:
+        stat = _stats[name] = [0, 0., 0.]
+    stat[0] += n
+
+def counted(name):
+    """
+    Decorator counting calls of the decorated function. Doesn't measure time
+    since the counted functions are typically too cheap for that.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        def wrapper(*args, **kwargs):
+            count(name)
+            return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+def mark(name, since=None):
+    """
+    Record the time elapsed since 'since' (a time.perf_counter() value, by
+    default the start of the program). Used to measure startup.
+    """
+    if not ENABLED:
+        return
+    if since is None:
+        since = START_TIME
+    record(name, time.perf_counter() - since)
+
+def end_frame():
+    """
+    Mark the end of a frame. Called from the main game loop.
+    """
+    global _frame, _last_frame, _frames
+    if not ENABLED:
+        return
+    _last_frame = _frame
+    _frame = {}
+    _frames += 1
+
+def get_stats():
+    """
+    Return the collected data as a list of dicts sorted by name.
+    """
+    result = []
+    for name in sorted(_stats):
+        count, total, maximum = _stats[name]
+        result.append({
+            "name": name,
+            "calls": count,
+            "total_ms": total * 1000,
+            "mean_ms": total * 1000 / count if count else 0.,
+            "max_ms": maximum * 1000,
+            "per_frame_ms": total * 1000 / _frames if _frames else 0.,
+        })
+    return result
+
+def dump(path=None):
+    """
+    Write the collected data into a file. The format is chosen by the file
+    extension (.csv or .json).
+    """
+    if path is None:
+        path = PROFILING_OUTPUT_FILE
+    stats = get_stats()
+    with open(path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            fields = ["name", "calls", "total_ms", "mean_ms", "max_ms",
+                      "per_frame_ms"]
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(stats)
+        else:
+            json.dump({"frames": _frames, "stats": stats}, f, indent=2)
+
+def draw_overlay(surface, font):
+    """
+    Draw times measured in the last frame and call counts onto the surface.
+    """
+    lines = [f"frame {_frames}"]
+    for name in sorted(_stats):
+        count, total, maximum = _stats[name]
+        if total:
+            lines.append(f"{name}: {_last_frame.get(name, 0.) * 1000:.2f} ms "
+                         + f"(max {maximum * 1000:.2f} ms)")
+        else:
+            lines.append(f"{name}: {count} calls")
+
+    y = 0
+    for line in lines:
+        text = font.render(line, True, TEXT_COLOR, PROFILING_OVERLAY_BG_COLOR)
+        surface.blit(text, (surface.get_width() - text.get_width(), y))
+        y += text.get_height()
+
+if ENABLED:
+    atexit.register(dump)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+Game server
+
+This file contains an asyncio server hosting many headless games (see
+logic.GameLogic) at once. Clients connect over TCP and exchange JSON objects,
+one per line.
+
+Each request has an "id" (echoed in the response) and an "action":
+- {"action": "new_game", "mode": "player_vs_player" | "player_vs_ai"}
+  Starts a game owned by the connection. The response contains its "game"
+  id, the list of "cards" ([color, rank] indexed by card ids) and the whole
+  state as a "diff". Card ids are given in a random order, so the list tells
+  nothing about the order of the deck.
+- {"action": "state", "game": ...}
+  The whole state as a "diff".
+- {"action": "take_card_from_hand", "game": ..., "card": card id}
+- {"action": "take_card_from_stack", "game": ..., "card": card id,
+   "stack": stack index}
+- {"action": "put_card_onto_stack", "game": ..., "stack": stack index}
+- {"action": "put_card_into_hand", "game": ...}
+- {"action": "end_turn", "game": ...}
+  Map to the try_* methods of GameLogic. The response has "ok" set to the
+  result and contains the "diff" of the state.
+- {"action": "close_game", "game": ...}
+
+Failed requests get a response with "ok": false and an "error" message.
+
+The state consists of "stacks" (lists of card ids), "hand1", "hand2",
+"pickup1", "pickup2" (a card id or null), "deck" (number of cards), "player",
+"winner" and "valid" (whether the turn can end). The hand of the AI is hidden,
+in player_vs_ai there's "hand2_size" (number of cards) instead of "hand2". A
+diff contains only the parts which changed since the last message about the
+game, changed stacks are given as an object {stack index (as a string): card
+ids}.
+
+AI turns are played in a pool of processes so they never block the event
+loop. When an AI turn is over, the server pushes {"event": "update", "game":
+..., "diff": ...} to the owner of the game. If an AI turn fails, the game is
+closed and the server pushes {"event": "error", "game": ..., "error": ...}.
+
+Usage: python3 server.py [-h] [--host HOST] [--port PORT] [-w WORKERS]
+"""
+
+import json
+import random
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from config import *
+from engine import Match, encode_move, decode_move
+from logic import GameLogic
+from strategies import make_strategy, init_worker_process
+import ai
+import gamelog
+
+MODES = {
+    "player_vs_player": PLAYER_VS_PLAYER,
+    "player_vs_ai": PLAYER_VS_AI,
+}
+
+# Strategies of a worker process by name (see _play_ai_turn())
+_worker_strategies = {}
+
+def _play_ai_turn(name, match, cards):
+    """
+    Let the strategy of the given name choose moves in a worker process.
+    'cards' are the cards of the game indexed by ids. They come pickled
+    together with the match so the moves can be returned encoded by the ids
+    (see encode_move()).
+    """
+    strategy = _worker_strategies.get(name)
+    if strategy is None:
+        strategy = _worker_strategies[name] = make_strategy(name)
+    moves = strategy.choose_moves(match)
+    return [encode_move(m, cards) for m in moves]
+
+
+class RequestError(Exception):
+    pass
+
+
+class HostedGame:
+    def __init__(self, game_id, gamemode, writer):
+        """
+        game_id ... id of the game on the server
+        gamemode ... PLAYER_VS_PLAYER or PLAYER_VS_AI
+        writer ... asyncio.StreamWriter of the connection owning the game
+        """
+        self.id = game_id
+        self.logic = GameLogic.new(gamemode)
+        self.writer = writer
+        self.thinking = False # An AI turn is being played
+
+        logic = self.logic
+        self.cards = logic.deck.get_state_copy() \
+            + list(logic.hand1.get_state_copy()) \
+            + list(logic.hand2.get_state_copy())
+        # Ids must not follow the order of the deck, the client gets the table
+        random.shuffle(self.cards)
+        self.ids = {card: i for i, card in enumerate(self.cards)}
+
+        # The state as last sent to the client
+        self._sent = {"stacks": [None] * len(logic.stacks)}
+
+    def card(self, card_id):
+        if not isinstance(card_id, int) or not 0 <= card_id < len(self.cards):
+            raise RequestError(f"unknown card {card_id}")
+        return self.cards[card_id]
+
+    def stack(self, index):
+        stacks = self.logic.stacks
+        if not isinstance(index, int) or not 0 <= index < len(stacks):
+            raise RequestError(f"unknown stack {index}")
+        return stacks[index]
+
+    def get_state(self):
+        logic = self.logic
+        ids = self.ids
+
+        def pickup_id(pickup):
+            return ids[pickup.get()] if pickup.has_card() else None
+
+        state = {
+            "stacks": [[ids[c] for c in s.get_state_copy()]
+                       for s in logic.stacks],
+            "hand1": sorted([ids[c] for c in logic.hand1.get_state_copy()]),
+            "pickup1": pickup_id(logic.pickup1),
+            "pickup2": pickup_id(logic.pickup2),
+            "deck": logic.deck.size(),
+            "player": logic.player,
+            "winner": logic.winner,
+            "valid": logic.board_is_valid(),
+        }
+        hand2 = logic.hand2.get_state_copy()
+        if logic.is_ai(2): # Only the size of the hand of the opponent
+            state["hand2_size"] = len(hand2)
+        else:
+            state["hand2"] = sorted([ids[c] for c in hand2])
+        return state
+
+    def diff(self):
+        """
+        Return the parts of the state which changed since the last call.
+        """
+        state = self.get_state()
+        result = {}
+        stacks = {}
+        for i, (old, new) in enumerate(zip(self._sent["stacks"],
+                                           state["stacks"])):
+            if old != new:
+                stacks[i] = new
+        if stacks:
+            result["stacks"] = stacks
+        for key, value in state.items():
+            if key != "stacks" and self._sent.get(key, -1) != value:
+                result[key] = value
+        self._sent = state
+        return result
+
+    def full_state(self):
+        self._sent = {"stacks": [None] * len(self.logic.stacks)}
+        return self.diff()
+
+
+class Server:
+    def __init__(self, ai_workers=SERVER_AI_WORKERS):
+        self.games = {} # Game id -> HostedGame
+        self._next_id = 0
+        self._executor = ProcessPoolExecutor(
+                max_workers=ai_workers if ai_workers else None,
+                initializer=init_worker_process)
+        self._tasks = set() # Running AI turns
+
+    async def handle_client(self, reader, writer):
+        """
+        Serve one connection until it's closed. Games owned by the connection
+        are closed with it.
+        """
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        request = {}
+                        raise RequestError("request must be an object")
+                    response = self.handle_request(request, writer, owned)
+                except (ValueError, RequestError) as e:
+                    response = {"ok": False, "error": str(e)}
+                response["id"] = request.get("id")
+                self._send(writer, response)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in owned:
+                self.games.pop(game_id, None)
+            writer.close()
+
+    def handle_request(self, request, writer, owned):
+        """
+        Handle a request (see the description of the protocol above) and
+        return the response.
+        """
+        action = request.get("action")
+        if action == "new_game":
+            if request.get("mode") not in MODES:
+                raise RequestError("unknown mode, use one of "
+                                   + ", ".join(MODES))
+            game = HostedGame(self._next_id, MODES[request["mode"]], writer)
+            self._next_id += 1
+            self.games[game.id] = game
+            owned.add(game.id)
+            return {
+                "ok": True,
+                "game": game.id,
+                "cards": [[c.color, c.rank] for c in game.cards],
+                "diff": game.full_state(),
+            }
+
+        game_id = request.get("game")
+        if not isinstance(game_id, (int, str)):
+            raise RequestError("unknown game")
+        game = self.games.get(game_id)
+        if game is None or game.id not in owned:
+            raise RequestError("unknown game")
+        logic = game.logic
+
+        if action == "state":
+            return {"ok": True, "game": game.id, "diff": game.full_state()}
+        if action == "close_game":
+            del self.games[game.id]
+            owned.discard(game.id)
+            return {"ok": True, "game": game.id}
+
+        if game.thinking or logic.is_ai(logic.player):
+            raise RequestError("not your turn")
+        if action == "take_card_from_hand":
+            ok = logic.try_take_card_from_hand(game.card(request.get("card")))
+        elif action == "take_card_from_stack":
+            ok = logic.try_take_card_from_stack(
+                    game.card(request.get("card")),
+                    game.stack(request.get("stack")))
+        elif action == "put_card_onto_stack":
+            ok = logic.try_put_card_onto_stack(
+                    game.stack(request.get("stack")))
+        elif action == "put_card_into_hand":
+            ok = logic.try_put_card_into_hand()
+        elif action == "end_turn":
+            ok = logic.try_end_turn()
+        else:
+            raise RequestError(f"unknown action {action}")
+
+        if logic.winner is None and logic.is_ai(logic.player):
+            game.thinking = True
+            task = asyncio.create_task(self.play_ai_turns(game))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return {"ok": ok, "game": game.id, "diff": game.diff()}
+
+    async def play_ai_turns(self, game):
+        """
+        Play turns of the AI in the worker processes while it is on turn and
+        push the changes to the owner of the game.
+        """
+        loop = asyncio.get_running_loop()
+        logic = game.logic
+        try:
+            while logic.winner is None and logic.is_ai(logic.player) \
+                    and game.id in self.games:
+                name = AI_SEAT_STRATEGIES[logic.player - 1]
+                moves = await loop.run_in_executor(
+                        self._executor, _play_ai_turn, name,
+                        Match.from_game(logic), game.cards)
+                if game.id not in self.games: # Closed in the meantime
+                    break
+                moves = [decode_move(m, game.cards) for m in moves]
+                ai.apply_moves(moves, logic)
+                self._send(game.writer, {"event": "update", "game": game.id,
+                                         "diff": game.diff()})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            # Close the game, otherwise the AI would stay on turn forever
+            self.games.pop(game.id, None)
+            gamelog.event(gamelog.game_logger, logging.ERROR, "ai_turn_failed",
+                          "AI turn in game %d failed: %r", game.id, e,
+                          game=game.id, error=repr(e))
+            self._send(game.writer, {"event": "error", "game": game.id,
+                                     "error": f"AI turn failed: {e!r}"})
+        finally:
+            game.thinking = False
+
+    def _send(self, writer, message):
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b"\n")
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+async def serve(host=SERVER_HOST, port=SERVER_PORT,
+                ai_workers=SERVER_AI_WORKERS):
+    server = Server(ai_workers)
+    tcp_server = await asyncio.start_server(server.handle_client, host, port,
+                                            limit=2 ** 20)
+    gamelog.event(gamelog.game_logger, logging.INFO, "serving",
+                  "Serving on %s:%d", host, port, host=host, port=port)
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="Host headless games over a JSON-lines protocol.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("-w", "--workers", type=int, default=SERVER_AI_WORKERS,
+                        help="processes playing AI turns, 0 for all cores")
+    args = parser.parse_args()
+    gamelog.setup()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
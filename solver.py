@@ -0,0 +1,388 @@
+"""
+Exact board-rearrangement solver
+
+This file contains a solver which, given the cards on the board and the cards
+in hand, finds a partition of all board cards and as many hand cards as
+possible into valid flushes and triplets. The rules allow rearranging the
+board freely so such a partition can be played in a single turn.
+
+Colors interact only through triplets and a triplet consists of cards of a
+single rank. So the solver is a branch and bound over the triplets, rank by
+rank, and once the triplets of a rank are decided, the rest of the cards of
+each color is partitioned into flushes on its own by a DP over the 13 cyclic
+ranks (see _best_flushes()). Only the numbers of cards matter, not which
+copy of a card goes where: a color and rank with b cards on the board, t of
+them put into a triplet and f into flushes has to have t + f >= b and uses
+t + f - b cards from hand.
+
+The bound of a branch is the sum of the best flushes of each color where the
+cards of the undecided ranks may go to flushes or freely to triplets (every
+hand card of such a rank counts as used). A branch is cut off when its bound
+doesn't beat the best partition found so far. When the cards the flushes
+leave out at the undecided ranks happen to form valid triplets, the bound is
+reached and the branch is done. Otherwise the search branches on a rank where
+they don't, trying the triplets closest to the left out cards first.
+"""
+
+import time
+import functools
+import itertools
+
+from config import *
+import util
+
+NUM_RANKS = len(RANKS)
+NUM_COLORS = len(COLORS)
+
+# Longest flush crossing the rank where the DP of a color starts. A longer
+# flush can always be cut into two valid flushes so that the crossing part is
+# at most this long
+MAX_CROSSING_LENGTH = 5
+
+# Worth of a card used in a flush. Cards of undecided ranks are worth 1 so
+# that among the best flushes the DP picks the ones leaving out the fewest of
+# them (see _search())
+WORTH = 32
+
+
+class SolverTimeout(Exception):
+    pass
+
+
+def _triplet_options(available):
+    """
+    Return all ways of putting cards of one rank into triplets given the
+    numbers of available cards of each color -- tuples of numbers of cards
+    taken per color. Bigger triplets go first so that good partitions are
+    found early.
+    """
+    options = []
+    for taken in itertools.product(*[range(n + 1) for n in available]):
+        size = sum(taken)
+        if size == 0 or size in (3, 4) and max(taken) == 1 \
+                or 6 <= size <= 8:
+            options.append(taken)
+    options.sort(key=sum, reverse=True)
+    return options
+
+def _make_transitions():
+    """
+    Return the transitions of the DP of _linear_flushes() -- a dict
+    (lengths of open flushes, number of cards of the next rank) -> list of
+    (new lengths, sources, closed). Lengths are capped at 3 and sorted,
+    sources tell for each new open flush the index of the open flush it
+    extends (-1 for a new flush) and closed are the indices of the open
+    flushes which get closed.
+    """
+    states = [()]
+    transitions = {}
+    while states:
+        lengths = states.pop()
+        for f in range(3):
+            result = transitions[(lengths, f)] = []
+            for mask in range(1 << len(lengths)):
+                extended = [j for j in range(len(lengths)) if mask & (1 << j)]
+                closed = [j for j in range(len(lengths)) if j not in extended]
+                if len(extended) > f or any([lengths[j] < 3 for j in closed]):
+                    continue
+                new_open = [(min(lengths[j] + 1, 3), j) for j in extended]
+                new_open += [(1, -1)] * (f - len(extended))
+                new_open.sort(key=lambda x: x[0])
+                new_lengths = tuple([length for length, j in new_open])
+                result.append((new_lengths, tuple([j for l, j in new_open]),
+                               tuple(closed)))
+                if (new_lengths, 0) not in transitions \
+                        and new_lengths not in states:
+                    states.append(new_lengths)
+    return transitions
+
+_TRANSITIONS = _make_transitions()
+
+def _linear_flushes(lo, hi, w, order):
+    """
+    Partition cards of one color of the ranks in the given order (not
+    wrapping around) into flushes of 3 or more cards. At least lo[r] and at
+    most hi[r] (at most 2) cards of rank r have to be used, each card of rank
+    r is worth w[r].
+
+    Returns a tuple (value, list of flushes (lists of ranks)) or None if there
+    is no such partition.
+    """
+    # Lengths of open flushes (see _make_transitions()) -> (value, tuple of
+    # the positions in the order where the open flushes start, closed
+    # flushes as a linked list of (first position, last position, rest))
+    layer = {(): (0, (), None)}
+    for i, rank in enumerate(order):
+        new_layer = {}
+        for lengths, (value, starts, closed) in layer.items():
+            for f in range(lo[rank], hi[rank] + 1):
+                new_value = value + f * w[rank]
+                for new_lengths, sources, closes in _TRANSITIONS[(lengths, f)]:
+                    old = new_layer.get(new_lengths)
+                    if old is not None and old[0] >= new_value:
+                        continue
+                    new_closed = closed
+                    for j in closes:
+                        new_closed = (starts[j], i - 1, new_closed)
+                    new_layer[new_lengths] = (
+                        new_value,
+                        tuple([i if j < 0 else starts[j] for j in sources]),
+                        new_closed)
+        layer = new_layer
+
+    best = None
+    for lengths, (value, starts, closed) in layer.items():
+        if all([length >= 3 for length in lengths]) \
+                and (best is None or best[0] < value):
+            for start in starts:
+                closed = (start, len(order) - 1, closed)
+            best = (value, closed)
+    if best is None:
+        return None
+    value, closed = best
+    flushes = []
+    while closed is not None:
+        first, last, closed = closed
+        flushes.append([order[i] for i in range(first, last + 1)])
+    return value, flushes
+
+def _crossing_flushes(start):
+    """
+    Return all flushes (tuples of ranks) of at most MAX_CROSSING_LENGTH cards
+    containing the rank before 'start' and 'start'.
+    """
+    flushes = []
+    for length in range(3, MAX_CROSSING_LENGTH + 1):
+        for before in range(1, length):
+            flushes.append(tuple([(start - before + k) % NUM_RANKS
+                                  for k in range(length)]))
+    return flushes
+
+@functools.lru_cache(maxsize=1 << 16)
+def _best_flushes(lo, hi, w):
+    """
+    Partition cards of one color into flushes. lo, hi and w are tuples
+    indexed by ranks: at least lo[r] and at most hi[r] cards of rank r have
+    to be used and each card of rank r is worth w[r].
+
+    Returns a tuple (value, list of flushes (lists of ranks)) or None if there
+    is no such partition.
+
+    Flushes are cyclic. The DP starts at the rank where the fewest flushes can
+    cross the start, tries every set of crossing flushes and partitions the
+    rest of the cards as if the ranks didn't wrap around.
+    """
+    start = min(range(NUM_RANKS), key=lambda r: min(hi[r], hi[r - 1]))
+    order = [(start + i) % NUM_RANKS for i in range(NUM_RANKS)]
+    k_max = min(hi[start], hi[start - 1])
+
+    best = None
+    for k in range(k_max + 1):
+        for crossing in itertools.combinations_with_replacement(
+                _crossing_flushes(start), k):
+            rest_lo = list(lo)
+            rest_hi = list(hi)
+            value = 0
+            for flush in crossing:
+                for rank in flush:
+                    rest_lo[rank] = max(0, rest_lo[rank] - 1)
+                    rest_hi[rank] -= 1
+                    value += w[rank]
+            if min(rest_hi) < 0:
+                continue
+            result = _linear_flushes(rest_lo, rest_hi, w, order)
+            if result is None:
+                continue
+            if best is None or best[0] < value + result[0]:
+                best = (value + result[0],
+                        [list(f) for f in crossing] + result[1])
+    return best
+
+def solve(board, hand, at_least=0, time_limit=SOLVER_TIME_LIMIT):
+    """
+    Find a partition of all board cards and as many hand cards as possible
+    into valid stacks.
+
+    board ... iterable of Cards on the board
+    hand ... iterable of Cards in hand
+    at_least ... only look for partitions using at least this many hand cards
+                 (e.g. one more than a known solution). This is the bound of
+                 the branch and bound -- branches that can't reach it are
+                 cut off.
+    time_limit ... seconds, None for no limit
+
+    Returns a tuple (list of stacks (tuples of Cards), number of hand cards
+    used) or None if there is no such partition or the time limit was hit.
+    """
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+
+    board = list(board)
+    hand = list(hand)
+    b = [0] * (NUM_COLORS * NUM_RANKS)
+    h = [0] * (NUM_COLORS * NUM_RANKS)
+    for card in board:
+        b[util.card_code(card)] += 1
+    for card in hand:
+        h[util.card_code(card)] += 1
+    for code in range(NUM_COLORS * NUM_RANKS):
+        # There are only two copies of each card in the game
+        h[code] = min(h[code], max(0, 2 - b[code]))
+    if max(b) > 2:
+        return None
+
+    try:
+        result = _search(b, h, at_least, deadline)
+    except SolverTimeout:
+        return None
+    if result is None:
+        return None
+    value, triplets, flushes = result
+    groups = []
+    for color, color_flushes in enumerate(flushes):
+        for flush in color_flushes:
+            groups.append([(color, rank) for rank in flush])
+    for rank, taken in triplets.items():
+        groups.extend(_triplet_groups(rank, taken))
+    return _assign_cards(groups, board, hand), value
+
+def _search(b, h, at_least, deadline):
+    """
+    Run the branch and bound over the triplets. Return a tuple (number of
+    hand cards used, dict rank -> cards taken into triplets per color, list
+    of flushes of each color) or None if there is no valid partition using at
+    least 'at_least' hand cards.
+    """
+    options = []
+    for rank in range(NUM_RANKS):
+        available = [b[c * NUM_RANKS + rank] + h[c * NUM_RANKS + rank]
+                     for c in range(NUM_COLORS)]
+        options.append(_triplet_options(available))
+    option_sets = [set(o) for o in options]
+
+    # Per color: minimal and maximal numbers of cards in flushes, worth of a
+    # card in a flush and the worth of the triplets, by ranks (see
+    # set_rank())
+    lo = [[0] * NUM_RANKS for c in range(NUM_COLORS)]
+    hi = [[0] * NUM_RANKS for c in range(NUM_COLORS)]
+    w = [[0] * NUM_RANKS for c in range(NUM_COLORS)]
+    base = [[0] * NUM_RANKS for c in range(NUM_COLORS)]
+
+    def set_rank(rank, taken):
+        """
+        Decide the triplets of the rank (cards taken per color) or make the
+        rank undecided (taken is None). Cards of a color of an undecided rank
+        may go to a triplet (as many as some option takes), the rest has to
+        go to flushes. Every hand card of it counts as used unless the color
+        can't join a triplet.
+        """
+        for c in range(NUM_COLORS):
+            code = c * NUM_RANKS + rank
+            if taken is None:
+                t = max([option[c] for option in options[rank]])
+            else:
+                t = taken[c]
+            lo[c][rank] = max(0, b[code] - t)
+            hi[c][rank] = b[code] + h[code] - (0 if taken is None else t)
+            if taken is None and t > 0:
+                w[c][rank] = 1
+                base[c][rank] = h[code]
+            else:
+                w[c][rank] = WORTH
+                base[c][rank] = t - b[code]
+
+    undecided = set()
+    for rank in range(NUM_RANKS):
+        if len(options[rank]) == 1:
+            # Nothing to decide
+            set_rank(rank, options[rank][0])
+        else:
+            set_rank(rank, None)
+            undecided.add(rank)
+
+    best = [at_least - 1, None]
+    decided = {}
+
+    def branch(undecided):
+        if deadline is not None and time.perf_counter() > deadline:
+            raise SolverTimeout()
+        bound = 0
+        flushes = []
+        for c in range(NUM_COLORS):
+            result = _best_flushes(tuple(lo[c]), tuple(hi[c]), tuple(w[c]))
+            if result is None:
+                return
+            bound += sum(base[c]) + result[0] // WORTH
+            flushes.append(result[1])
+        if bound <= best[0]:
+            return
+
+        # The cards of undecided ranks left out of the flushes go to
+        # triplets. If they form valid triplets, the bound is reached
+        leftovers = {}
+        for rank in undecided:
+            leftovers[rank] = [hi[c][rank] for c in range(NUM_COLORS)]
+        for c, color_flushes in enumerate(flushes):
+            for flush in color_flushes:
+                for rank in flush:
+                    if rank in leftovers:
+                        leftovers[rank][c] -= 1
+        invalid = [rank for rank in undecided
+                   if tuple(leftovers[rank]) not in option_sets[rank]]
+        if not invalid:
+            best[0] = bound
+            triplets = dict(decided)
+            for rank in undecided:
+                if any(leftovers[rank]):
+                    triplets[rank] = tuple(leftovers[rank])
+            best[1] = (bound, triplets, flushes)
+            return
+
+        rank = min(invalid, key=lambda r: len(options[r]))
+        undecided.remove(rank)
+        # Options closest to the cards the flushes leave out go first
+        leftover = leftovers[rank]
+        for taken in sorted(options[rank], key=lambda option: sum(
+                [abs(x - y) for x, y in zip(option, leftover)])):
+            set_rank(rank, taken)
+            if any(taken):
+                decided[rank] = taken
+            branch(undecided)
+            decided.pop(rank, None)
+        undecided.add(rank)
+        set_rank(rank, None)
+
+    branch(undecided)
+    return best[1]
+
+def _triplet_groups(rank, taken):
+    """
+    Return the triplets (lists of (color, rank) index pairs) of the given
+    rank made of the given numbers of cards per color.
+    """
+    colors = [(color, n) for color, n in enumerate(taken) if n]
+    size = sum(taken)
+    if size <= 4:
+        return [[(color, rank) for color, n in colors]]
+    # Colors present twice go to both triplets, the rest is split
+    twice = [color for color, n in colors if n == 2]
+    once = [color for color, n in colors if n == 1]
+    group1 = twice + once[:max(0, 3 - len(twice))]
+    group2 = twice + once[max(0, 3 - len(twice)):]
+    return [[(color, rank) for color in group1],
+            [(color, rank) for color in group2]]
+
+def _assign_cards(groups, board, hand):
+    """
+    Turn stacks of (color, rank) index pairs into stacks of Cards. Cards from
+    the board are used first so that all of them end up in some stack.
+    """
+    pools = {}
+    for card in hand + board: # Board cards are popped first
+        pools.setdefault(util.card_code(card), []).append(card)
+
+    stacks = []
+    for group in groups:
+        cards = [pools[color * NUM_RANKS + rank].pop()
+                 for color, rank in group]
+        stacks.append(util.attempt_construct_valid_stack(cards))
+    return stacks
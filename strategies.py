@@ -0,0 +1,210 @@
+"""
+AI strategies
+
+This file contains the interface shared by all AIs of the game and its
+implementations. A strategy gets the state of the game as a Match (see the
+engine module) and returns the moves (see ai.generate_moves() for the format)
+of the player on turn. It may be given a time budget and it reports
+statistics of its last decision. Once the deck is empty and both hands are
+small, every strategy leaves the decision to the exact endgame solver (see
+endgame.py).
+
+Strategies playing the same seat for the whole game keep the analysis of
+their position between turns (see the analysis module), so each turn only
+applies what changed since their last turn.
+
+Strategies are selected by name (see STRATEGIES) -- per seat in config.py
+(AI_SEAT_STRATEGIES) and on the command line of the tournament runner (see
+tournament.py).
+"""
+
+import time
+
+from config import *
+from engine import Position
+from analysis import Analysis
+from montecarlo import MonteCarlo
+from endgame import EndgameSolver, is_endgame
+import ai
+
+
+class Strategy:
+    """
+    Base class of strategies. Subclasses implement plan().
+    """
+    name = ""
+
+    def __init__(self, time_budget=None):
+        """
+        time_budget ... seconds the strategy may spend on one turn or None for
+                        the default of the strategy. Not every strategy needs
+                        one.
+        """
+        self.time_budget = time_budget
+        self.endgame = EndgameSolver() if AI_ENDGAME else None
+        self.analysis = Analysis() # Kept between turns
+        # Statistics of the last call of choose_moves()
+        self.stats = {}
+
+    def choose_moves(self, match):
+        """
+        Return moves for the player on turn of the given match (class Match).
+        The match is left unchanged.
+        """
+        start = time.perf_counter()
+        self.stats = {}
+        moves = None
+        if self.endgame is not None and is_endgame(match):
+            moves = self.endgame.choose_moves(match)
+            self.stats.update(self.endgame.stats)
+        if moves is None:
+            moves = self.plan(match)
+        self.stats["seconds"] = time.perf_counter() - start
+        return moves
+
+    def iter_moves(self, match):
+        """
+        Generator variant of choose_moves() yielding the moves as soon as
+        they are found. The match mustn't change until the generator is
+        exhausted. Strategies which decide the whole turn at once yield the
+        moves of choose_moves().
+        """
+        yield from self.choose_moves(match)
+
+    def plan(self, match):
+        raise NotImplementedError
+
+    def _position(self, match):
+        """
+        Return a Position of the player on turn detached from the match.
+        """
+        return Position(set(match.hand()), set(match.stacks))
+
+    def _analyze(self, position):
+        """
+        Bring the analysis kept between turns up to date with the position
+        and return it (see ai.analyze()).
+        """
+        analysis = ai.analyze(position, self.analysis)
+        self.stats["analysis_changes"] = analysis.num_changes
+        return analysis
+
+
+class GreedyStrategy(Strategy):
+    """
+    The greedy AI (see ai.iter_greedy_moves()). It finds moves one by one, so
+    it stops in time if given a time budget and it can stream its moves (see
+    iter_moves()).
+    """
+    name = "greedy"
+
+    def plan(self, match):
+        return list(self._moves(match))
+
+    def iter_moves(self, match):
+        if self.endgame is not None and is_endgame(match):
+            yield from super().iter_moves(match)
+            return
+        self.stats = {"seconds": 0.}
+        start = time.perf_counter()
+        moves = self._moves(match)
+        self.stats["seconds"] += time.perf_counter() - start
+        while True:
+            # Only the time spent finding moves counts, not the time the
+            # caller spends making them
+            start = time.perf_counter()
+            move = next(moves, None)
+            self.stats["seconds"] += time.perf_counter() - start
+            if move is None:
+                return
+            yield move
+
+    def _moves(self, match):
+        deadline = None
+        if self.time_budget is not None:
+            deadline = time.perf_counter() + self.time_budget
+        position = self._position(match)
+        analysis = self._analyze(position)
+        return ai.bounded_moves(ai.iter_greedy_moves(position, analysis),
+                                deadline=deadline)
+
+
+class SearchStrategy(Strategy):
+    """
+    Greedy continuations of all first moves (see ai.search_moves()).
+    """
+    name = "search"
+
+    def plan(self, match):
+        position = self._position(match)
+        return ai.search_moves(position, self._analyze(position))
+
+
+class SolverStrategy(SearchStrategy):
+    """
+    Search, then try to beat it by rearranging the whole board using the
+    exact solver (see ai.solver_moves()). The time budget limits the solver.
+    """
+    name = "solver"
+
+    def plan(self, match):
+        moves = super().plan(match)
+        position = self._position(match)
+        placed = len(position.hand)
+        for move in moves:
+            if not position.apply(move):
+                break
+        placed -= len(position.hand)
+        position.undo_to(0)
+
+        time_limit = SOLVER_TIME_LIMIT if self.time_budget is None \
+            else self.time_budget
+        better_moves = ai.solver_moves(position, placed, time_limit)
+        self.stats["solver_used"] = better_moves is not None
+        if better_moves is not None:
+            return better_moves
+        return moves
+
+
+class MonteCarloStrategy(Strategy):
+    """
+    The flat Monte Carlo AI (see the montecarlo module).
+    """
+    name = "montecarlo"
+
+    def __init__(self, time_budget=None, seed=None):
+        super().__init__(time_budget)
+        if time_budget is None:
+            self.monte_carlo = MonteCarlo(seed=seed)
+        else:
+            self.monte_carlo = MonteCarlo(time_budget=time_budget, seed=seed)
+
+    def plan(self, match):
+        moves = self.monte_carlo.choose_moves(match)
+        self.stats.update(self.monte_carlo.stats)
+        return moves
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in (GreedyStrategy, SearchStrategy, SolverStrategy,
+                MonteCarloStrategy)
+}
+
+def make_strategy(name, **kwargs):
+    """
+    Create a strategy given its name (see STRATEGIES). Keyword arguments are
+    passed to the constructor.
+    """
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{name}', choose one of " +
+                         ", ".join(STRATEGIES))
+    return STRATEGIES[name](**kwargs)
+
+def init_worker_process():
+    """
+    Initializer of pools of processes running strategies (e.g. matches of a
+    tournament). The processes already run in parallel so the search mustn't
+    start pools of its own.
+    """
+    ai.AI_SEARCH_WORKERS = 1
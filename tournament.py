@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+Tournament runner
+
+This file plays a round-robin tournament of AI strategies (see the strategies
+module) on the headless engine. Every pair of strategies plays a number of
+seeded deals, each deal once from each seat. The matches are played in
+parallel by a pool of processes. At the end, the win rate and the mean time
+spent on a turn are reported for every strategy and every pair so that the
+strategies can be compared by their strength per millisecond.
+
+Usage: python3 tournament.py [-h] [-n GAMES] [-w WORKERS] [-s SEED]
+                             [-t TIME_BUDGET] [strategy ...]
+"""
+
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from config import *
+from engine import Match
+from strategies import STRATEGIES, make_strategy, init_worker_process
+
+def play_match(names, seed, time_budget=None, max_turns=TOURNAMENT_MAX_TURNS):
+    """
+    Play a match of the given strategies (names of player 1 and 2) on the
+    deal given by the seed.
+
+    Returns a tuple (
+        the winner (1 or 2) or None for a draw,
+        number of turns,
+        list of total seconds spent by the strategies of player 1 and 2,
+        list of numbers of turns played by player 1 and 2
+    )
+    """
+    strategies = [make_strategy(name, time_budget=time_budget)
+                  for name in names]
+    match = Match.new(seed)
+    seconds = [0., 0.]
+    turns = [0, 0]
+    while not match.is_over() and match.turn < max_turns:
+        i = match.player - 1
+        moves = strategies[i].choose_moves(match)
+        seconds[i] += strategies[i].stats["seconds"]
+        turns[i] += 1
+        match.play_turn(moves)
+    return match.winner, match.turn, seconds, turns
+
+def run_tournament(names, games=TOURNAMENT_GAMES, seed=0, time_budget=None,
+                   workers=TOURNAMENT_WORKERS):
+    """
+    Play every pair of the given strategies on 'games' deals, each deal from
+    both seats. Return a dict (name1, name2) -> list of results of
+    play_match() where name1 was player 1.
+    """
+    tasks = []
+    for name1, name2 in itertools.combinations(names, 2):
+        for game in range(games):
+            tasks.append(((name1, name2), seed + game))
+            tasks.append(((name2, name1), seed + game))
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers if workers else None,
+                             initializer=init_worker_process) as executor:
+        futures = [executor.submit(play_match, pair, s, time_budget)
+                   for pair, s in tasks]
+        for (pair, s), future in zip(tasks, futures):
+            results.setdefault(pair, []).append(future.result())
+    return results
+
+def print_report(names, results):
+    """
+    Print win rates (draws count as half a win) and mean times per turn.
+    """
+    # name -> [points, matches, seconds, turns]
+    totals = {name: [0., 0, 0., 0] for name in names}
+    # (name, opponent) -> [points, matches]
+    pairs = {}
+    for (name1, name2), matches in results.items():
+        for winner, num_turns, seconds, turns in matches:
+            for i, (name, opponent) in enumerate(((name1, name2),
+                                                  (name2, name1))):
+                points = 0.5 if winner is None else float(winner == i + 1)
+                total = totals[name]
+                total[0] += points
+                total[1] += 1
+                total[2] += seconds[i]
+                total[3] += turns[i]
+                pair = pairs.setdefault((name, opponent), [0., 0])
+                pair[0] += points
+                pair[1] += 1
+
+    print(f"{'strategy':<10} {'win rate':>8} {'ms/turn':>9} {'matches':>8}")
+    for name in sorted(names, key=lambda n: -totals[n][0] / totals[n][1]):
+        points, matches, seconds, turns = totals[name]
+        print(f"{name:<10} {points / matches:>8.3f} "
+              + f"{seconds * 1000 / turns if turns else 0.:>9.2f} "
+              + f"{matches:>8}")
+
+    print()
+    print("win rate of the row against the column")
+    print(f"{'':<10}" + "".join([f"{name:>10}" for name in names]))
+    for name in names:
+        row = f"{name:<10}"
+        for opponent in names:
+            if (name, opponent) in pairs:
+                points, matches = pairs[(name, opponent)]
+                row += f"{points / matches:>10.3f}"
+            else:
+                row += f"{'-':>10}"
+        print(row)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description="Play a round-robin tournament of AI strategies.")
+    parser.add_argument("strategies", nargs="*", default=list(STRATEGIES),
+                        help="names of the strategies (default: all of "
+                        + ", ".join(STRATEGIES) + ")")
+    parser.add_argument("-n", "--games", type=int, default=TOURNAMENT_GAMES,
+                        help="deals per pair of strategies")
+    parser.add_argument("-w", "--workers", type=int,
+                        default=TOURNAMENT_WORKERS,
+                        help="worker processes, 0 for all cores")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the first deal")
+    parser.add_argument("-t", "--time-budget", type=float, default=None,
+                        help="seconds per turn of strategies which take it")
+    args = parser.parse_args()
+
+    for name in args.strategies:
+        if name not in STRATEGIES:
+            parser.error(f"unknown strategy '{name}'")
+    if len(args.strategies) < 2:
+        parser.error("at least two strategies are needed")
+
+    results = run_tournament(args.strategies, args.games, args.seed,
+                             args.time_budget, args.workers)
+    print_report(args.strategies, results)
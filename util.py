@@ -5,9 +5,18 @@ This file contains miscellaneous functions that aren't game-logic-, ui- or ai-
 specific.
 """
 
+import functools
+
 from card import Card
 from config import *
 
+_COLOR_INDEX = {color: i for i, color in enumerate(COLORS)}
+_RANK_INDEX = {rank: i for i, rank in enumerate(RANKS)}
+
+# Code (see card_code()) shared by all jokers, it follows the codes of the
+# other cards
+JOKER_CODE = len(COLORS) * len(RANKS)
+
 def sorted_by_rank(cards):
     """
     Return the given list of cards (class Card) sorted by rank
@@ -32,23 +41,41 @@ def get_biggest_gap(cards):
             max_difference = difference
     return max_gap_i
 
+def split_jokers(cards):
+    """
+    Return a tuple (list of cards which aren't jokers, list of jokers)
+    """
+    naturals = []
+    jokers = []
+    for card in cards:
+        if card.color == JOKER:
+            jokers.append(card)
+        else:
+            naturals.append(card)
+    return naturals, jokers
+
 def is_triplet(cards):
     """
-    Return True iff cards form a triplet (see Note2 for definition)
+    Return True iff cards form a triplet (see Note2 for definition). Jokers
+    (see Note4) stand for the missing colors.
     """
     # Three or four
     if len(cards) < 3 or len(cards) > 4:
         return False
 
+    naturals, jokers = split_jokers(cards)
+    if not naturals:
+        return False
+
     # Same rank
-    rank = cards[0].rank
-    for card in cards:
+    rank = naturals[0].rank
+    for card in naturals:
         if card.rank != rank:
             return False
 
     # Different colors
     colors = []
-    for card in cards:
+    for card in naturals:
         if card.color in colors:
             return False
         else:
@@ -64,12 +91,16 @@ def attempt_construct_flush(cards):
     are multiple cards of same rank or not all cards are of the same color),
     return None.
 
+    Jokers (see Note4) take the places of the missing card markers first,
+    the remaining ones extend the flush after its last card.
+
     Returns a tuple.
     """
-    flush = sorted_by_rank(cards)
+    naturals, jokers = split_jokers(cards)
+    flush = sorted_by_rank(naturals)
 
-    # At least three cards
-    if len(flush) < 3:
+    # At least three cards, not only jokers
+    if len(cards) < 3 or not flush:
         return None
 
     # Same color
@@ -110,6 +141,14 @@ def attempt_construct_flush(cards):
         last_card = card
         result.append(card)
 
+    if jokers:
+        for i in range(len(result)):
+            if result[i] is None and jokers:
+                result[i] = jokers.pop()
+        result.extend(jokers)
+        if len(result) > len(RANKS):
+            return None
+
     return tuple(result)
 
 def attempt_construct_valid_stack(cards):
@@ -142,6 +181,245 @@ def sorted_by_flush(stack):
     else:
         return attempt_construct_flush(stack)
 
+def card_code(card):
+    """
+    Return a number from 0 to len(COLORS) * len(RANKS) - 1 identifying the
+    color and the rank of the card. Both copies of a card have the same code.
+    All jokers have the code JOKER_CODE.
+    """
+    if card.color == JOKER:
+        return JOKER_CODE
+    return _COLOR_INDEX[card.color] * len(RANKS) + _RANK_INDEX[card.rank]
+
+def card_from_code(code, copy=0):
+    """
+    Return a new Card with the given code (see card_code()). 'copy' tells
+    which copy of the card it is (see Card).
+    """
+    if code == JOKER_CODE:
+        return Card(JOKER, JOKER, copy)
+    return Card(COLORS[code // len(RANKS)], RANKS[code % len(RANKS)], copy)
+
+def accepted_codes(stack):
+    """
+    Given a valid stack sorted by util.sorted_by_flush(), return a tuple of
+    codes (see card_code()) of cards which could be added to it without
+    breaking its validity. For an invalid stack return an empty tuple.
+
+    When playing with jokers (see Note4), a stack accepts a joker exactly
+    when it accepts some other card, so JOKER_CODE comes last.
+    """
+    if len(stack) < 3:
+        return ()
+    if any([card.color == JOKER for card in stack]):
+        codes = _accepted_codes_with_jokers(stack)
+    else:
+        codes = _accepted_natural_codes(stack)
+    if JOKERS and codes:
+        codes += (JOKER_CODE,)
+    return codes
+
+def _accepted_natural_codes(stack):
+    """
+    accepted_codes() of a stack without jokers
+    """
+    first = stack[0]
+    last = stack[-1]
+    color = _COLOR_INDEX[first.color]
+    if is_triplet(stack):
+        if len(stack) == len(COLORS):
+            return ()
+        colors = set([c.color for c in stack])
+        return tuple([_COLOR_INDEX[c] * len(RANKS) + _RANK_INDEX[first.rank]
+                      for c in COLORS if c not in colors])
+
+    # A flush has all cards of one color between the first and the last card
+    lo = _RANK_INDEX[first.rank]
+    hi = _RANK_INDEX[last.rank]
+    if (hi - lo) % len(RANKS) != len(stack) - 1 or len(stack) >= len(RANKS):
+        return ()
+    for card in stack:
+        if card.color != first.color:
+            return ()
+    before = color * len(RANKS) + (lo - 1) % len(RANKS)
+    after = color * len(RANKS) + (hi + 1) % len(RANKS)
+    if before == after:
+        return (before,)
+    return (before, after)
+
+def _accepted_codes_with_jokers(stack):
+    """
+    accepted_codes() of a stack containing jokers. The stack doesn't tell
+    which cards its jokers stand for, so each card which could extend it is
+    tried using is_valid_layout() -- at most len(RANKS) + len(COLORS) checks.
+    """
+    counts = CardCounts(stack)
+    size = counts.size
+    jokers = counts.jokers
+    if not is_valid_layout(size, jokers, counts.colors, counts.ranks):
+        return ()
+    codes = []
+    if popcount(counts.colors) == 1: # May grow as a flush
+        color = counts.colors.bit_length() - 1
+        for rank in range(len(RANKS)):
+            ranks = counts.ranks | (1 << rank)
+            if ranks != counts.ranks \
+                    and is_valid_layout(size + 1, jokers, counts.colors, ranks):
+                codes.append(color * len(RANKS) + rank)
+    if popcount(counts.ranks) == 1: # May grow as a triplet
+        rank = counts.ranks.bit_length() - 1
+        for color in range(len(COLORS)):
+            colors = counts.colors | (1 << color)
+            if colors != counts.colors \
+                    and is_valid_layout(size + 1, jokers, colors, counts.ranks):
+                codes.append(color * len(RANKS) + rank)
+    return tuple(sorted(set(codes)))
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+@functools.lru_cache(maxsize=None)
+def rank_mask_layout(mask):
+    """
+    Given a bitmask of ranks (bit i set for RANKS[i]), return a tuple (
+        number of missing ranks needed to turn the ranks into a cyclic
+        sequence,
+        index of the rank the sequence starts at
+    ). The biggest gap between the ranks is left outside of the sequence the
+    same way attempt_construct_flush() does it.
+    """
+    ranks = [r for r in range(len(RANKS)) if mask & (1 << r)]
+    if not ranks:
+        return 0, 0
+    max_gap_i = 0
+    max_difference = 0
+    for i in range(len(ranks)):
+        difference = (ranks[(i + 1) % len(ranks)] - ranks[i]) % len(RANKS)
+        if difference > max_difference:
+            max_gap_i = i
+            max_difference = difference
+    start = ranks[(max_gap_i + 1) % len(ranks)]
+    span = (ranks[max_gap_i] - start) % len(RANKS) + 1
+    return span - len(ranks), start
+
+def is_valid_layout(size, jokers, colors, ranks):
+    """
+    Decide whether cards form a valid stack (a flush or a triplet, see Note2)
+    given only
+        size ... number of the cards
+        jokers ... how many of them are jokers (see Note4)
+        colors ... bitmask of colors of the other cards
+        ranks ... bitmask of ranks of the other cards
+    as kept by CardCounts. An empty stack is valid. Takes O(1) time: jokers
+    don't have to be substituted one by one, in a flush they fill the gaps of
+    the rank ring (see rank_mask_layout()) and in a triplet the missing
+    colors.
+    """
+    natural = size - jokers
+    if natural == 0:
+        return size == 0
+    if popcount(colors) == 1 and popcount(ranks) == natural: # Flush-like
+        gaps, start = rank_mask_layout(ranks)
+        return 3 <= size <= len(RANKS) and gaps <= jokers
+    if popcount(ranks) == 1 and popcount(colors) == natural: # Triplet-like
+        return 3 <= size <= len(COLORS)
+    return False
+
+def is_valid_stack(cards):
+    """
+    Return True iff the cards form a valid stack (or there are none). Unlike
+    attempt_construct_valid_stack() doesn't sort the cards, it only collects
+    their bitmasks for is_valid_layout().
+    """
+    jokers = 0
+    colors = 0
+    ranks = 0
+    for card in cards:
+        if card.color == JOKER:
+            jokers += 1
+        else:
+            colors |= 1 << _COLOR_INDEX[card.color]
+            ranks |= 1 << _RANK_INDEX[card.rank]
+    return is_valid_layout(len(cards), jokers, colors, ranks)
+
+# Bits of one color in CardCounts.present and of one rank (shifted by it)
+_RANKS_MASK = (1 << len(RANKS)) - 1
+_RANK_COLUMN = sum(1 << (i * len(RANKS)) for i in range(len(COLORS)))
+
+class CardCounts:
+    """
+    Counts of cards by color and rank. Conceptually a len(COLORS) x len(RANKS)
+    matrix, stored flat and indexed by card codes (see card_code()). Also keeps
+    bitboards -- a bitmask of present cards indexed by card codes (a row of
+    len(RANKS) bits per color) and bitmasks of all present colors and ranks.
+    Jokers (see Note4) are counted under JOKER_CODE and in 'jokers', they
+    don't have a place in the bitmasks. All updates and queries take O(1)
+    time.
+
+    The counts are kept in a bytearray and the present cards in a single int
+    -- a game has one CardCounts per hand and non-empty stack.
+    """
+    __slots__ = ("counts", "present", "colors", "ranks", "jokers", "size")
+
+    def __init__(self, cards=()):
+        self.counts = bytearray(JOKER_CODE + 1)
+        self.present = 0 # Bitmask of present cards indexed by codes
+        self.colors = 0 # Bitmask of colors present
+        self.ranks = 0 # Bitmask of ranks present
+        self.jokers = 0
+        self.size = 0
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        if card.color == JOKER:
+            self.counts[JOKER_CODE] += 1
+            self.jokers += 1
+            self.size += 1
+            return
+        color = _COLOR_INDEX[card.color]
+        rank = _RANK_INDEX[card.rank]
+        code = color * len(RANKS) + rank
+        self.counts[code] += 1
+        self.present |= 1 << code
+        self.colors |= 1 << color
+        self.ranks |= 1 << rank
+        self.size += 1
+
+    def remove(self, card):
+        if card.color == JOKER:
+            self.counts[JOKER_CODE] -= 1
+            self.jokers -= 1
+            self.size -= 1
+            return
+        color = _COLOR_INDEX[card.color]
+        rank = _RANK_INDEX[card.rank]
+        code = color * len(RANKS) + rank
+        self.counts[code] -= 1
+        if not self.counts[code]:
+            present = self.present = self.present & ~(1 << code)
+            if not present >> (color * len(RANKS)) & _RANKS_MASK:
+                self.colors &= ~(1 << color)
+            if not present & (_RANK_COLUMN << rank):
+                self.ranks &= ~(1 << rank)
+        self.size -= 1
+
+    def count(self, color, rank):
+        if color == JOKER:
+            return self.jokers
+        return self.counts[_COLOR_INDEX[color] * len(RANKS) + _RANK_INDEX[rank]]
+
+    def has(self, color, rank):
+        return self.count(color, rank) > 0
+
+    def missing_colors(self, rank):
+        """
+        Return a list of colors of which there is no card of the given rank
+        """
+        present = self.present >> _RANK_INDEX[rank]
+        return [c for i, c in enumerate(COLORS)
+                if not present >> (i * len(RANKS)) & 1]
+
 def card_to_string(card):
     return str(card.color) + str(card.rank)
 
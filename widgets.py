@@ -1,34 +1,78 @@
 """
 Widgets
 
-This file contains classes which form the UI of the game. They also represent
-the state of the game.
+This file contains classes which form the UI of the game. The ones holding
+cards extend the state containers of the logic module.
 
 For example the Stack class represents a stack somewhere on the board. It
-contains some Card objects and knows whether the card sequence inside is valid.
-It also is able to draw itself onto a canvas and given a point on the screen
-answer if the point intersects any of the cards in the stack and which one.
+contains some Card objects and knows whether the card sequence inside is valid
+(see logic.StackState). It also is able to draw itself onto a canvas and given
+a point on the screen answer if the point intersects any of the cards in the
+stack and which one.
+
+Widgets are drawn in one batch (see Game.draw()). Each widget returns the
+surfaces to blit by get_blits(). The widgets holding cards render them into a
+composite surface which is cached until the cards change, so drawing a stack
+or a hand takes a single blit.
 """
 
-from random import shuffle
 import pygame
 import pygame.draw
 import pygame.transform
 
-import util
+import profiling
 from config import *
-from card import Card
-
-class Stack:
-    def __init__(self, pos, size):
+from logic import StackState, HandState, PickUpAreaState, DeckState
+
+class CardImages:
+    """
+    Images of cards. Cards themselves don't hold any (see the card module).
+    Cards not frozen yet are drawn partially transparent.
+    """
+    def __init__(self, card_imgs):
+        """
+        card_imgs ... 2d list mapping (color, rank) to pygame image objects
+                      (with jokers also (JOKER, JOKER))
+        """
+        self._imgs = {} # (color, rank, frozen) -> image
+        self._scaled = {} # (color, rank, frozen, size) -> scaled image
+        for color in card_imgs:
+            for rank in card_imgs[color]:
+                for frozen in (False, True):
+                    img = card_imgs[color][rank].copy()
+                    if frozen:
+                        img.set_alpha(255 * 1.00)
+                    else:
+                        img.set_alpha(255 * (1.00 - CARD_TRANSPARENCY))
+                    self._imgs[(color, rank, frozen)] = img
+
+    def get(self, card, size=None):
+        """
+        Return the image of the given card. If size (x, y) is given, return
+        the image scaled to it.
+        """
+        key = (card.color, card.rank, card.is_frozen())
+        if size is None:
+            return self._imgs[key]
+        scaled_key = key + (size,)
+        img = self._scaled.get(scaled_key)
+        if img is None:
+            img = pygame.transform.scale(self._imgs[key], size)
+            img.set_alpha(self._imgs[key].get_alpha())
+            self._scaled[scaled_key] = img
+        return img
+
+class Stack(StackState):
+    def __init__(self, pos, size, card_images):
         """
         pos ... (x, y) coordinates
         size ... (x, y) coordinates
+        card_images ... CardImages
         """
+        super().__init__()
+        self._card_images = card_images
         self._rect = pygame.Rect(pos, size)
-        self._cards = [] # Contains just cards, no missing markers
-        self._cards_with_missing = [] # Sorted cards, contains missing markers
-        self._is_valid = True # Is empty or contains a flush or a triplet
+        self._composite = None # Rendered stack, None when outdated
 
         # UI Invariant: At least the top 1/5 of each card should be visible
         # Also, lets assume that at least one card should be visible fully
@@ -51,82 +95,46 @@ class Stack:
             self._card_width = self._rect.w
             self._card_height = self._card_width * CARD_HEIGHT_WIDTH_RATIO
 
-    def is_empty(self):
-        return not self._cards
-
-    def size(self):
-        return len(self._cards)
-
-    def has_card(self, card):
-        return card in self._cards
-
-    def add(self, card):
-        """
-        Add a card onto the stack.
-        """
-        self._cards.append(card)
-        self.reconstruct()
-    
-    def remove(self, card):
-        """
-        Remove given card from stack.
-        """
-        self._cards.remove(card)
-        self.reconstruct()
-
-    def reconstruct(self):
-        foo = util.attempt_construct_valid_stack(self._cards)
-        self._is_valid = not (foo is None or None in foo)
-        if foo is None:
-            self._cards_with_missing = [c for c in self._cards]
-        else:
-            self._cards_with_missing = foo
-
-    def is_valid(self):
-        return self._is_valid
+    def _update(self):
+        super()._update()
+        self._composite = None
 
     def freeze(self):
-        for card in self._cards:
-            card.freeze()
+        if not self.is_frozen():
+            self._composite = None
+        super().freeze()
 
-    def is_frozen(self):
+    def get_blits(self):
         """
-        Does the stack contain only frozen cards (No new card was put in the
-        stack this turn)?
+        Return a list of (surface, position) pairs drawing the stack (see
+        pygame.Surface.blits()).
         """
-        frozen = True
-        for card in self._cards:
-            frozen &= card.is_frozen()
-        return frozen
-
-    def get_state_copy(self):
-        return tuple(self._cards)
+        if self._composite is None:
+            self._composite = self._render()
+        return [(self._composite, self._rect.topleft)]
 
     def draw(self, surface):
+        surface.blits(self.get_blits())
+
+    @profiling.timed("widgets.Stack.render")
+    def _render(self):
         # Note: card_at_point() depends on how the stack is drawn
         # When changing anything here, also check if changes shouldn't be made
         # in card_at_point()
 
-        pygame.draw.rect(surface,
-                         FG_COLOR if self._is_valid else ERR_COLOR,
-                         self._rect)
+        composite = pygame.Surface(self._rect.size)
+        composite.fill(FG_COLOR if self._is_valid else ERR_COLOR)
 
         a = self._card_height / 5
+        size = (self._card_width, self._card_height)
 
-        for i, card in enumerate(self._cards_with_missing):
+        blits = []
+        for i, card in enumerate(self.get_cards_with_missing()):
             if card is None: # Skip "missing card" markers
                 continue
-
-            img = card.img
-            card_surface = pygame.transform.scale(
-                img,
-                (self._card_width, self._card_height)
-            )
-            pos = (
-                self._rect.x,
-                self._rect.y + a * i
-            )
-            surface.blit(card_surface, pos)
+            blits.append((self._card_images.get(card, size), (0, a * i)))
+        composite.blits(blits, doreturn=False)
+        return composite
 
     def collidepoint(self, pos):
         return self._rect.collidepoint(pos)
@@ -141,7 +149,8 @@ class Stack:
         # When changing anything here, also check if changes shouldn't be made
         # in draw()
 
-        card_num = len(self._cards_with_missing)
+        cards_with_missing = self.get_cards_with_missing()
+        card_num = len(cards_with_missing)
 
         x = pos[0]
         y = pos[1]
@@ -160,26 +169,30 @@ class Stack:
         if i < 0 or i >= card_num:
             return None
         else:
-            card = self._cards_with_missing[i]
+            card = cards_with_missing[i]
             while card is None: # "missing card" marker
                 i -= 1
                 assert i >= 0
-                card = self._cards_with_missing[i]
+                card = cards_with_missing[i]
             return card
 
-class Hand:
-    def __init__(self, pos, size, hide_cards, deck_img=None):
+class Hand(HandState):
+    def __init__(self, pos, size, card_images, hide_cards, deck_img=None):
         """
         pos ... (x, y) coordinates
         size ... (x, y) coordinates
+        card_images ... CardImages
         hide_cards ... if cards should be visible or turned upside down
         deck_img ... image to show for upside down cards (card backside)
         """
+        super().__init__()
+        self._card_images = card_images
         self.hide_cards = hide_cards
         self.deck_img = deck_img
 
         self._rect = pygame.Rect(pos, size)
-        self._cards = []
+        self._highlighted = set() # Cards suggested by a hint
+        self._composite = None # Rendered hand, None when outdated
 
         self._card_height = self._rect.height
         self._card_width = self._card_height / CARD_HEIGHT_WIDTH_RATIO
@@ -196,45 +209,66 @@ class Hand:
             self._dynamic_card_width = min(self._card_width,
                                            self._rect.width / len(self._cards))
 
-    def has_card(self, card):
-        return card in self._cards
-
     def add(self, card):
-        self._cards.append(card)
+        super().add(card)
         self._update_dynamic_card_width()
+        self._composite = None
 
     def remove(self, card):
-        self._cards.remove(card)
+        super().remove(card)
         self._update_dynamic_card_width()
+        self._composite = None
 
-    def is_empty(self):
-        return len(self._cards) == 0
+    def set_highlighted(self, cards):
+        """
+        Highlight the given cards (e.g. the ones a hint suggests to play).
+        """
+        cards = set(cards)
+        if cards != self._highlighted:
+            self._highlighted = cards
+            self._composite = None
 
-    def get_state_copy(self):
-        return set(self._cards)
+    def get_blits(self):
+        """
+        Return a list of (surface, position) pairs drawing the hand (see
+        pygame.Surface.blits()).
+        """
+        if self._composite is None:
+            self._composite = self._render()
+        return [(self._composite, self._rect.topleft)]
 
     def draw(self, surface):
+        surface.blits(self.get_blits())
+
+    @profiling.timed("widgets.Hand.render")
+    def _render(self):
         # Note: card_at_point() depends on how the hand is drawn
         # When changing anything here, also check if changes shouldn't be made
         # in card_at_point()
 
-        pygame.draw.rect(surface, FG_COLOR, self._rect)
+        composite = pygame.Surface(self._rect.size)
+        composite.fill(FG_COLOR)
 
-        x = self._rect.centerx - len(self._cards) * self._dynamic_card_width / 2
+        x = self._rect.centerx - self._rect.x \
+            - len(self._cards) * self._dynamic_card_width / 2
+        size = (self._card_width, self._card_height)
+        if self.hide_cards:
+            back = pygame.transform.scale(self.deck_img, size)
 
         for card in self._cards:
-            img = self.deck_img if self.hide_cards else card.img
-            card_surface = pygame.transform.scale(
-                img,
-                (self._card_width, self._card_height)
-            )
-            pos = (
-                x,
-                self._rect.y
-            )
-            surface.blit(card_surface, pos)
+            if self.hide_cards:
+                img = back
+            else:
+                img = self._card_images.get(card, size)
+            composite.blit(img, (x, 0))
+            if card in self._highlighted:
+                rect = pygame.Rect((x, 0), (self._dynamic_card_width,
+                                            self._card_height))
+                pygame.draw.rect(composite, HINT_COLOR, rect,
+                                 HINT_BORDER_WIDTH)
 
             x += self._dynamic_card_width
+        return composite
 
     def collidepoint(self, pos):
         return self._rect.collidepoint(pos)
@@ -268,58 +302,48 @@ class Hand:
         else:
             return self._cards[i]
 
-class PickUpArea:
-    def __init__(self, pos, size):
+class PickUpArea(PickUpAreaState):
+    def __init__(self, pos, size, card_images):
         """
         pos ... (x, y) coordinates
         size ... (x, y) coordinates
+        card_images ... CardImages
         """
+        super().__init__()
+        self._card_images = card_images
         self._rect = pygame.Rect(pos, size)
-        self._card = None
-
-    def has_card(self):
-        return not self._card is None
-
-    def put(self, card):
-        self._card = card
+        self._empty_surface = pygame.Surface(size)
+        self._empty_surface.fill(FG_COLOR)
 
-    def get(self):
-        return self._card
+    def get_blits(self):
+        """
+        Return a list of (surface, position) pairs drawing the pickup area
+        (see pygame.Surface.blits()).
+        """
+        blits = [(self._empty_surface, self._rect.topleft)]
+        if self._card:
+            blits.append((self._card_images.get(self._card, self._rect.size),
+                          self._rect.topleft))
+        return blits
 
-    def pop(self):
-        card = self._card
-        self._card = None
-        return card
-    
     def draw(self, surface):
-        pygame.draw.rect(surface, FG_COLOR, self._rect)
-        if self._card:
-            card_surface = pygame.transform.scale(self._card.img,
-                                                  self._rect.size)
-            surface.blit(card_surface, self._rect.topleft)
+        surface.blits(self.get_blits())
 
-class Deck:
-    def __init__(self, pos, size, card_imgs, deck_img, font):
+class Deck(DeckState):
+    def __init__(self, pos, size, deck_img, font):
         """
         pos ... (x, y) coordinates
         size ... (x, y) coordinates
-        card_imgs ... 2d list mapping (color, rank) to pygame image objects
         deck_img ... pygame image object representing the deck
         font ... font with which to display the remaining number of cards
 
         Fill the deck with cards and shuffle it
         """
+        super().__init__()
         self._rect = pygame.Rect(pos, size)
         self._surface = pygame.transform.scale(deck_img, size)
-
-        self._cards = []
-        for color in COLORS:
-            for rank in RANKS:
-                img = card_imgs[color][rank]
-                # Each card two times
-                self._cards.append(Card(color, rank, img))
-                self._cards.append(Card(color, rank, img))
-        shuffle(self._cards)
+        self._empty_surface = pygame.Surface(size)
+        self._empty_surface.fill(FG_COLOR)
 
         self._font = font
         self._text_surface = None
@@ -335,28 +359,28 @@ class Deck:
             TEXT_COLOR
         )
 
-    def is_empty(self):
-        return not self._cards
-
     def pop(self):
-        if self._cards:
-            card = self._cards.pop()
-            self._update_text()
-            return card
-        else:
-            return None
-
-    def draw(self, surface):
-        if self._cards:
-            surface.blit(self._surface, self._rect.topleft)
-        else:
-            pygame.draw.rect(surface, FG_COLOR, self._rect)
+        card = super().pop()
+        self._update_text()
+        return card
 
+    def get_blits(self):
+        """
+        Return a list of (surface, position) pairs drawing the deck (see
+        pygame.Surface.blits()).
+        """
         pos = (
             self._rect.centerx - self._text_surface.get_width() / 2,
             self._rect.top - self._text_surface.get_height()
         )
-        surface.blit(self._text_surface, pos)
+        return [
+            (self._surface if self._cards else self._empty_surface,
+             self._rect.topleft),
+            (self._text_surface, pos),
+        ]
+
+    def draw(self, surface):
+        surface.blits(self.get_blits())
 
     def collidepoint(self, pos):
         return self._rect.collidepoint(pos)
@@ -373,6 +397,7 @@ class EndTurnButton:
         self._text_surface1 = None
         self._text_surface2 = None
         self._text_surface3 = None
+        self._surface = None # The button with the texts
         self._update_text()
 
     def _update_text(self):
@@ -395,6 +420,7 @@ class EndTurnButton:
             True,
             TEXT_COLOR
         )
+        self._render()
 
     def set_board_valid(self):
         self._board_valid = True
@@ -416,27 +442,98 @@ class EndTurnButton:
         self._player_name = player
         self._update_text()
 
-    def draw(self, surface):
-        color = FG_COLOR if self._board_valid else BG_COLOR
-        pygame.draw.rect(surface, color, self._rect)
+    def set_state(self, board_valid, card_draw_needed, player_name):
+        """
+        Set everything the button shows at once. The texts are rendered again
+        only if something changed.
+        """
+        state = (board_valid, card_draw_needed, player_name)
+        if state != (self._board_valid, self._card_draw_needed,
+                     self._player_name):
+            self._board_valid, self._card_draw_needed, self._player_name = \
+                state
+            self._update_text()
+
+    @profiling.timed("widgets.EndTurnButton.render")
+    def _render(self):
+        self._surface = pygame.Surface(self._rect.size)
+        self._surface.fill(FG_COLOR if self._board_valid else BG_COLOR)
         pos = (
-                self._rect.x,
-                self._rect.centery \
+                0,
+                self._rect.h / 2 \
                 - (self._text_surface1.get_height() +
                    self._text_surface2.get_height() +
                    self._text_surface3.get_height())
         )
-        surface.blit(self._text_surface1, pos)
+        self._surface.blit(self._text_surface1, pos)
         pos = (
                 pos[0],
                 pos[1] + self._text_surface1.get_height()
         )
-        surface.blit(self._text_surface2, pos)
+        self._surface.blit(self._text_surface2, pos)
         pos = (
                 pos[0],
                 pos[1] + self._text_surface2.get_height()
         )
-        surface.blit(self._text_surface3, pos)
+        self._surface.blit(self._text_surface3, pos)
+
+    def get_blits(self):
+        """
+        Return a list of (surface, position) pairs drawing the button (see
+        pygame.Surface.blits()).
+        """
+        return [(self._surface, self._rect.topleft)]
+
+    def draw(self, surface):
+        surface.blits(self.get_blits())
+
+    def collidepoint(self, pos):
+        return self._rect.collidepoint(pos)
+
+
+class HintButton:
+    def __init__(self, pos, size, font):
+        self._rect = pygame.Rect(pos, size)
+        self._font = font
+
+        self._text = ""
+        self._text_surface1 = None
+        self._text_surface2 = None
+        self._surface = None # The button with the texts
+        self.set_text("")
+
+    def set_text(self, text):
+        """
+        Set the line shown under the button label (e.g. the state of the hint).
+        """
+        if text == self._text and self._surface is not None:
+            return
+        self._text = text
+        self._text_surface1 = self._font.render("Napoveda", True, TEXT_COLOR)
+        self._text_surface2 = self._font.render(text, True, TEXT_COLOR)
+
+        self._surface = pygame.Surface(self._rect.size)
+        self._surface.fill(FG_COLOR)
+        pos = (
+                0,
+                self._rect.h / 2 - self._text_surface1.get_height()
+        )
+        self._surface.blit(self._text_surface1, pos)
+        pos = (
+                pos[0],
+                pos[1] + self._text_surface1.get_height()
+        )
+        self._surface.blit(self._text_surface2, pos)
+
+    def get_blits(self):
+        """
+        Return a list of (surface, position) pairs drawing the button (see
+        pygame.Surface.blits()).
+        """
+        return [(self._surface, self._rect.topleft)]
+
+    def draw(self, surface):
+        surface.blits(self.get_blits())
 
     def collidepoint(self, pos):
         return self._rect.collidepoint(pos)